@@ -0,0 +1,150 @@
+"""Micro-benchmark of the GCSObjectStreamUpload write/read buffer.
+
+Streams a synthetic file through the resumable upload machinery using a fake
+transport, so only the buffering is measured, and reports how many bytes
+were copied for every byte uploaded along with time and peak memory.
+
+    python -m benchmarks.gcs_stream_upload --total-mb 256 --write-kb 32
+"""
+
+import argparse
+import re
+import time
+import tracemalloc
+from typing import Any, Optional, Type, Union
+from unittest import mock
+
+import requests
+
+from pkg.gcs_stream_upload import GCSObjectStreamUpload
+
+CONTENT_RANGE = re.compile(
+    r"bytes (?:(?P<start>\d+)-(?P<end>\d+)|\*)/(?P<total>\d+|\*)"
+)
+
+
+class FakeUploadTransport:
+    def __init__(self) -> None:
+        self.bytes_received = 0
+        self.bytes_copied = 0
+
+    def request(self, method, url, data=None, headers=None, timeout=None):
+        response = requests.Response()
+        if method == "POST":
+            response.status_code = 200
+            response.headers["location"] = "https://fake.invalid/upload?id=1"
+            return response
+
+        if not isinstance(data, memoryview):
+            # resumable-media was handed a fresh bytes object for this chunk
+            self.bytes_copied += len(data)
+        self.bytes_received += len(data)
+
+        match = CONTENT_RANGE.match(headers["content-range"])
+        if match and match.group("total") == "*":
+            response.status_code = 308
+            response.headers["range"] = f"bytes=0-{self.bytes_received - 1}"
+        else:
+            response.status_code = 200
+            response._content = b"{}"
+        return response
+
+
+class LegacyGCSObjectStreamUpload(GCSObjectStreamUpload):
+    """The bytes concatenation buffer that GCSObjectStreamUpload used to use."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._legacy_buffer = b""
+        self.bytes_copied = 0
+
+    def write(self, data: bytes) -> int:
+        data_len = len(data)
+        self.bytes_copied += len(self._legacy_buffer) + data_len
+        self._buffer_size += data_len
+        self._legacy_buffer += data
+        while self._buffer_size >= self._chunk_size:
+            self._request and self._request.transmit_next_chunk(self._transport)
+        return data_len
+
+    def read(self, chunk_size: int) -> Union[memoryview, bytes]:
+        to_read = min(chunk_size, self._buffer_size)
+        memview = memoryview(self._legacy_buffer)
+        self._legacy_buffer = memview[to_read:].tobytes()
+        self.bytes_copied += self._buffer_size
+        self._read += to_read
+        self._buffer_size -= to_read
+        return memview[:to_read].tobytes()
+
+
+def fake_google_storage(transport: FakeUploadTransport) -> mock.MagicMock:
+    google_storage = mock.MagicMock()
+    google_storage.authorized_session.return_value = transport
+    google_storage.bucket.name = "benchmark-bucket"
+    google_storage.bucket.blob.return_value.name = "benchmark/blob.bdbx"
+    return google_storage
+
+
+def run(
+    upload_class: Type[GCSObjectStreamUpload],
+    total_bytes: int,
+    write_size: int,
+    chunk_size: int,
+) -> dict:
+    transport = FakeUploadTransport()
+    data = b"x" * write_size
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    with upload_class(
+        google_storage=fake_google_storage(transport),
+        blob_name="benchmark/blob.bdbx",
+        chunk_size=chunk_size,
+    ) as upload:
+        for _ in range(total_bytes // write_size):
+            upload.write(data)
+
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    bytes_copied: Optional[int] = getattr(upload, "bytes_copied", None)
+    if bytes_copied is None:
+        # one copy into the chunk buffer for every byte written
+        bytes_copied = total_bytes + transport.bytes_copied
+    return {
+        "seconds": elapsed,
+        "mb_per_second": total_bytes / elapsed / 1024 / 1024,
+        "copies_per_byte": bytes_copied / total_bytes,
+        "peak_mb": peak / 1024 / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--total-mb", type=int, default=128)
+    parser.add_argument("--write-kb", type=int, default=32)
+    parser.add_argument("--chunk-kb", type=int, default=2048)
+    args = parser.parse_args()
+
+    total_bytes = args.total_mb * 1024 * 1024
+    print(
+        f"Uploading {args.total_mb} MB in {args.write_kb} KB writes "
+        f"with {args.chunk_kb} KB chunks"
+    )
+    for name, upload_class in [
+        ("bytes concatenation", LegacyGCSObjectStreamUpload),
+        ("chunk buffer", GCSObjectStreamUpload),
+    ]:
+        result = run(
+            upload_class, total_bytes, args.write_kb * 1024, args.chunk_kb * 1024
+        )
+        print(
+            f"{name:>20}: {result['copies_per_byte']:.2f} bytes copied per byte, "
+            f"{result['mb_per_second']:.0f} MB/s, "
+            f"peak {result['peak_mb']:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
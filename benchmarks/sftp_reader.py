@@ -0,0 +1,202 @@
+"""Micro-benchmark of reading a file over SFTP on a high latency link.
+
+Serves a synthetic file from a local paramiko SFTP server through a proxy
+that delays every packet, then reads it back with the old prefetch/seek loop
+and with read_sftp_file, reporting throughput for each.
+
+    python -m benchmarks.sftp_reader --size-mb 32 --latency-ms 20
+
+The old loop only stays pipelined while the buffer size is a multiple of the
+SFTP request size, try --bufsize-kb 1000 to see it fall back to a round trip
+per request.
+"""
+
+import argparse
+import math
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+from typing import Callable, Iterator, List, Tuple
+
+import paramiko
+
+from pkg.config import Config
+from pkg.sftp import read_sftp_file
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark"
+
+
+class BenchmarkServer(paramiko.ServerInterface):
+    def check_auth_password(self, username: str, password: str) -> int:
+        if (username, password) == (USERNAME, PASSWORD):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username: str) -> str:
+        return "password"
+
+    def check_channel_request(self, kind: str, chanid: int) -> int:
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class BenchmarkSFTPHandle(paramiko.SFTPHandle):
+    def __init__(self, path: str, flags: int) -> None:
+        super().__init__(flags)
+        self.readfile = open(path, "rb")
+
+    def stat(self) -> paramiko.SFTPAttributes:
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class BenchmarkSFTPServer(paramiko.SFTPServerInterface):
+    """Read only view of the local filesystem."""
+
+    def open(
+        self, path: str, flags: int, attr: paramiko.SFTPAttributes
+    ) -> BenchmarkSFTPHandle:
+        return BenchmarkSFTPHandle(path, flags)
+
+    def stat(self, path: str) -> paramiko.SFTPAttributes:
+        return paramiko.SFTPAttributes.from_stat(os.stat(path))
+
+    lstat = stat
+
+
+class DelayedForwarder(threading.Thread):
+    """Forwards everything from one socket to another `latency` seconds later."""
+
+    def __init__(self, source: socket.socket, target: socket.socket, latency: float):
+        super().__init__(daemon=True)
+        self.source = source
+        self.target = target
+        self.latency = latency
+        self.pending: "queue.Queue[Tuple[float, bytes]]" = queue.Queue()
+
+    def run(self) -> None:
+        threading.Thread(target=self._deliver, daemon=True).start()
+        data = b"-"
+        while data:
+            try:
+                data = self.source.recv(65536)
+            except OSError:
+                data = b""
+            self.pending.put((time.monotonic() + self.latency, data))
+
+    def _deliver(self) -> None:
+        while True:
+            deliver_at, data = self.pending.get()
+            time.sleep(max(0.0, deliver_at - time.monotonic()))
+            try:
+                if not data:
+                    self.target.close()
+                    return
+                self.target.sendall(data)
+            except OSError:
+                return
+
+
+def connect(latency: float) -> Tuple[paramiko.SFTPClient, List[paramiko.Transport]]:
+    client_socket, client_proxy = socket.socketpair()
+    server_proxy, server_socket = socket.socketpair()
+    # half the round trip in each direction
+    DelayedForwarder(client_proxy, server_proxy, latency / 2).start()
+    DelayedForwarder(server_proxy, client_proxy, latency / 2).start()
+
+    server_transport = paramiko.Transport(server_socket)
+    server_transport.add_server_key(paramiko.RSAKey.generate(2048))
+    server_transport.set_subsystem_handler(
+        "sftp", paramiko.SFTPServer, BenchmarkSFTPServer
+    )
+    # negotiates in the background while the client connects
+    server_transport.start_server(event=threading.Event(), server=BenchmarkServer())
+
+    client_transport = paramiko.Transport(client_socket)
+    client_transport.connect(username=USERNAME, password=PASSWORD)
+    sftp_client = paramiko.SFTPClient.from_transport(client_transport)
+    assert sftp_client is not None
+    return sftp_client, [client_transport, server_transport]
+
+
+def legacy_read(
+    sftp_connection: paramiko.SFTPClient, path: str, size: int, config: Config
+) -> Iterator[bytes]:
+    """The prefetch/seek loop CaseMover.sync_file used to use."""
+    chunks = math.ceil(size / config.bufsize)
+    with sftp_connection.open(path, bufsize=config.bufsize) as sftp_file:
+        sftp_file.prefetch()
+        for chunk in range(chunks):
+            sftp_file.seek(chunk * config.bufsize)
+            yield sftp_file.read(config.bufsize)
+
+
+def run(
+    reader: Callable[..., Iterator[bytes]],
+    sftp_connection: paramiko.SFTPClient,
+    path: str,
+    config: Config,
+) -> dict:
+    size = os.path.getsize(path)
+    started = time.perf_counter()
+    bytes_read = sum(len(data) for data in reader(sftp_connection, path, size, config))
+    elapsed = time.perf_counter() - started
+    assert bytes_read == size, f"read {bytes_read} of {size} bytes"
+    return {
+        "seconds": elapsed,
+        "mb_per_second": size / elapsed / 1024 / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=32)
+    parser.add_argument("--latency-ms", type=int, default=20)
+    parser.add_argument("--bufsize-kb", type=int, default=2048)
+    parser.add_argument("--request-count", type=int, default=64)
+    parser.add_argument("--request-kb", type=int, default=32)
+    args = parser.parse_args()
+
+    config = Config(
+        bucket_name="benchmark",
+        server_park="benchmark",
+        blaise_api_url="benchmark",
+        project_id="benchmark",
+        processor_topic_name="benchmark",
+        bufsize=args.bufsize_kb * 1024,
+        sftp_request_count=args.request_count,
+        sftp_request_size=args.request_kb * 1024,
+    )
+
+    with tempfile.NamedTemporaryFile(suffix=".bdbx") as source:
+        source.write(os.urandom(args.size_mb * 1024 * 1024))
+        source.flush()
+
+        print(
+            f"Reading {args.size_mb} MB over SFTP with {args.latency_ms} ms "
+            f"round trip latency"
+        )
+        readers: List[Tuple[str, Callable[..., Iterator[bytes]]]] = [
+            ("prefetch and seek", legacy_read),
+            ("read_sftp_file", read_sftp_file),
+        ]
+        for name, reader in readers:
+            sftp_connection, transports = connect(args.latency_ms / 1000)
+            try:
+                result = run(reader, sftp_connection, source.name, config)
+            finally:
+                sftp_connection.close()
+                for transport in transports:
+                    transport.close()
+            print(
+                f"{name:>20}: {result['mb_per_second']:.1f} MB/s, "
+                f"{result['seconds']:.2f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import base64
 import logging
+import time
 
 import requests
 from google.cloud import pubsub_v1
@@ -7,22 +8,31 @@ from paramiko.ssh_exception import SSHException
 from redo import retry
 
 import cloud_functions.nisra_changes_checker
+from models import BatchProcessorEvent
 from models.configuration.blaise_config_model import BlaiseConfig
 from models.configuration.bucket_config_model import BucketConfig
 from models.configuration.notification_config_model import NotificationConfig
-from models.processor_event import ProcessorEvent
+from models.processor_event import processor_events_from_json
 from pkg.case_mover import CaseMover
 from pkg.config import Config
-from pkg.google_storage import init_google_storage
+from pkg.deadline import Deadline
+from pkg.google_storage import init_google_storage, reset_google_storage
 from pkg.sftp import SFTP, SFTPConfig
-from pkg.trigger import get_filtered_instruments, trigger_processor
-from processor import process_instrument
+from pkg.trigger import (
+    PUBLISH_BATCH_SETTINGS,
+    PUBLISHER_OPTIONS,
+    ProcessorEventPublisher,
+    TriggerCheckpoint,
+    batch_processor_events,
+    iter_filtered_instruments,
+)
+from processor import process_events
 from services.blaise_service import BlaiseService
 from services.google_bucket_service import GoogleBucketService
 from services.nisra_update_check_service import NisraUpdateCheckService
 from services.notification_service import NotificationService
 from util.service_logging import setupLogging
-from util.sftp_connection import sftp_connection
+from util.sftp_connection import pooled_sftp_connection, sftp_connection
 
 setupLogging()
 
@@ -32,7 +42,9 @@ _publisher_client = None
 def get_publisher_client():
     global _publisher_client
     if _publisher_client is None:
-        _publisher_client = pubsub_v1.PublisherClient()
+        _publisher_client = pubsub_v1.PublisherClient(
+            batch_settings=PUBLISH_BATCH_SETTINGS, publisher_options=PUBLISHER_OPTIONS
+        )
     return _publisher_client
 
 
@@ -68,13 +80,15 @@ def trigger(request):
         retry_exceptions=RETRYABLE_EXCEPTIONS,
         cleanup=retry_logger,
         args=(request,),
-        kwargs={},
+        # retries carry on from what earlier attempts found and published
+        kwargs={"checkpoint": TriggerCheckpoint()},
     )
     return "Done"
 
 
-def do_trigger(request, _content=None):
+def do_trigger(request, _content=None, checkpoint=None):
     logging.info("do_trigger called!")
+    checkpoint = checkpoint or TriggerCheckpoint()
 
     try:
         publisher_client = get_publisher_client()
@@ -104,27 +118,27 @@ def do_trigger(request, _content=None):
             sftp = SFTP(sftp_conn, sftp_config, config)
             case_mover = CaseMover(google_storage, config, sftp)
 
-            instruments = get_filtered_instruments(sftp, case_mover, survey_source_path)
             logging.info(f"Processing survey - {survey_source_path}")
+            instruments = iter_filtered_instruments(
+                sftp, case_mover, survey_source_path, checkpoint
+            )
 
-            if not instruments:
+            publisher = checkpoint.get_publisher(publisher_client, config)
+            for processor_event in batch_processor_events(instruments, config):
+                publisher.publish(processor_event)
+
+            if not publisher.published:
                 logging.info("No instrument folders found after filtering")
                 return "No instrument folders found, exiting", 200
 
-            for instrument_name, instrument in instruments.items():
-                trigger_processor(
-                    publisher_client,
-                    config,
-                    ProcessorEvent(
-                        instrument_name=instrument_name, instrument=instrument
-                    ),
-                )
+            publisher.wait()
 
         logging.info("SFTP connection closed")
         return "Done"
 
     except Exception as error:
         logging.error(f"{error.__class__.__name__}: {error}", exc_info=True)
+        reset_google_storage(error)
         raise error
 
 
@@ -136,15 +150,17 @@ def processor(*args, **kwargs):
         retry_exceptions=RETRYABLE_EXCEPTIONS,
         cleanup=retry_logger,
         args=args,
-        kwargs=kwargs,
+        # retries share the time left before the function is stopped
+        kwargs={**kwargs, "started": time.monotonic()},
     )
 
 
-def do_processor(event, _context):
+def do_processor(event, _context, started=None):
     logging.info("do_processor called!")
     try:
         config = Config.from_env()
         sftp_config = SFTPConfig.from_env()
+        deadline = Deadline.from_config(config, started)
 
         google_storage = init_google_storage(config)
         if google_storage.bucket is None:
@@ -153,32 +169,50 @@ def do_processor(event, _context):
 
         public_ip_logger()
 
-        processor_event = ProcessorEvent.from_json(
+        processor_events = processor_events_from_json(
             base64.b64decode(event["data"]).decode("utf-8")
         )
+        instrument_names = ", ".join(
+            processor_event.instrument_name for processor_event in processor_events
+        )
 
-        logging.info(f"Processing instrument: {processor_event.instrument_name}")
+        logging.info(f"Processing instrument: {instrument_names}")
         logging.info("Connecting to SFTP server")
 
-        with sftp_connection(sftp_config) as sftp_conn:
+        with pooled_sftp_connection(sftp_config) as sftp_conn:
             logging.info("Connected to SFTP server")
 
             sftp = SFTP(sftp_conn, sftp_config, config)
             case_mover = CaseMover(google_storage, config, sftp)
 
-            process_instrument(
-                case_mover, processor_event.instrument_name, processor_event.instrument
-            )
+            unfinished = process_events(case_mover, processor_events, deadline)
 
-            logging.info(
-                f"Successfully processed instrument {processor_event.instrument_name}"
-            )
+        if unfinished:
+            hand_back(config, unfinished)
+        else:
+            logging.info(f"Successfully processed instrument {instrument_names}")
 
     except Exception as error:
         logging.error(f"{error.__class__.__name__}: {error}", exc_info=True)
+        reset_google_storage(error)
         raise error
 
 
+def hand_back(config, processor_events):
+    """Send unfinished instruments back to the processor topic, to carry on
+    from the files already synced in a new invocation."""
+    logging.warning(
+        "Out of time, handing back instrument "
+        + ", ".join(event.instrument_name for event in processor_events)
+    )
+    publisher = ProcessorEventPublisher(get_publisher_client(), config)
+    if len(processor_events) == 1:
+        publisher.publish(processor_events[0])
+    else:
+        publisher.publish(BatchProcessorEvent(events=processor_events))
+    publisher.wait()
+
+
 def nisra_changes_checker(_request):
     logging.info("Running Cloud Function - nisra_changes_checker")
 
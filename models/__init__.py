@@ -1,4 +1,4 @@
 from .instruments import Instrument
-from .processor_event import ProcessorEvent
+from .processor_event import BatchProcessorEvent, ProcessorEvent
 
-__all__ = ["Instrument", "ProcessorEvent"]
+__all__ = ["BatchProcessorEvent", "Instrument", "ProcessorEvent"]
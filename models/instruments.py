@@ -4,11 +4,16 @@ from dataclasses import dataclass, field
 from typing import Dict, List, Optional
 
 
+def source_fingerprint(size: int, mtime: float) -> Dict[str, str]:
+    return {"source_size": str(size), "source_mtime": str(int(mtime))}
+
+
 @dataclass
 class Instrument:
     sftp_path: str
     bdbx_updated_at: Optional[datetime.datetime] = None
     bdbx_md5: Optional[str] = None
+    bdbx_size: Optional[int] = None
     files: List[str] = field(default_factory=list)
 
     def bdbx_file(self) -> Optional[str]:
@@ -17,6 +22,11 @@ class Instrument:
                 return f"{self.sftp_path}/{file}"
         return None
 
+    def bdbx_fingerprint(self) -> Optional[Dict[str, str]]:
+        if self.bdbx_size is None or self.bdbx_updated_at is None:
+            return None
+        return source_fingerprint(self.bdbx_size, self.bdbx_updated_at.timestamp())
+
     def get_blob_filepaths(self) -> Dict[str, str]:
         filepaths = {}
         folder_name = self.gcp_folder()
@@ -1,7 +1,7 @@
 import json
 from dataclasses import asdict, dataclass
 from datetime import date, datetime
-from typing import Any
+from typing import Any, List, Union
 
 from dacite import from_dict
 
@@ -38,3 +38,27 @@ class ProcessorEvent:
         return from_dict(
             data_class=cls, data=json.loads(json_object, object_hook=json_decode_hook)
         )
+
+
+@dataclass
+class BatchProcessorEvent:
+    events: List[ProcessorEvent]
+
+    def json(self) -> str:
+        return json.dumps(asdict(self), default=json_serialiser)
+
+    @classmethod
+    def from_json(cls, json_object: str) -> "BatchProcessorEvent":
+        return from_dict(
+            data_class=cls, data=json.loads(json_object, object_hook=json_decode_hook)
+        )
+
+
+def processor_events_from_json(json_object: str) -> List[ProcessorEvent]:
+    data = json.loads(json_object, object_hook=json_decode_hook)
+    if "events" in data:
+        return from_dict(data_class=BatchProcessorEvent, data=data).events
+    return [from_dict(data_class=ProcessorEvent, data=data)]
+
+
+AnyProcessorEvent = Union[ProcessorEvent, BatchProcessorEvent]
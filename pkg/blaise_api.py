@@ -0,0 +1,61 @@
+from typing import Any, Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from pkg.config import Config
+
+# Clients outlive a single invocation so a warm instance keeps its
+# connections to the REST API open.
+_clients: Dict[Tuple[str, str], "BlaiseApiClient"] = {}
+
+
+class BlaiseApiClient:
+    def __init__(
+        self,
+        blaise_api_url: str,
+        server_park: str,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+    ) -> None:
+        self.base_url = f"http://{blaise_api_url}/api/v2/serverparks/{server_park}"
+        self.timeout = (connect_timeout, read_timeout)
+
+        # Connection failures are retried for every method, but a POST that
+        # reached the API is never sent twice.
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.session.get(
+            f"{self.base_url}/{path}", timeout=self.timeout, **kwargs
+        )
+
+    def post(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.session.post(
+            f"{self.base_url}/{path}", timeout=self.timeout, **kwargs
+        )
+
+
+def get_blaise_api_client(config: Config) -> BlaiseApiClient:
+    key = (config.blaise_api_url, config.server_park)
+    if key not in _clients:
+        _clients[key] = BlaiseApiClient(
+            config.blaise_api_url,
+            config.server_park,
+            connect_timeout=config.blaise_api_connect_timeout,
+            read_timeout=config.blaise_api_read_timeout,
+        )
+    return _clients[key]
@@ -0,0 +1,64 @@
+import pathlib
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from pkg.google_storage import GoogleStorage
+
+
+@dataclass
+class BlobEntry:
+    name: str
+    md5: Optional[str] = None
+    size: Optional[int] = None
+    generation: Optional[int] = None
+    # when the current content was written, unlike `updated` which metadata
+    # changes move too
+    time_created: Optional[datetime] = None
+    updated: Optional[datetime] = None
+    metadata: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_blob(cls, blob: Any) -> "BlobEntry":
+        return cls(
+            name=blob.name,
+            md5=GoogleStorage.content_md5(blob),
+            size=blob.size,
+            generation=blob.generation,
+            time_created=blob.time_created,
+            updated=blob.updated,
+            metadata=dict(blob.metadata or {}),
+        )
+
+    def has_metadata(self, metadata: Dict[str, str]) -> bool:
+        return all(self.metadata.get(key) == value for key, value in metadata.items())
+
+
+@dataclass
+class BucketIndex:
+    folders: Dict[str, Dict[str, BlobEntry]] = field(default_factory=dict)
+    contents: Dict[Tuple[str, int], BlobEntry] = field(default_factory=dict)
+
+    @classmethod
+    def from_blobs(cls, blobs: Iterable[Any]) -> "BucketIndex":
+        bucket_index = cls()
+        for blob in blobs:
+            bucket_index.add(BlobEntry.from_blob(blob))
+        return bucket_index
+
+    def add(self, entry: BlobEntry) -> None:
+        path = pathlib.PurePosixPath(entry.name)
+        folder = self.folders.setdefault(path.parent.name.lower(), {})
+        folder[path.name.lower()] = entry
+        if entry.md5 and entry.size is not None:
+            self.contents[(entry.md5, entry.size)] = entry
+
+    def files(self, folder: str) -> Dict[str, BlobEntry]:
+        return self.folders.get(folder.lower(), {})
+
+    def get(self, blob_filepath: str) -> Optional[BlobEntry]:
+        path = pathlib.PurePosixPath(blob_filepath)
+        return self.files(path.parent.name).get(path.name.lower())
+
+    def find_content(self, md5: str, size: int) -> Optional[BlobEntry]:
+        return self.contents.get((md5, size))
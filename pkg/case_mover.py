@@ -1,33 +1,200 @@
 import logging
 import math
 import pathlib
-from typing import Dict, List
+import threading
+from contextlib import contextmanager
+from typing import (
+    Callable,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
+import paramiko
 import redo
 import requests
+from google.api_core import exceptions as api_exceptions
 
 from models import Instrument
+from models.instruments import source_fingerprint
+from pkg.blaise_api import BlaiseApiClient, get_blaise_api_client
+from pkg.bucket_index import BlobEntry, BucketIndex
+from pkg.checksums import StreamChecksums, UploadIntegrityError
 from pkg.config import Config
-from pkg.gcs_stream_upload import GCSObjectStreamUpload
-from pkg.google_storage import GoogleStorage
-from pkg.sftp import SFTP
+from pkg.deadline import Deadline, DeadlineExceeded
+from pkg.gcs_stream_upload import GCSObjectStreamUpload, ResumableSession
+from pkg.google_storage import (
+    BLOB_LISTING_FIELDS,
+    BUCKET_INDEX_FIELDS,
+    MAX_COMPOSE_SOURCES,
+    SOURCE_MD5_METADATA,
+    GoogleStorage,
+)
+from pkg.sftp import SFTP, map_on_sftp_channels, read_sftp_file
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+COMPOSITE_PARTS_PREFIX = "_composite_parts"
+
+# Unfinished uploads by bucket, blob and source size and modified time. Kept at
+# module level so the retry around a whole processor run resumes them too.
+_resumable_sessions: Dict[Tuple[str, str, int, float], ResumableSession] = {}
+
+# Every blob in each bucket by MD5 and size, listed once per process and shared
+# by every CaseMover, with what they upload added as they go.
+_content_indexes: Dict[str, BucketIndex] = {}
+_content_indexes_lock = threading.Lock()
+
+
+def composite_part_ranges(file_size: int, config: Config) -> List[Tuple[int, int]]:
+    parts = max(1, min(config.composite_upload_parts, MAX_COMPOSE_SOURCES))
+    # whole buffers per part, so every part but the last reads full chunks
+    part_size = max(1, math.ceil(file_size / parts / config.bufsize)) * config.bufsize
+    return [
+        (offset, min(part_size, file_size - offset))
+        for offset in range(0, file_size, part_size)
+    ]
 
 
 class CaseMover:
-    def __init__(self, google_storage: GoogleStorage, config: Config, sftp: SFTP):
+    def __init__(
+        self,
+        google_storage: GoogleStorage,
+        config: Config,
+        sftp: SFTP,
+        blaise_api: Optional[BlaiseApiClient] = None,
+    ):
         self.google_storage = google_storage
         self.config = config
         self.sftp = sftp
+        self.blaise_api = blaise_api or get_blaise_api_client(config)
+        self.bucket_index: Optional[BucketIndex] = None
+
+    def for_sftp_connection(self, sftp_connection: paramiko.SFTPClient) -> "CaseMover":
+        case_mover = CaseMover(
+            self.google_storage,
+            self.config,
+            self.sftp.for_connection(sftp_connection),
+            self.blaise_api,
+        )
+        case_mover.bucket_index = self.bucket_index
+        return case_mover
+
+    def load_bucket_index(self, prefix: Optional[str] = None) -> None:
+        self.bucket_index = BucketIndex.from_blobs(
+            self.google_storage.list_blobs(prefix=prefix, fields=BUCKET_INDEX_FIELDS)
+        )
+        logging.info(
+            f"Indexed {len(self.bucket_index.folders)} folders "
+            f"in bucket {self.google_storage.bucket_name}"
+        )
+
+    def content_index(self) -> BucketIndex:
+        """Every blob in the bucket by MD5 and size, listed on first use."""
+        bucket_name = self.google_storage.bucket_name
+        with _content_indexes_lock:
+            if bucket_name not in _content_indexes:
+                _content_indexes[bucket_name] = BucketIndex.from_blobs(
+                    self.google_storage.list_blobs(fields=BUCKET_INDEX_FIELDS)
+                )
+            return _content_indexes[bucket_name]
+
+    def iter_update_checks(
+        self, instruments: Dict[str, Instrument]
+    ) -> Iterator[Tuple[str, Instrument, bool]]:
+        """Check instruments `sftp_scan_concurrency` at a time, each on its own
+        SFTP session, yielding each with whether it needs updating as soon as
+        it has been checked, so a slow hash does not hold back the rest."""
+        workers = min(self.config.sftp_scan_concurrency, len(instruments))
+        if workers <= 1:
+            for instrument_name, instrument in instruments.items():
+                yield self.update_check(instrument_name, instrument)
+            return
+
+        yield from map_on_sftp_channels(
+            self.sftp.sftp_connection,
+            lambda channel, item: self.for_sftp_connection(channel).update_check(*item),
+            list(instruments.items()),
+            workers,
+            ordered=False,
+        )
+
+    def update_check(
+        self, instrument_name: str, instrument: Instrument
+    ) -> Tuple[str, Instrument, bool]:
+        if self.bdbx_changed(instrument):
+            return instrument_name, instrument, True
+        if self.gcp_missing_files(instrument):
+            # The processor skips a database MD5 it has already imported, but
+            # it is the other files that need syncing.
+            instrument.bdbx_md5 = None
+            return instrument_name, instrument, True
+        logging.info(
+            f"Instrument {instrument_name} has no changes to the database file, "
+            "not triggering processor..."
+        )
+        return instrument_name, instrument, False
 
     def instrument_needs_updating(self, instrument: Instrument) -> bool:
-        return self.bdbx_md5_changed(instrument) or self.gcp_missing_files(instrument)
+        return self.bdbx_changed(instrument) or self.gcp_missing_files(instrument)
+
+    def bdbx_changed(self, instrument: Instrument) -> bool:
+        if instrument.bdbx_md5:
+            return self.bdbx_md5_changed(instrument)
+
+        blob = self.get_bdbx_blob_entry(instrument)
+        if not blob:
+            return True
+
+        fingerprint = instrument.bdbx_fingerprint()
+        if fingerprint and blob.has_metadata(fingerprint):
+            logging.info(
+                f"Size and modified time of {instrument.bdbx_file()} are unchanged"
+            )
+            return False
+
+        instrument.bdbx_md5 = self.sftp.generate_bdbx_md5(instrument)
+        if instrument.bdbx_md5 != blob.md5:
+            return True
+
+        if fingerprint:
+            # Same content with a new modified time, record it so the next run
+            # can skip hashing.
+            self.google_storage.update_blob_metadata(blob.name, fingerprint)
+        return False
 
     def bdbx_md5_changed(self, instrument: Instrument) -> bool:
+        if self.bucket_index is not None:
+            blob = self.get_bdbx_blob_entry(instrument)
+            return instrument.bdbx_md5 != (blob.md5 if blob else None)
         blob_md5 = self.google_storage.get_blob_md5(instrument.get_bdbx_blob_filepath())
         return instrument.bdbx_md5 != blob_md5
 
+    def get_bdbx_blob_entry(self, instrument: Instrument) -> Optional[BlobEntry]:
+        blob_filepath = instrument.get_bdbx_blob_filepath()
+        if not blob_filepath:
+            return None
+        return self.get_blob_entry(blob_filepath)
+
+    def get_blob_entry(self, blob_filepath: str) -> Optional[BlobEntry]:
+        if self.bucket_index is not None:
+            return self.bucket_index.get(blob_filepath)
+        blob = self.google_storage.get_blob(blob_filepath)
+        return BlobEntry.from_blob(blob) if blob else None
+
     def gcp_missing_files(self, instrument: Instrument) -> bool:
-        instrument_blobs = self.get_instrument_blobs(instrument)
+        if self.bucket_index is not None:
+            instrument_blobs = list(
+                self.bucket_index.files(instrument.gcp_folder()).keys()
+            )
+        else:
+            instrument_blobs = self.get_instrument_blobs(instrument)
         for file in instrument.files:
             if file.lower() not in instrument_blobs:
                 return True
@@ -35,48 +202,164 @@ class CaseMover:
 
     def get_instrument_blobs(self, instrument: Instrument) -> List[str]:
         instrument_blobs = []
-        for blob in self.google_storage.list_blobs():
+        for blob in self.google_storage.list_blobs(
+            prefix=f"{instrument.gcp_folder()}/",
+            delimiter="/",
+            fields=BLOB_LISTING_FIELDS,
+        ):
             if pathlib.Path(blob.name).parent.name == instrument.gcp_folder():
                 instrument_blobs.append(pathlib.Path(blob.name).name.lower())
         return instrument_blobs
 
-    def sync_instrument(self, instrument: Instrument) -> None:
-        blob_filepaths = instrument.get_blob_filepaths()
-        for file in instrument.files:
-            blob_filepath = blob_filepaths[file]
+    def sync_instrument(
+        self, instrument: Instrument, deadline: Optional[Deadline] = None
+    ) -> bool:
+        """Sync the files that have changed, returning whether they all were."""
+        bdbx_file = instrument.bdbx_file()
+        transfers = []
+        bdbx_transfer = None
+        for transfer in self.changed_file_transfers(instrument):
+            if transfer[1] == bdbx_file:
+                bdbx_transfer = transfer
+            else:
+                transfers.append(transfer)
+
+        results = self.sync_files(transfers, deadline)
+        failed = [sftp_path for sftp_path, result in results.items() if not result]
+        if not bdbx_transfer:
+            return not failed
+
+        # The database file goes last, and only once everything else is in the
+        # bucket, so an interrupted sync still looks changed on the next run.
+        if failed:
+            logging.error(
+                f"Not syncing {bdbx_file} as {', '.join(failed)} failed to sync"
+            )
+            return False
+
+        return self.sync_bdbx(instrument, bdbx_transfer, deadline)
+
+    def sync_bdbx(
+        self,
+        instrument: Instrument,
+        bdbx_transfer: Tuple[str, str],
+        deadline: Optional[Deadline] = None,
+    ) -> bool:
+        checksums = self.sync_file(*bdbx_transfer, deadline=deadline)
+        if checksums is None:
+            return False
+        # a composed object has no MD5 to record if md5sum was unavailable
+        if checksums.md5_hexdigest():
+            instrument.bdbx_md5 = checksums.md5_hexdigest()
+        return True
+
+    def changed_file_transfers(self, instrument: Instrument) -> List[Tuple[str, str]]:
+        """The (blob, SFTP path) of each file that is missing from the bucket or
+        has a different size or modified time to the copy there."""
+        source_files = self.list_source_files(instrument)
+        transfers = []
+        for file, blob_filepath in instrument.get_blob_filepaths().items():
             sftp_path = f"{instrument.sftp_path}/{file}"
-            logging.info(f"Syncing file from SFTP: {sftp_path} to GCP: {blob_filepath}")
-            self.sync_file(blob_filepath, sftp_path)
+            if self.blob_matches_source(blob_filepath, source_files.get(file)):
+                logging.info(f"File {sftp_path} is unchanged, not syncing")
+            else:
+                transfers.append((blob_filepath, sftp_path))
+        return transfers
 
-    def sync_file(self, blob_filepath: str, sftp_path: str) -> None:
-        def perform_sync():
-            with GCSObjectStreamUpload(
-                google_storage=self.google_storage,
-                blob_name=blob_filepath,
-                chunk_size=self.config.bufsize,
-            ) as blob_stream:
+    def list_source_files(
+        self, instrument: Instrument
+    ) -> Dict[str, paramiko.SFTPAttributes]:
+        try:
+            return {
+                file_details.filename: file_details
+                for file_details in self.sftp.sftp_connection.listdir_attr(
+                    instrument.sftp_path
+                )
+            }
+        except IOError as e:
+            logging.warning(
+                f"Failed to list files in {instrument.sftp_path}, "
+                f"syncing them all: {e}"
+            )
+            return {}
 
-                bdbx_details = self.sftp.sftp_connection.stat(sftp_path)
-                chunks = math.ceil(bdbx_details.st_size / self.config.bufsize)
+    def blob_matches_source(
+        self, blob_filepath: str, file_details: Optional[paramiko.SFTPAttributes]
+    ) -> bool:
+        if file_details is None:
+            return False
+        blob = self.get_blob_entry(blob_filepath)
+        return (
+            blob is not None
+            and blob.size == file_details.st_size
+            and blob.has_metadata(
+                source_fingerprint(file_details.st_size, file_details.st_mtime)
+            )
+        )
 
-                with self.sftp.sftp_connection.open(
-                    sftp_path, bufsize=self.config.bufsize
-                ) as sftp_file:
+    def sync_files(
+        self, transfers: List[Tuple[str, str]], deadline: Optional[Deadline] = None
+    ) -> Dict[str, Optional[StreamChecksums]]:
+        """Raises DeadlineExceeded, once the files already started have finished,
+        if there is not enough time left to start the rest."""
+        workers = min(self.config.file_sync_concurrency, len(transfers))
+        if workers <= 1:
+            return {
+                sftp_path: self.sync_file(blob_filepath, sftp_path, deadline=deadline)
+                for blob_filepath, sftp_path in transfers
+            }
 
-                    sftp_file.prefetch()
+        results = self.map_on_sftp_channels(
+            lambda channel, transfer: self.sync_file(
+                *transfer, sftp_connection=channel, deadline=deadline
+            ),
+            transfers,
+            workers,
+        )
+        return {sftp_path: result for (_, sftp_path), result in zip(transfers, results)}
+
+    def map_on_sftp_channels(
+        self,
+        func: Callable[[paramiko.SFTPClient, T], R],
+        items: List[T],
+        workers: int,
+    ) -> List[R]:
+        return list(
+            map_on_sftp_channels(self.sftp.sftp_connection, func, items, workers)
+        )
 
-                    for chunk in range(chunks):
-                        sftp_file.seek(chunk * self.config.bufsize)
-                        blob_stream.write(sftp_file.read(self.config.bufsize))
+    def sync_file(
+        self,
+        blob_filepath: str,
+        sftp_path: str,
+        sftp_connection: Optional[paramiko.SFTPClient] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Optional[StreamChecksums]:
+        if sftp_connection is None:
+            sftp_connection = self.sftp.sftp_connection
 
         try:
-            redo.retry(
-                perform_sync,
-                retry_exceptions=(requests.exceptions.ReadTimeout,),
+            checksums = redo.retry(
+                lambda: self.upload_file(
+                    blob_filepath, sftp_path, sftp_connection, deadline
+                ),
+                retry_exceptions=(
+                    requests.exceptions.ReadTimeout,
+                    UploadIntegrityError,
+                ),
                 attempts=4,
                 max_sleeptime=0,
             )
+            logging.info(
+                f"Synced file {sftp_path} to {blob_filepath} - "
+                f"md5: {checksums.md5_hexdigest()}, "
+                f"crc32c: {checksums.crc32c_hexdigest()}"
+            )
+            self.record_content(blob_filepath, checksums)
+            return checksums
 
+        except DeadlineExceeded:
+            raise
         except FileNotFoundError:
             logging.warning(
                 f"File {sftp_path} not found on SFTP server; "
@@ -87,8 +370,260 @@ class CaseMover:
             logging.exception(
                 f"Fatal error while syncing file {sftp_path} to {blob_filepath}"
             )
+        return None
 
-    def send_request_to_api(self, instrument_name: str) -> None:
+    def upload_file(
+        self,
+        blob_filepath: str,
+        sftp_path: str,
+        sftp_connection: paramiko.SFTPClient,
+        deadline: Optional[Deadline] = None,
+    ) -> StreamChecksums:
+        """Upload one file the cheapest way its size allows."""
+        file_details = sftp_connection.stat(sftp_path)
+        copied = self.copy_duplicate(blob_filepath, sftp_path, file_details)
+        if copied:
+            return copied
+
+        if deadline:
+            with deadline.transfer(sftp_path, file_details.st_size):
+                return self.transfer_file(
+                    blob_filepath, sftp_path, sftp_connection, file_details
+                )
+        return self.transfer_file(
+            blob_filepath, sftp_path, sftp_connection, file_details
+        )
+
+    def transfer_file(
+        self,
+        blob_filepath: str,
+        sftp_path: str,
+        sftp_connection: paramiko.SFTPClient,
+        file_details: paramiko.SFTPAttributes,
+    ) -> StreamChecksums:
+        if file_details.st_size > self.config.composite_upload_threshold:
+            return self.composite_sync(blob_filepath, sftp_path, file_details)
+
+        metadata = source_fingerprint(file_details.st_size, file_details.st_mtime)
+        if file_details.st_size < self.config.multipart_upload_threshold:
+            return self.upload_in_one_request(
+                sftp_connection,
+                sftp_path,
+                file_details.st_size,
+                blob_filepath,
+                metadata=metadata,
+            )
+
+        with self.resumable_session(blob_filepath, file_details) as session:
+            return self.stream_to_blob(
+                sftp_connection,
+                sftp_path,
+                file_details.st_size,
+                blob_filepath,
+                metadata=metadata,
+                session=session,
+            )
+
+    def copy_duplicate(
+        self,
+        blob_filepath: str,
+        sftp_path: str,
+        file_details: paramiko.SFTPAttributes,
+    ) -> Optional[StreamChecksums]:
+        """Copy a blob with the same content as `sftp_path` within the bucket,
+        instead of reading it over SFTP, for files shared between instruments."""
+        if pathlib.Path(sftp_path).suffix.lower() not in self.config.dedupe_extensions:
+            return None
+        md5 = self.sftp.remote_md5(sftp_path)
+        source = md5 and self.content_index().find_content(md5, file_details.st_size)
+        # a copy of a composed object has no MD5 for GCS to check it against
+        if not md5 or not source or SOURCE_MD5_METADATA in source.metadata:
+            return None
+
+        try:
+            blob = self.google_storage.copy_blob(
+                source.name,
+                blob_filepath,
+                metadata=source_fingerprint(
+                    file_details.st_size, file_details.st_mtime
+                ),
+            )
+        except api_exceptions.NotFound:
+            logging.info(f"{source.name} has been removed, syncing {sftp_path}")
+            return None
+        if GoogleStorage.blob_md5(blob) != md5:
+            logging.warning(
+                f"{source.name} changed while being copied, syncing {sftp_path}"
+            )
+            return None
+
+        logging.info(
+            f"Copied {source.name} to {blob_filepath} as it has the same content "
+            f"as {sftp_path}"
+        )
+        return StreamChecksums.from_digests(
+            md5, GoogleStorage.blob_crc32c(blob), file_details.st_size
+        )
+
+    def record_content(self, blob_filepath: str, checksums: StreamChecksums) -> None:
+        md5 = checksums.md5_hexdigest()
+        with _content_indexes_lock:
+            content_index = _content_indexes.get(self.google_storage.bucket_name)
+            if content_index is not None and md5:
+                content_index.add(
+                    BlobEntry(name=blob_filepath, md5=md5, size=checksums.bytes_hashed)
+                )
+
+    def upload_in_one_request(
+        self,
+        sftp_connection: paramiko.SFTPClient,
+        sftp_path: str,
+        file_size: int,
+        blob_filepath: str,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> StreamChecksums:
+        """Read a small file into memory and upload it with a single request,
+        rather than the three or more a resumable upload takes."""
+        checksums = StreamChecksums()
+        chunks = []
+        for chunk in read_sftp_file(sftp_connection, sftp_path, file_size, self.config):
+            checksums.update(chunk)
+            chunks.append(chunk)
+        # the multipart upload only accepts bytes
+        self.google_storage.upload_bytes(
+            blob_filepath,
+            b"".join(chunks),
+            checksums.md5_base64(),
+            checksums.crc32c_base64(),
+            metadata=metadata,
+        )
+        return checksums
+
+    def stream_to_blob(
+        self,
+        sftp_connection: paramiko.SFTPClient,
+        sftp_path: str,
+        file_size: int,
+        blob_filepath: str,
+        metadata: Optional[Dict[str, str]] = None,
+        offset: int = 0,
+        length: Optional[int] = None,
+        session: Optional[ResumableSession] = None,
+    ) -> StreamChecksums:
+        session = session or ResumableSession()
+        with GCSObjectStreamUpload(
+            google_storage=self.google_storage,
+            blob_name=blob_filepath,
+            chunk_size=self.config.bufsize,
+            metadata=metadata,
+            session=session,
+        ) as blob_stream:
+            checksums = session.resume()
+            resumed = checksums.bytes_hashed
+            for data in read_sftp_file(
+                sftp_connection,
+                sftp_path,
+                file_size,
+                self.config,
+                offset=offset + resumed,
+                length=None if length is None else length - resumed,
+            ):
+                checksums.update(data)
+                blob_stream.write(data)
+        return checksums
+
+    @contextmanager
+    def resumable_session(
+        self, blob_filepath: str, file_details: paramiko.SFTPAttributes
+    ) -> Generator[ResumableSession, None, None]:
+        """The session to resume uploading `blob_filepath` from, if the source
+        is unchanged, which is forgotten once the upload has finished."""
+        key = (
+            self.google_storage.bucket_name,
+            blob_filepath,
+            file_details.st_size,
+            file_details.st_mtime,
+        )
+        session = _resumable_sessions.setdefault(key, ResumableSession())
+        try:
+            yield session
+        except UploadIntegrityError:
+            # the session finished with the wrong content, upload it again
+            _resumable_sessions.pop(key, None)
+            raise
+        _resumable_sessions.pop(key, None)
+
+    def composite_sync(
+        self, blob_filepath: str, sftp_path: str, file_details: paramiko.SFTPAttributes
+    ) -> StreamChecksums:
+        parts = [
+            (
+                f"{COMPOSITE_PARTS_PREFIX}/{blob_filepath}.part-{index:02d}",
+                offset,
+                length,
+            )
+            for index, (offset, length) in enumerate(
+                composite_part_ranges(file_details.st_size, self.config)
+            )
+        ]
+        part_names = [part_name for part_name, _, _ in parts]
+        logging.info(
+            f"Syncing {sftp_path} to {blob_filepath} in {len(parts)} parallel parts"
+        )
+        # GCS keeps no MD5 for composed objects and the parts' MD5s cannot be
+        # combined, so the source's is recorded alongside the fingerprint.
+        source_md5 = self.sftp.remote_md5(sftp_path)
+
+        def sync_part(
+            channel: paramiko.SFTPClient, part: Tuple[str, int, int]
+        ) -> StreamChecksums:
+            part_name, offset, length = part
+            with self.resumable_session(part_name, file_details) as session:
+                return self.stream_to_blob(
+                    channel,
+                    sftp_path,
+                    file_details.st_size,
+                    part_name,
+                    offset=offset,
+                    length=length,
+                    session=session,
+                )
+
+        try:
+            checksums = StreamChecksums.combine(
+                self.map_on_sftp_channels(sync_part, parts, len(parts))
+            )
+            blob = self.google_storage.compose_blobs(blob_filepath, part_names)
+        finally:
+            self.delete_composite_parts(part_names)
+
+        checksums.verify(
+            blob_filepath,
+            GoogleStorage.blob_md5(blob),
+            GoogleStorage.blob_crc32c(blob),
+        )
+
+        # Only recorded once the object is verified, and compose would not
+        # carry it over from the parts anyway.
+        metadata = source_fingerprint(file_details.st_size, file_details.st_mtime)
+        if source_md5:
+            metadata[SOURCE_MD5_METADATA] = source_md5
+            checksums = StreamChecksums.from_digests(
+                source_md5, checksums.crc32c_hexdigest(), checksums.bytes_hashed
+            )
+        self.google_storage.update_blob_metadata(blob_filepath, metadata)
+        return checksums
+
+    def delete_composite_parts(self, part_names: List[str]) -> None:
+        try:
+            # parts that never got uploaded are ignored
+            self.google_storage.delete_blobs(part_names, on_error=lambda _: None)
+        except Exception as e:
+            logging.warning(
+                f"Failed to delete composite upload parts {part_names}: {e}"
+            )
+
+    def send_request_to_api(self, instrument_name: str) -> bool:
 
         logging.info(
             f"Sending request to {self.config.blaise_api_url} "
@@ -96,18 +631,17 @@ class CaseMover:
         )
 
         try:
-            response = requests.post(
-                f"http://{self.config.blaise_api_url}/api/v2/serverparks/"
-                + f"{self.config.server_park}/questionnaires/{instrument_name}/data",
+            response = self.blaise_api.post(
+                f"questionnaires/{instrument_name}/data",
                 headers={"content-type": "application/json"},
                 json={"questionnaireDataPath": instrument_name},
-                timeout=30,
             )
 
             if response.status_code == 202:
                 logging.info(
                     f"Data import successfully triggered for instrument {instrument_name}"
                 )
+                return True
 
             elif response.status_code == 404:
                 logging.error(
@@ -123,20 +657,36 @@ class CaseMover:
 
         except requests.exceptions.RequestException as e:
             logging.error(f"Error connecting to REST API: {e}")
+        return False
 
     def instrument_exists_in_blaise(self, instrument_name: str) -> bool:
-        response = requests.get(
-            f"http://{self.config.blaise_api_url}/api/v2/serverparks/"
-            + f"{self.config.server_park}/questionnaires/{instrument_name}/exists"
-        )
+        response = self.blaise_api.get(f"questionnaires/{instrument_name}/exists")
         return response.json()
 
+    def get_blaise_questionnaire_names(self) -> Optional[Set[str]]:
+        try:
+            response = self.blaise_api.get("questionnaires")
+            response.raise_for_status()
+            return {questionnaire["name"].lower() for questionnaire in response.json()}
+        except (
+            requests.exceptions.RequestException,
+            ValueError,
+            KeyError,
+            TypeError,
+        ) as e:
+            logging.warning(
+                f"Failed to list questionnaires on {self.config.server_park} server park, "
+                f"checking each instrument instead: {e}"
+            )
+            return None
+
     def filter_existing_instruments(
         self, instruments: Dict[str, Instrument]
     ) -> Dict[str, Instrument]:
+        questionnaire_names = self.get_blaise_questionnaire_names()
         filtered_instruments = {}
         for key, instrument in instruments.items():
-            if self.instrument_exists_in_blaise(instrument.gcp_folder()):
+            if self.questionnaire_exists(instrument.gcp_folder(), questionnaire_names):
                 logging.info(f"Instrument {instrument.gcp_folder()} exists in blaise")
                 filtered_instruments[key] = instrument
             else:
@@ -145,3 +695,10 @@ class CaseMover:
                     "not ingesting..."
                 )
         return filtered_instruments
+
+    def questionnaire_exists(
+        self, instrument_name: str, questionnaire_names: Optional[Set[str]]
+    ) -> bool:
+        if questionnaire_names is None:
+            return self.instrument_exists_in_blaise(instrument_name)
+        return instrument_name.lower() in questionnaire_names
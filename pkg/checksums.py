@@ -0,0 +1,131 @@
+import hashlib
+from typing import Iterable, List, Optional
+
+import google_crc32c
+import pybase64
+
+# Reversed Castagnoli polynomial used by CRC32C
+CRC32C_POLYNOMIAL = 0x82F63B78
+
+
+def _gf2_matrix_times(matrix: List[int], vector: int) -> int:
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return total
+
+
+def _gf2_matrix_square(matrix: List[int]) -> List[int]:
+    return [_gf2_matrix_times(matrix, matrix[row]) for row in range(32)]
+
+
+def crc32c_combine(crc1: int, crc2: int, len2: int) -> int:
+    """CRC32C of two concatenated blocks from the CRC32C of each block.
+
+    A port of zlib's crc32_combine, which GCS uses for composite objects.
+    """
+    # operator for a single zero bit, squared twice for four zero bits
+    operator = [CRC32C_POLYNOMIAL] + [1 << row for row in range(31)]
+    operator = _gf2_matrix_square(_gf2_matrix_square(operator))
+    while len2:
+        # the first square gives the operator for one zero byte
+        operator = _gf2_matrix_square(operator)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(operator, crc1)
+        len2 >>= 1
+    return crc1 ^ crc2
+
+
+class UploadIntegrityError(Exception):
+    """The object GCS finalised does not have the content that was read."""
+
+    def __init__(
+        self, blob_name: str, checksum: str, actual: Optional[str], expected: str
+    ) -> None:
+        super().__init__(f"{blob_name} has {checksum} {actual}, expected {expected}")
+        self.blob_name = blob_name
+
+
+class StreamChecksums:
+    def __init__(self) -> None:
+        self._md5 = hashlib.md5()
+        self._md5_complete = True
+        self._md5_known: Optional[str] = None
+        self.crc32c = 0
+        self.bytes_hashed = 0
+
+    @classmethod
+    def from_digests(
+        cls, md5_hexdigest: str, crc32c_hexdigest: Optional[str], size: int
+    ) -> "StreamChecksums":
+        """Checksums of content that was never streamed, like a copied blob."""
+        checksums = cls()
+        checksums._md5_known = md5_hexdigest
+        checksums.crc32c = int(crc32c_hexdigest or "0", 16)
+        checksums.bytes_hashed = size
+        return checksums
+
+    @classmethod
+    def combine(cls, parts: Iterable["StreamChecksums"]) -> "StreamChecksums":
+        """Checksums of the parts joined end to end, the MD5 cannot be combined."""
+        combined = cls()
+        combined._md5_complete = False
+        for part in parts:
+            combined.crc32c = crc32c_combine(
+                combined.crc32c, part.crc32c, part.bytes_hashed
+            )
+            combined.bytes_hashed += part.bytes_hashed
+        return combined
+
+    def copy(self) -> "StreamChecksums":
+        copied = StreamChecksums()
+        copied._md5 = self._md5.copy()
+        copied._md5_complete = self._md5_complete
+        copied._md5_known = self._md5_known
+        copied.crc32c = self.crc32c
+        copied.bytes_hashed = self.bytes_hashed
+        return copied
+
+    def update(self, data: bytes) -> None:
+        self._md5.update(data)
+        self.crc32c = google_crc32c.extend(self.crc32c, data)
+        self.bytes_hashed += len(data)
+
+    def md5_hexdigest(self) -> Optional[str]:
+        if self._md5_known:
+            return self._md5_known
+        if not self._md5_complete:
+            return None
+        return self._md5.hexdigest()
+
+    def crc32c_hexdigest(self) -> str:
+        return f"{self.crc32c:08x}"
+
+    def verify(
+        self,
+        blob_name: str,
+        md5_hexdigest: Optional[str],
+        crc32c_hexdigest: Optional[str],
+    ) -> None:
+        """Compare with the checksums GCS reports for `blob_name`, the MD5 is
+        skipped where either side does not have one, as for composite objects."""
+        expected_md5 = self.md5_hexdigest()
+        if expected_md5 and md5_hexdigest and md5_hexdigest != expected_md5:
+            raise UploadIntegrityError(blob_name, "md5", md5_hexdigest, expected_md5)
+        if crc32c_hexdigest != self.crc32c_hexdigest():
+            raise UploadIntegrityError(
+                blob_name, "crc32c", crc32c_hexdigest, self.crc32c_hexdigest()
+            )
+
+    def md5_base64(self) -> Optional[str]:
+        md5 = self.md5_hexdigest()
+        if md5 is None:
+            return None
+        return pybase64.b64encode(bytes.fromhex(md5)).decode("utf-8")
+
+    def crc32c_base64(self) -> str:
+        return pybase64.b64encode(self.crc32c.to_bytes(4, "big")).decode("utf-8")
@@ -19,7 +19,27 @@ class Config:
     extension_list: List[str] = field(
         default_factory=lambda: [".blix", ".bdbx", ".bdix", ".bmix"]
     )
+    # files often identical between instruments, copied within the bucket
+    # when one with the same content is already there
+    dedupe_extensions: List[str] = field(default_factory=lambda: [".blix"])
     bufsize: int = field(default_factory=lambda: DEFAULT_WINDOW_SIZE)
+    sftp_request_count: int = 64
+    sftp_request_size: int = 32768
+    sftp_scan_concurrency: int = 4
+    file_sync_concurrency: int = 4
+    multipart_upload_threshold: int = 8 * 1024 * 1024
+    composite_upload_threshold: int = 1024 * 1024 * 1024
+    composite_upload_parts: int = 8
+    blaise_api_connect_timeout: float = 5
+    blaise_api_read_timeout: float = 30
+    processor_batch_bytes: int = 0
+    processor_batch_concurrency: int = 2
+    force_local_md5: bool = False
+    # seconds the processor function may run for, and how many of them to keep
+    # for handing unfinished instruments back
+    function_timeout: float = 540
+    deadline_margin: float = 30
+    expected_transfer_rate: float = 5 * 1024 * 1024
 
     @classmethod
     def from_env(cls: Type[T]) -> T:
@@ -38,6 +58,27 @@ class Config:
             bucket_name=get_from_env("NISRA_BUCKET_NAME"),
             project_id=get_from_env("PROJECT_ID"),
             processor_topic_name=get_from_env("PROCESSOR_TOPIC_NAME"),
+            force_local_md5=os.getenv("FORCE_LOCAL_MD5", "").lower() == "true",
+            sftp_request_count=int(os.getenv("SFTP_REQUEST_COUNT", "64")),
+            sftp_request_size=int(os.getenv("SFTP_REQUEST_SIZE", "32768")),
+            sftp_scan_concurrency=int(os.getenv("SFTP_SCAN_CONCURRENCY", "4")),
+            file_sync_concurrency=int(os.getenv("FILE_SYNC_CONCURRENCY", "4")),
+            multipart_upload_threshold=int(
+                os.getenv("MULTIPART_UPLOAD_THRESHOLD", str(8 * 1024 * 1024))
+            ),
+            composite_upload_threshold=int(
+                os.getenv("COMPOSITE_UPLOAD_THRESHOLD", str(1024 * 1024 * 1024))
+            ),
+            composite_upload_parts=int(os.getenv("COMPOSITE_UPLOAD_PARTS", "8")),
+            processor_batch_bytes=int(os.getenv("PROCESSOR_BATCH_BYTES", "0")),
+            processor_batch_concurrency=int(
+                os.getenv("PROCESSOR_BATCH_CONCURRENCY", "2")
+            ),
+            function_timeout=float(os.getenv("FUNCTION_TIMEOUT", "540")),
+            deadline_margin=float(os.getenv("DEADLINE_MARGIN", "30")),
+            expected_transfer_rate=float(
+                os.getenv("EXPECTED_TRANSFER_RATE", str(5 * 1024 * 1024))
+            ),
         )
 
         if missing:
@@ -0,0 +1,75 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from pkg.config import Config
+
+
+class DeadlineExceeded(Exception):
+    """Not enough of the function's time is left to start the next piece of work."""
+
+
+class Deadline:
+    """The time left before the Cloud Function is stopped.
+
+    Work is only started if it is expected to leave `margin` seconds to hand
+    the rest back. Transfers are expected to run at the rate seen so far, or
+    `transfer_rate` bytes a second until one has finished. Until something
+    has finished work is always started, so every delivery makes progress.
+    """
+
+    def __init__(
+        self,
+        timeout: float,
+        margin: float,
+        transfer_rate: float,
+        started: Optional[float] = None,
+    ) -> None:
+        self.expires = (time.monotonic() if started is None else started) + timeout
+        self.margin = margin
+        self._transfer_rate = transfer_rate
+        self._bytes_transferred = 0
+        self._seconds_transferring = 0.0
+        self._transfers = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Config, started: Optional[float] = None) -> "Deadline":
+        return cls(
+            config.function_timeout,
+            config.deadline_margin,
+            config.expected_transfer_rate,
+            started,
+        )
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    def transfer_rate(self) -> float:
+        with self._lock:
+            if self._bytes_transferred and self._seconds_transferring:
+                return self._bytes_transferred / self._seconds_transferring
+        return self._transfer_rate
+
+    def check(self, description: str, seconds: float = 0) -> None:
+        remaining = self.remaining()
+        if self._progressed() and remaining - self.margin < seconds:
+            raise DeadlineExceeded(
+                f"Not starting {description}, expected to take {seconds:.0f}s "
+                f"with {remaining:.0f}s remaining"
+            )
+
+    @contextmanager
+    def transfer(self, description: str, size: int) -> Iterator[None]:
+        self.check(description, size / self.transfer_rate())
+        started = time.monotonic()
+        yield
+        with self._lock:
+            self._bytes_transferred += size
+            self._seconds_transferring += time.monotonic() - started
+            self._transfers += 1
+
+    def _progressed(self) -> bool:
+        with self._lock:
+            return self._transfers > 0
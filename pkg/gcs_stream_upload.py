@@ -1,6 +1,10 @@
-from google.auth.transport.requests import AuthorizedSession
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Union
+
 from google.resumable_media import common, requests
 
+from pkg.checksums import StreamChecksums, UploadIntegrityError
 from pkg.google_storage import GoogleStorage
 
 # This has been taken from the blog post:
@@ -16,24 +20,73 @@ from pkg.google_storage import GoogleStorage
 #         s.write(b'x' * 1024)
 
 
+@dataclass
+class ResumableSession:
+    """An upload session that a retry can pick up from instead of byte zero.
+
+    `checksums` cover the bytes the server has confirmed, so the retry only
+    needs to read and hash what comes after them.
+    """
+
+    url: Optional[str] = None
+    checksums: StreamChecksums = field(default_factory=StreamChecksums)
+    _tracking: Optional[StreamChecksums] = field(default=None, repr=False)
+
+    @property
+    def bytes_uploaded(self) -> int:
+        return self.checksums.bytes_hashed
+
+    def resume(self) -> StreamChecksums:
+        """Checksums to carry on hashing into, kept to record progress."""
+        self._tracking = self.checksums.copy()
+        return self._tracking
+
+    def confirm(self, url: str, bytes_uploaded: int) -> None:
+        self.url = url
+        # Chunks and reads are the same size, so the hashing is normally at the
+        # byte the server has just confirmed.
+        if self._tracking and self._tracking.bytes_hashed == bytes_uploaded:
+            self.checksums = self._tracking.copy()
+
+    def verify(self, blob_name: str, uploaded_object: dict) -> None:
+        """Check the finalised object against what was hashed since `resume`."""
+        if self._tracking:
+            self._tracking.verify(
+                blob_name,
+                GoogleStorage.hexdigest(uploaded_object.get("md5Hash")),
+                GoogleStorage.hexdigest(uploaded_object.get("crc32c")),
+            )
+
+    def reset(self) -> None:
+        self.url = None
+        self.checksums = StreamChecksums()
+
+
 class GCSObjectStreamUpload(object):
     def __init__(
         self,
         google_storage: GoogleStorage,
         blob_name: str,
         chunk_size: int = 256 * 1024,
+        metadata: Optional[Dict[str, str]] = None,
+        session: Optional[ResumableSession] = None,
     ):
         self._bucket = google_storage.bucket
         self._blob = self._bucket.blob(blob_name)
+        self._metadata = metadata
+        self._session = session or ResumableSession()
 
-        self._buffer = b""
+        # A single chunk sized buffer, resumable-media is handed views of it
+        # rather than copies when it reads the next chunk to transmit.
+        self._buffer = bytearray(chunk_size)
+        self._buffer_view = memoryview(self._buffer)
         self._buffer_size = 0
         self._chunk_size = chunk_size
         self._read = 0
+        self._last_read = 0
+        self._skip = 0
 
-        self._transport = AuthorizedSession(
-            credentials=google_storage.storage_client._credentials
-        )
+        self._transport = google_storage.authorized_session()
         self._request = None  # type: ignore # type: requests.ResumableUpload
 
     def __enter__(self):
@@ -45,46 +98,135 @@ class GCSObjectStreamUpload(object):
             self.stop()
 
     def start(self):
-        url = (
-            f"https://www.googleapis.com/upload/storage/v1/b/"
-            f"{self._bucket.name}/o?uploadType=resumable"
-        )
-        self._request = requests.ResumableUpload(
-            upload_url=url, chunk_size=self._chunk_size
-        )
+        if self._session.url and self._resume():
+            return
+
+        self._session.reset()
+        self._request = self._new_request()
         self._request.initiate(
             transport=self._transport,
             content_type="application/octet-stream",
             stream=self,
             stream_final=False,
-            metadata={"name": self._blob.name},
+            metadata=self._object_metadata(),
         )
+        self._session.url = self._request.resumable_url
+
+    def _new_request(self) -> requests.ResumableUpload:
+        url = (
+            f"https://www.googleapis.com/upload/storage/v1/b/"
+            f"{self._bucket.name}/o?uploadType=resumable"
+        )
+        return requests.ResumableUpload(upload_url=url, chunk_size=self._chunk_size)
+
+    def _resume(self) -> bool:
+        request = self._new_request()
+        # Attach to the existing session, recover() asks the server how much
+        # it has and seeks this stream there.
+        request._resumable_url = self._session.url
+        request._stream = self
+        request._content_type = "application/octet-stream"
+        self._read = self._session.bytes_uploaded
+        try:
+            request.recover(self._transport)
+        except (common.InvalidResponse, ValueError) as error:
+            logging.warning(
+                f"Unable to resume upload of {self._blob.name}, "
+                f"starting again: {error}"
+            )
+            self._read = self._skip = 0
+            return False
+
+        logging.info(
+            f"Resuming upload of {self._blob.name} from byte {request.bytes_uploaded}"
+        )
+        self._request = request
+        return True
+
+    def _object_metadata(self) -> dict:
+        object_metadata: dict = {"name": self._blob.name}
+        if self._metadata:
+            object_metadata["metadata"] = self._metadata
+        return object_metadata
 
     def stop(self):
         if self._request:
-            self._request.transmit_next_chunk(self._transport)
+            response = self._request.transmit_next_chunk(self._transport)
+            uploaded_object = response.json()
+            try:
+                self._session.verify(self._blob.name, uploaded_object)
+            except UploadIntegrityError:
+                # It has the source fingerprint, so would be taken as up to date
+                self._blob.delete(
+                    if_generation_match=int(uploaded_object["generation"])
+                )
+                raise
 
     def write(self, data: bytes) -> int:
-        data_len = len(data)
-        self._buffer_size += data_len
-        self._buffer += data
-        del data
+        data_view = memoryview(data).cast("B")
+        data_len = len(data_view)
+        # bytes the server already had when this upload was resumed
+        written = min(self._skip, data_len)
+        self._skip -= written
+        while written < data_len:
+            to_copy = min(self._chunk_size - self._buffer_size, data_len - written)
+            self._buffer_view[self._buffer_size : self._buffer_size + to_copy] = (
+                data_view[written : written + to_copy]
+            )
+            self._buffer_size += to_copy
+            written += to_copy
+            self._transmit_full_chunks()
+        return data_len
+
+    def _transmit_full_chunks(self) -> None:
         while self._buffer_size >= self._chunk_size:
             try:
                 self._request and self._request.transmit_next_chunk(self._transport)
             except common.InvalidResponse:
                 self._request and self._request.recover(self._transport)
-        return data_len
+            else:
+                self._confirm()
+
+    def _confirm(self) -> None:
+        if self._request:
+            self._session.confirm(
+                self._request.resumable_url, self._request.bytes_uploaded
+            )
 
-    def read(self, chunk_size: int) -> bytes:
-        # I'm not good with efficient no-copy buffering so if this is
-        # wrong or there's a better way to do this let me know! :-)
+    def read(self, chunk_size: int) -> Union[memoryview, bytes]:
         to_read = min(chunk_size, self._buffer_size)
-        memview = memoryview(self._buffer)
-        self._buffer = memview[to_read:].tobytes()
         self._read += to_read
-        self._buffer_size -= to_read
-        return memview[:to_read].tobytes()
+        if to_read == self._buffer_size:
+            # The whole buffer is being sent; it is only written to again once
+            # the chunk has been transmitted, so no copy is needed.
+            self._buffer_size = 0
+            self._last_read = to_read
+            return self._buffer_view[:to_read]
+
+        self._last_read = 0
+        data = self._buffer_view[:to_read].tobytes()
+        remaining = self._buffer_size - to_read
+        self._buffer_view[:remaining] = self._buffer_view[to_read : self._buffer_size]
+        self._buffer_size = remaining
+        return data
 
     def tell(self) -> int:
         return self._read
+
+    def seek(self, position: int) -> None:
+        """Move to the byte the server asks for when recovering.
+
+        Going back is only possible to the start of the chunk still in the
+        buffer. Going forward skips that many of the next bytes written, as
+        the server already has them.
+        """
+        if self._buffer_size == 0 and position >= self._read:
+            self._skip = position - self._read
+        elif self._buffer_size == 0 and self._read - position == self._last_read:
+            self._buffer_size = self._last_read
+        elif position != self._read:
+            raise ValueError(
+                f"Unable to seek {self._blob.name} to byte {position} "
+                f"from byte {self._read}"
+            )
+        self._read = position
@@ -1,12 +1,37 @@
 import binascii
 import logging
+import threading
 
 import pybase64
+import requests
+from google.api_core import exceptions as api_exceptions
+from google.auth import exceptions as auth_exceptions
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
+from google.resumable_media.requests import MultipartUpload
+from requests.adapters import HTTPAdapter
 
-# workaround to prevent file transfer timeouts
-storage.blob._DEFAULT_CHUNKSIZE = 5 * 1024 * 1024  # 5 MB
-storage.blob._MAX_MULTIPART_SIZE = 5 * 1024 * 1024  # 5 MB
+BLOB_LISTING_FIELDS = "items(name,md5Hash,size,updated),nextPageToken"
+BUCKET_INDEX_FIELDS = (
+    "items(name,md5Hash,size,generation,timeCreated,updated,metadata),nextPageToken"
+)
+MAX_COMPOSE_SOURCES = 32
+# where a composed object, which GCS keeps no MD5 for, records its source's
+SOURCE_MD5_METADATA = "source_md5"
+UPLOAD_POOL_SIZE = 32
+# chunk size for upload_file, to prevent file transfer timeouts
+UPLOAD_FILE_CHUNK_SIZE = 5 * 1024 * 1024  # 5 MB
+
+# Errors after which a cached client, bucket and transport are rebuilt
+STORAGE_RESET_EXCEPTIONS = (
+    auth_exceptions.GoogleAuthError,
+    api_exceptions.Unauthorized,
+    api_exceptions.Forbidden,
+    requests.exceptions.ConnectionError,
+)
+
+# Kept for the life of the instance, like the Pub/Sub publisher client in main
+_google_storage: dict = {}
 
 
 class GoogleStorage:
@@ -14,6 +39,8 @@ class GoogleStorage:
         self.bucket_name = bucket_name
         self.bucket = None
         self.storage_client = None
+        self._authorized_session = None
+        self._authorized_session_lock = threading.Lock()
 
     def initialise_bucket_connection(self):
         try:
@@ -25,32 +52,143 @@ class GoogleStorage:
         except Exception as ex:
             logging.error("Connection to bucket failed - %s", ex)
 
+    def authorized_session(self):
+        with self._authorized_session_lock:
+            if self._authorized_session is None:
+                session = AuthorizedSession(
+                    credentials=self.storage_client._credentials
+                )
+                # enough pooled connections for concurrent uploads
+                session.mount("https://", HTTPAdapter(pool_maxsize=UPLOAD_POOL_SIZE))
+                self._authorized_session = session
+            return self._authorized_session
+
+    def close(self):
+        if self._authorized_session is not None:
+            self._authorized_session.close()
+            self._authorized_session = None
+
     def upload_file(self, source, dest):
-        blob_destination = self.bucket.blob(dest)
+        blob_destination = self.bucket.blob(dest, chunk_size=UPLOAD_FILE_CHUNK_SIZE)
         logging.info(f"Uploading file - {source}")
         blob_destination.upload_from_filename(source)
         logging.info(f"Uploaded file - {source}")
 
+    def upload_bytes(self, blob_location, data, md5_hash, crc32c, metadata=None):
+        """Upload in a single multipart request, which GCS rejects unless the
+        data matches the base64 `md5_hash` and `crc32c`."""
+        url = (
+            f"https://www.googleapis.com/upload/storage/v1/b/"
+            f"{self.bucket_name}/o?uploadType=multipart"
+        )
+        object_metadata = {"name": blob_location, "md5Hash": md5_hash, "crc32c": crc32c}
+        if metadata:
+            object_metadata["metadata"] = metadata
+        MultipartUpload(url).transmit(
+            self.authorized_session(),
+            data,
+            object_metadata,
+            "application/octet-stream",
+        )
+
     def get_blob(self, blob_location):
         return self.bucket.get_blob(blob_location)
 
-    def list_blobs(self):
-        return list(self.bucket.list_blobs())
+    def list_blobs(self, prefix=None, delimiter=None, fields=None):
+        return list(
+            self.bucket.list_blobs(prefix=prefix, delimiter=delimiter, fields=fields)
+        )
 
-    def delete_blobs(self, blob_list):
-        self.bucket.delete_blobs(blob_list)
+    def delete_blobs(self, blob_list, on_error=None):
+        self.bucket.delete_blobs(blob_list, on_error=on_error)
 
     def get_blob_md5(self, blob_location):
         blob = self.bucket.get_blob(blob_location)
         if not blob:
             logging.info(f"{blob_location} does not exist in bucket {self.bucket_name}")
             return None
-        return binascii.hexlify(pybase64.urlsafe_b64decode(blob.md5_hash)).decode(
-            "utf-8"
+        return self.content_md5(blob)
+
+    @staticmethod
+    def blob_md5(blob):
+        return GoogleStorage.hexdigest(blob.md5_hash)
+
+    @staticmethod
+    def content_md5(blob):
+        """MD5 of the content, taken from the source for composed objects."""
+        return GoogleStorage.blob_md5(blob) or (blob.metadata or {}).get(
+            SOURCE_MD5_METADATA
         )
 
+    @staticmethod
+    def blob_crc32c(blob):
+        return GoogleStorage.hexdigest(blob.crc32c)
+
+    @staticmethod
+    def hexdigest(base64_checksum):
+        """Hex digest of a checksum in the base64 form GCS reports it in."""
+        if not base64_checksum:
+            return None
+        return binascii.hexlify(pybase64.b64decode(base64_checksum)).decode("utf-8")
+
+    def compose_blobs(self, blob_location, source_locations):
+        blob = self.bucket.blob(blob_location)
+        blob.content_type = "application/octet-stream"
+        blob.compose([self.bucket.blob(source) for source in source_locations])
+        return blob
+
+    def copy_blob(self, source_location, blob_location, metadata=None):
+        source = self.bucket.blob(source_location)
+        blob = self.bucket.blob(blob_location)
+        blob.metadata = metadata
+        token = None
+        while True:
+            # large objects can take several rewrite calls
+            token, _, _ = blob.rewrite(source, token=token)
+            if token is None:
+                return blob
+
+    def create_blob(self, blob_location, metadata=None, if_generation_match=None):
+        """Write an empty object, returning None if `if_generation_match` does
+        not match the current generation, 0 meaning it must not exist yet."""
+        blob = self.bucket.blob(blob_location)
+        blob.metadata = metadata
+        try:
+            blob.upload_from_string(b"", if_generation_match=if_generation_match)
+        except api_exceptions.PreconditionFailed:
+            return None
+        return blob
+
+    def delete_blob(self, blob_location, if_generation_match=None):
+        try:
+            self.bucket.delete_blob(
+                blob_location, if_generation_match=if_generation_match
+            )
+        except (api_exceptions.NotFound, api_exceptions.PreconditionFailed):
+            logging.info(f"{blob_location} has already been deleted or replaced")
+
+    def update_blob_metadata(self, blob_location, metadata):
+        blob = self.bucket.blob(blob_location)
+        blob.metadata = metadata
+        blob.patch()
+
 
 def init_google_storage(config):
-    google_storage = GoogleStorage(config.bucket_name)
-    google_storage.initialise_bucket_connection()
+    google_storage = _google_storage.get(config.bucket_name)
+    if google_storage is None or google_storage.bucket is None:
+        google_storage = GoogleStorage(config.bucket_name)
+        google_storage.initialise_bucket_connection()
+        _google_storage[config.bucket_name] = google_storage
     return google_storage
+
+
+def reset_google_storage(error=None):
+    if error is not None and not isinstance(error, STORAGE_RESET_EXCEPTIONS):
+        return
+    for google_storage in _google_storage.values():
+        google_storage.close()
+    _google_storage.clear()
+    if error is not None:
+        logging.info(
+            f"Discarded cached storage client after {error.__class__.__name__}"
+        )
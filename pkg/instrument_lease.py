@@ -0,0 +1,106 @@
+import logging
+import time
+from typing import Any, Optional
+
+from models import Instrument
+from pkg.config import Config
+from pkg.google_storage import GoogleStorage
+
+LEASES_PREFIX = "_leases"
+PROCESSED_PREFIX = "_processed"
+
+
+class LeaseHeld(Exception):
+    """Another processor is syncing a different database for the instrument."""
+
+    def __init__(self, lease_name: str, held_md5: Optional[str], expires: float):
+        super().__init__(f"{lease_name} is held for database md5 {held_md5}")
+        self.expires = expires
+
+
+class InstrumentLease:
+    """An object in the bucket held by the processor syncing an instrument.
+
+    It is only created if it does not exist, and records the database MD5
+    being synced, so a duplicate delivery finds it and leaves the instrument
+    alone, and a delivery for a different database can wait for it. It expires after the function timeout, in case its holder was
+    stopped before releasing it. A marker records the database MD5 last
+    imported, so deliveries for it finish straight away.
+    """
+
+    def __init__(
+        self, google_storage: GoogleStorage, instrument: Instrument, config: Config
+    ) -> None:
+        self.google_storage = google_storage
+        self.instrument = instrument
+        self.config = config
+        self.lease_name = f"{LEASES_PREFIX}/{instrument.gcp_folder()}"
+        self.marker_name = f"{PROCESSED_PREFIX}/{instrument.gcp_folder()}"
+        self.generation: Optional[int] = None
+
+    def processed(self) -> bool:
+        if not self.instrument.bdbx_md5:
+            return False
+        marker = self.google_storage.get_blob(self.marker_name)
+        return marker is not None and self.instrument.bdbx_md5 == _metadata(marker).get(
+            "md5"
+        )
+
+    def acquire(self) -> bool:
+        """Returns False if another processor holds the lease for the same
+        database, raising LeaseHeld if it is syncing a different one."""
+        lease = self.google_storage.create_blob(
+            self.lease_name, self._lease_metadata(), if_generation_match=0
+        )
+        if lease is None:
+            lease = self._take_over_expired()
+        if lease is None:
+            return False
+        self.generation = lease.generation
+        return True
+
+    def release(self) -> None:
+        if self.generation is not None:
+            # only if it has not expired and been taken over since
+            self.google_storage.delete_blob(
+                self.lease_name, if_generation_match=self.generation
+            )
+            self.generation = None
+
+    def mark_processed(self) -> None:
+        if self.instrument.bdbx_md5:
+            self.google_storage.create_blob(
+                self.marker_name, {"md5": self.instrument.bdbx_md5}
+            )
+
+    def _take_over_expired(self) -> Any:
+        current = self.google_storage.get_blob(self.lease_name)
+        if current is None:
+            # released since it was found, so it must still not exist
+            generation = 0
+        elif float(_metadata(current).get("expires", "0")) > time.time():
+            self._check_held_for_same_md5(current)
+            return None
+        else:
+            logging.warning(f"Taking over expired lease {self.lease_name}")
+            generation = current.generation
+        return self.google_storage.create_blob(
+            self.lease_name, self._lease_metadata(), if_generation_match=generation
+        )
+
+    def _check_held_for_same_md5(self, current: Any) -> None:
+        held_md5 = _metadata(current).get("md5")
+        if held_md5 != self.instrument.bdbx_md5:
+            raise LeaseHeld(
+                self.lease_name, held_md5, float(_metadata(current)["expires"])
+            )
+
+    def _lease_metadata(self) -> dict:
+        metadata = {"expires": str(time.time() + self.config.function_timeout)}
+        if self.instrument.bdbx_md5:
+            metadata["md5"] = self.instrument.bdbx_md5
+        return metadata
+
+
+def _metadata(blob: Any) -> dict:
+    return blob.metadata or {}
@@ -1,12 +1,17 @@
 import hashlib
 import logging
-import math
 import os
 import pathlib
+import queue
+import re
+import shlex
 import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Dict, List, Type, TypeVar
+from typing import Callable, Dict, Generator, Iterator, List, Optional, Type, TypeVar
 
 import paramiko
 
@@ -14,6 +19,11 @@ from models import Instrument
 from pkg.config import Config
 
 T = TypeVar("T", bound="SFTPConfig")
+ItemT = TypeVar("ItemT")
+ResultT = TypeVar("ResultT")
+
+EMPTY_FILE_MD5 = "d41d8cd98f00b204e9800998ecf8427e"
+MD5SUM_OUTPUT = re.compile(r"^(?P<md5>[0-9a-f]{32})\s")
 
 
 @dataclass
@@ -60,6 +70,117 @@ class SFTPConfig:
         )
 
 
+def read_sftp_file(
+    sftp_connection: paramiko.SFTPClient,
+    sftp_path: str,
+    file_size: int,
+    config: Config,
+    offset: int = 0,
+    length: Optional[int] = None,
+) -> Iterator[bytes]:
+    end = file_size if length is None else min(file_size, offset + length)
+    with sftp_connection.open(sftp_path, bufsize=config.bufsize) as sftp_file:
+        # Read requests are queued in file order up front, so reading the file
+        # sequentially (without seeking) is served from the prefetch buffer
+        # instead of paying a round trip per chunk.
+        sftp_file.MAX_REQUEST_SIZE = config.sftp_request_size
+        sftp_file.seek(offset)
+        sftp_file.prefetch(end, max_concurrent_requests=config.sftp_request_count)
+        position = offset
+        while position < end:
+            data = sftp_file.read(min(config.bufsize, end - position))
+            if not data:
+                return
+            position += len(data)
+            yield data
+
+
+@contextmanager
+def sftp_channels(
+    sftp: paramiko.SFTPClient, count: int
+) -> Generator[List[paramiko.SFTPClient], None, None]:
+    """Open up to `count` extra SFTP sessions on the transport behind `sftp`.
+
+    Servers can cap the number of sessions per connection, so this stops at
+    the first refusal and always yields at least the original session.
+    """
+    transport = sftp.get_channel().get_transport()
+    channels: List[paramiko.SFTPClient] = []
+    try:
+        while len(channels) < count:
+            try:
+                channel = paramiko.SFTPClient.from_transport(transport)
+            except (paramiko.SSHException, OSError) as e:
+                logging.warning(
+                    f"Unable to open SFTP session {len(channels) + 1} of {count}: {e}"
+                )
+                break
+            if channel is None:
+                break
+            channels.append(channel)
+
+        yield channels or [sftp]
+    finally:
+        for channel in channels:
+            channel.close()
+
+
+def map_on_sftp_channels(
+    sftp: paramiko.SFTPClient,
+    func: Callable[[paramiko.SFTPClient, ItemT], ResultT],
+    items: List[ItemT],
+    workers: int,
+    ordered: bool = True,
+) -> Iterator[ResultT]:
+    """Call `func(channel, item)` for each item over up to `workers` sessions.
+
+    Each call has a session to itself while it runs. Results are yielded in
+    the order of `items` as they become available, or as soon as each call
+    finishes if not `ordered`.
+    """
+    with sftp_channels(sftp, workers) as channels:
+        idle_channels: "queue.Queue[paramiko.SFTPClient]" = queue.Queue()
+        for channel in channels:
+            idle_channels.put(channel)
+
+        def run_on_channel(item: ItemT) -> ResultT:
+            channel = idle_channels.get()
+            try:
+                return func(channel, item)
+            finally:
+                idle_channels.put(channel)
+
+        with ThreadPoolExecutor(max_workers=len(channels)) as executor:
+            if ordered:
+                yield from executor.map(run_on_channel, items)
+                return
+            calls = [executor.submit(run_on_channel, item) for item in items]
+            for call in as_completed(calls):
+                yield call.result()
+
+
+class RemoteMd5Support:
+    """Whether md5sum can be run on the SFTP server.
+
+    Shared by the SFTP for every session on a connection, so the server is
+    probed once and md5sum failing on one session stops them all using it.
+    """
+
+    def __init__(self) -> None:
+        self._supported: Optional[bool] = None
+        self._lock = threading.Lock()
+
+    def check(self, probe: Callable[[], bool]) -> bool:
+        with self._lock:
+            if self._supported is None:
+                self._supported = probe()
+            return self._supported
+
+    def disable(self) -> None:
+        with self._lock:
+            self._supported = False
+
+
 class SFTP:
     def __init__(
         self,
@@ -70,6 +191,7 @@ class SFTP:
         self.sftp_connection = sftp_connection
         self.sftp_config = sftp_config
         self.config = config
+        self._remote_md5_support = RemoteMd5Support()
 
     def get_instrument_folders(self, survey_source_path: str) -> Dict[str, Instrument]:
         instruments = {}
@@ -88,18 +210,36 @@ class SFTP:
 
         return instruments
 
-    def get_instrument_files(
-        self, instruments: Dict[str, Instrument]
-    ) -> Dict[str, Instrument]:
-        for _, instrument in instruments.items():
-            instrument.files = self._get_instrument_files_for_instrument(instrument)
-        return instruments
+    def for_connection(self, sftp_connection: paramiko.SFTPClient) -> "SFTP":
+        sftp = SFTP(sftp_connection, self.sftp_config, self.config)
+        sftp._remote_md5_support = self._remote_md5_support
+        return sftp
+
+    def map_on_channels(
+        self, func: Callable[["SFTP", ItemT], ResultT], items: List[ItemT]
+    ) -> Iterator[ResultT]:
+        """Run `func` for each item, over `sftp_scan_concurrency` sessions."""
+        workers = min(self.config.sftp_scan_concurrency, len(items))
+        if workers <= 1:
+            return (func(self, item) for item in items)
+        return map_on_sftp_channels(
+            self.sftp_connection,
+            lambda channel, item: func(self.for_connection(channel), item),
+            items,
+            workers,
+        )
 
-    def generate_bdbx_md5s(
+    def get_instrument_files(
         self, instruments: Dict[str, Instrument]
     ) -> Dict[str, Instrument]:
-        for _, instrument in instruments.items():
-            instrument.bdbx_md5 = self.generate_bdbx_md5(instrument)
+        listings = self.map_on_channels(
+            lambda sftp, instrument: sftp._get_instrument_files_for_instrument(
+                instrument
+            ),
+            list(instruments.values()),
+        )
+        for instrument, files in zip(instruments.values(), listings):
+            instrument.files = files
         return instruments
 
     def generate_bdbx_md5(self, instrument: Instrument) -> str:
@@ -110,21 +250,68 @@ class SFTP:
             )
             return ""
 
-        try:
-            bdbx_details = self.sftp_connection.stat(bdbx_file)
-            md5sum = hashlib.md5()
-            chunks = math.ceil(bdbx_details.st_size / self.config.bufsize)
+        if not self.config.force_local_md5 and self.remote_md5_supported():
+            remote_md5 = self._remote_md5(bdbx_file)
+            if remote_md5:
+                return remote_md5
+            logging.warning(
+                f"Remote md5sum failed for {bdbx_file}, "
+                "falling back to downloading files from the SFTP server"
+            )
+            self._remote_md5_support.disable()
+
+        return self._local_md5(bdbx_file)
+
+    def remote_md5_supported(self) -> bool:
+        return self._remote_md5_support.check(self._probe_remote_md5)
+
+    def _probe_remote_md5(self) -> bool:
+        supported = self._exec_md5sum("/dev/null") == EMPTY_FILE_MD5
+        logging.info(
+            f"Remote md5sum supported by {self.sftp_config.host} - {supported}"
+        )
+        return supported
 
-            with self.sftp_connection.open(
-                bdbx_file, bufsize=self.config.bufsize
-            ) as sftp_file:
+    def remote_md5(self, sftp_path: str) -> Optional[str]:
+        """The MD5 from md5sum on the SFTP server, None if that is unavailable."""
+        if self.config.force_local_md5 or not self.remote_md5_supported():
+            return None
+        return self._remote_md5(sftp_path)
 
-                sftp_file.prefetch()
-                for chunk in range(chunks):
-                    sftp_file.seek(chunk * self.config.bufsize)
-                    md5sum.update(sftp_file.read(self.config.bufsize))
+    def _remote_md5(self, sftp_path: str) -> Optional[str]:
+        logging.info(f"Calculating md5 for {sftp_path} on the SFTP server")
+        return self._exec_md5sum(sftp_path)
 
-                return md5sum.hexdigest()
+    def _exec_md5sum(self, sftp_path: str) -> Optional[str]:
+        try:
+            transport = self.sftp_connection.get_channel().get_transport()
+            channel = transport.open_session()
+            try:
+                channel.exec_command(f"md5sum {shlex.quote(sftp_path)}")
+                output = channel.makefile("rb").read()
+                exit_status = channel.recv_exit_status()
+            finally:
+                channel.close()
+        except (paramiko.SSHException, OSError) as error:
+            logging.info(f"Unable to run md5sum over SSH for {sftp_path}: {error}")
+            return None
+
+        if exit_status != 0:
+            return None
+        match = MD5SUM_OUTPUT.match(output.decode("utf-8", errors="replace"))
+        if not match:
+            return None
+        return match.group("md5")
+
+    def _local_md5(self, bdbx_file: str) -> str:
+        try:
+            bdbx_details = self.sftp_connection.stat(bdbx_file)
+            md5sum = hashlib.md5()
+            for data in read_sftp_file(
+                self.sftp_connection, bdbx_file, bdbx_details.st_size, self.config
+            ):
+                md5sum.update(data)
+            return md5sum.hexdigest()
 
         except FileNotFoundError as error:
             logging.error(f"Failed to open {bdbx_file} over SFTP")
@@ -145,6 +332,7 @@ class SFTP:
                     instrument.bdbx_updated_at = datetime.fromtimestamp(
                         instrument_file.st_mtime, tz=timezone.utc
                     )
+                    instrument.bdbx_size = instrument_file.st_size
 
                 if file_extension in self.config.extension_list:
                     logging.info(f"Instrument file found - {instrument_file.filename}")
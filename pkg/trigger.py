@@ -1,35 +1,257 @@
 import logging
-from typing import Dict
+import time
+from concurrent import futures
+from dataclasses import dataclass, field
+from typing import Container, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 from google.cloud import pubsub_v1
 
-from models import Instrument, ProcessorEvent
+from models import BatchProcessorEvent, Instrument, ProcessorEvent
+from models.processor_event import AnyProcessorEvent
 from pkg.case_mover import CaseMover
 from pkg.config import Config
 from pkg.sftp import SFTP
 
-
-def trigger_processor(
-    publisher_client: pubsub_v1.PublisherClient,
-    config: Config,
-    processor_event: ProcessorEvent,
-) -> None:
-    logging.info(f"Triggering processor for: {processor_event.instrument_name}")
-    topic_path = publisher_client.topic_path(
-        config.project_id, config.processor_topic_name
+# Events are small, so batches are bounded by latency rather than size, and
+# publishing blocks rather than buffering without limit if Pub/Sub falls behind.
+PUBLISH_BATCH_SETTINGS = pubsub_v1.types.BatchSettings(
+    max_messages=100, max_bytes=1024 * 1024, max_latency=0.05
+)
+PUBLISHER_OPTIONS = pubsub_v1.types.PublisherOptions(
+    flow_control=pubsub_v1.types.PublishFlowControl(
+        message_limit=500,
+        byte_limit=10 * 1024 * 1024,
+        limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK,
     )
-    msg_bytes = bytes(processor_event.json(), encoding="utf-8")
-    publisher_client.publish(topic_path, data=msg_bytes)
-    logging.info(f"Queued on pubsub for: {processor_event.instrument_name}")
+)
+
+
+@dataclass
+class PendingPublish:
+    processor_event: AnyProcessorEvent
+    future: futures.Future
+    started: float
+    finished: Optional[float] = None
+
+    def latency_ms(self) -> float:
+        return ((self.finished or time.monotonic()) - self.started) * 1000
+
+
+class ProcessorEventPublisher:
+    """Publishes processor events without waiting, then confirms them together.
+
+    Events that fail to publish are sent again from memory by `wait`, so the
+    instruments do not need to be discovered again.
+    """
+
+    def __init__(
+        self,
+        publisher_client: pubsub_v1.PublisherClient,
+        config: Config,
+        attempts: int = 3,
+    ) -> None:
+        self.publisher_client = publisher_client
+        self.topic_path = publisher_client.topic_path(
+            config.project_id, config.processor_topic_name
+        )
+        self.attempts = attempts
+        self.published = 0
+        self.instrument_names: Set[str] = set()
+        self._pending: List[PendingPublish] = []
+
+    def publish(self, processor_event: AnyProcessorEvent) -> None:
+        logging.info(
+            f"Triggering processor for: {event_instrument_names(processor_event)}"
+        )
+        msg_bytes = bytes(processor_event.json(), encoding="utf-8")
+        pending = PendingPublish(
+            processor_event=processor_event,
+            future=self.publisher_client.publish(self.topic_path, data=msg_bytes),
+            started=time.monotonic(),
+        )
+        pending.future.add_done_callback(
+            lambda _: setattr(pending, "finished", time.monotonic())
+        )
+        self._pending.append(pending)
+        self.published += 1
+        self.instrument_names.update(instrument_names(processor_event))
+
+    def wait(self) -> None:
+        failed = self._confirm()
+        for attempt in range(2, self.attempts + 1):
+            if not failed:
+                return
+            logging.warning(
+                f"Publishing {len(failed)} processor events again, "
+                f"attempt {attempt} of {self.attempts}"
+            )
+            for processor_event in failed:
+                self.publish(processor_event)
+            failed = self._confirm()
+
+        if failed:
+            raise Exception(
+                "Failed to publish processor events for: "
+                + ", ".join(event_instrument_names(event) for event in failed)
+            )
+
+    def _confirm(self) -> List[AnyProcessorEvent]:
+        pending, self._pending = self._pending, []
+        futures.wait([publish.future for publish in pending])
+        failed = []
+        for publish in pending:
+            instrument_names = event_instrument_names(publish.processor_event)
+            error = publish.future.exception()
+            if error:
+                logging.error(
+                    f"Failed to queue on pubsub for: {instrument_names} after "
+                    f"{publish.latency_ms():.0f} ms - {error}"
+                )
+                failed.append(publish.processor_event)
+            else:
+                logging.info(
+                    f"Queued on pubsub for: {instrument_names} as message "
+                    f"{publish.future.result()} in {publish.latency_ms():.0f} ms"
+                )
+        return failed
+
+
+def event_instrument_names(processor_event: AnyProcessorEvent) -> str:
+    return ", ".join(instrument_names(processor_event))
+
+
+def instrument_names(processor_event: AnyProcessorEvent) -> List[str]:
+    if isinstance(processor_event, BatchProcessorEvent):
+        return [event.instrument_name for event in processor_event.events]
+    return [processor_event.instrument_name]
+
+
+@dataclass
+class TriggerCheckpoint:
+    """What a trigger run has found out so far, kept across its retries.
+
+    The survey folder and the bucket are listed again, one call each, and
+    the Blaise checks, file listings and change checks already done for each
+    instrument are reused. Instruments that have already been published are
+    not published again.
+    """
+
+    exists: Dict[str, bool] = field(default_factory=dict)
+    listed: Dict[str, Instrument] = field(default_factory=dict)
+    checked: Dict[str, Tuple[Instrument, bool]] = field(default_factory=dict)
+    publisher: Optional[ProcessorEventPublisher] = None
+
+    def get_publisher(
+        self, publisher_client: pubsub_v1.PublisherClient, config: Config
+    ) -> ProcessorEventPublisher:
+        """The same publisher across retries, so messages an earlier attempt
+        published are confirmed along with the rest."""
+        if self.publisher is None:
+            self.publisher = ProcessorEventPublisher(publisher_client, config)
+        return self.publisher
+
+    def filter_existing_instruments(
+        self, case_mover: CaseMover, instruments: Dict[str, Instrument]
+    ) -> Dict[str, Instrument]:
+        unchecked = self._without(self.exists, instruments)
+        if unchecked:
+            existing = case_mover.filter_existing_instruments(unchecked)
+            self.exists.update({name: name in existing for name in unchecked})
+        return {
+            name: instrument
+            for name, instrument in instruments.items()
+            if self.exists[name]
+        }
+
+    def get_instrument_files(
+        self, sftp: SFTP, instruments: Dict[str, Instrument]
+    ) -> Dict[str, Instrument]:
+        unlisted = self._without(self.listed, instruments)
+        if unlisted:
+            self.listed.update(sftp.get_instrument_files(unlisted))
+        return {name: self.listed[name] for name in instruments}
+
+    def iter_instruments_needing_update(
+        self, case_mover: CaseMover, instruments: Dict[str, Instrument]
+    ) -> Iterator[Tuple[str, Instrument]]:
+        yield from self._unpublished(instruments)
+        unchecked = self._without(self.checked, instruments)
+        for name, instrument, needs_update in case_mover.iter_update_checks(unchecked):
+            self.checked[name] = (instrument, needs_update)
+            if needs_update:
+                yield name, instrument
+
+    def _unpublished(
+        self, instruments: Dict[str, Instrument]
+    ) -> Iterator[Tuple[str, Instrument]]:
+        """Instruments an earlier attempt found needing an update, but did not
+        get as far as publishing."""
+        published = self.publisher.instrument_names if self.publisher else set()
+        for name in instruments:
+            instrument, needs_update = self.checked.get(name, (None, False))
+            if instrument and needs_update and name not in published:
+                yield name, instrument
+
+    @staticmethod
+    def _without(
+        done: Container[str], instruments: Dict[str, Instrument]
+    ) -> Dict[str, Instrument]:
+        return {
+            name: instrument
+            for name, instrument in instruments.items()
+            if name not in done
+        }
+
+
+def batch_processor_events(
+    instruments: Iterable[Tuple[str, Instrument]], config: Config
+) -> Iterator[AnyProcessorEvent]:
+    """Group instruments into events of up to `processor_batch_bytes` of .bdbx.
+
+    Instruments at or over the limit always get an event of their own, and
+    batching is off when the limit is 0. Events are yielded as soon as they
+    are complete so publishing can start before discovery finishes.
+    """
+    limit = config.processor_batch_bytes
+    batch: List[ProcessorEvent] = []
+    batch_bytes = 0
+    for instrument_name, instrument in instruments:
+        event = ProcessorEvent(instrument_name=instrument_name, instrument=instrument)
+        size = instrument.bdbx_size or 0
+        if size >= limit:
+            yield event
+        elif batch_bytes + size > limit:
+            yield _batch_event(batch)
+            batch, batch_bytes = [event], size
+        else:
+            batch.append(event)
+            batch_bytes += size
+    if batch:
+        yield _batch_event(batch)
+
+
+def _batch_event(batch: List[ProcessorEvent]) -> AnyProcessorEvent:
+    return batch[0] if len(batch) == 1 else BatchProcessorEvent(events=batch)
+
 
+def iter_filtered_instruments(
+    sftp: SFTP,
+    case_mover: CaseMover,
+    survey_source_path: str,
+    checkpoint: Optional[TriggerCheckpoint] = None,
+) -> Iterator[Tuple[str, Instrument]]:
+    """Yield each instrument that needs syncing as soon as it is known to.
 
-def get_filtered_instruments(
-    sftp: SFTP, case_mover: CaseMover, survey_source_path: str
-) -> Dict[str, Instrument]:
+    Folders are listed, and changes detected, several instruments at a time
+    over separate SFTP sessions, so the scan takes about as long as the
+    slowest instrument rather than the sum of them all. Pass the checkpoint
+    of an earlier attempt to carry on from where it failed.
+    """
+    checkpoint = checkpoint or TriggerCheckpoint()
     instruments = sftp.get_instrument_folders(survey_source_path)
-    instruments = case_mover.filter_existing_instruments(instruments)
-    instruments = sftp.get_instrument_files(instruments)
+    instruments = checkpoint.filter_existing_instruments(case_mover, instruments)
+    case_mover.load_bucket_index()
+    instruments = checkpoint.get_instrument_files(sftp, instruments)
     instruments = sftp.filter_invalid_instrument_filenames(instruments)
     instruments = sftp.filter_instrument_files(instruments)
-    instruments = sftp.generate_bdbx_md5s(instruments)
-    return instruments
+    yield from checkpoint.iter_instruments_needing_update(case_mover, instruments)
@@ -1,19 +1,146 @@
 import logging
+import time
+from typing import List, Optional
 
-from models import Instrument
+import paramiko
+
+from models import Instrument, ProcessorEvent
 from pkg.case_mover import CaseMover
+from pkg.deadline import Deadline, DeadlineExceeded
+from pkg.instrument_lease import InstrumentLease, LeaseHeld
+
+LEASE_POLL_SECONDS = 5
 
 
 def process_instrument(
-    case_mover: CaseMover, instrument_name: str, instrument: Instrument
+    case_mover: CaseMover,
+    instrument_name: str,
+    instrument: Instrument,
+    deadline: Optional[Deadline] = None,
 ) -> None:
+    if deadline:
+        deadline.check(f"instrument {instrument_name}")
+    lease = InstrumentLease(case_mover.google_storage, instrument, case_mover.config)
+    if lease.processed():
+        logging.info(
+            f"Instrument - {instrument_name} - has already been processed "
+            f"with database md5 {instrument.bdbx_md5}, skipping..."
+        )
+        return
+    if not acquire_lease(lease, deadline):
+        logging.info(
+            f"Instrument - {instrument_name} - is being processed by another "
+            f"processor with database md5 {instrument.bdbx_md5}, skipping..."
+        )
+        return
+
+    try:
+        if sync_and_import(case_mover, instrument_name, instrument, deadline):
+            lease.mark_processed()
+    finally:
+        lease.release()
+
+
+def acquire_lease(lease: InstrumentLease, deadline: Optional[Deadline] = None) -> bool:
+    """Acquire the lease, waiting for a processor syncing a different database
+    to release it or for it to expire. The wait is handed back as
+    DeadlineExceeded if it would run past the deadline."""
+    while True:
+        try:
+            return lease.acquire()
+        except LeaseHeld as held:
+            wait = max(0.0, held.expires - time.time())
+            if deadline and deadline.remaining() - deadline.margin < wait:
+                raise DeadlineExceeded(
+                    f"{held}, which may not be released for {wait:.0f}s"
+                )
+            logging.info(f"{held}, waiting for it to be released")
+            time.sleep(min(wait, LEASE_POLL_SECONDS))
+
+
+def sync_and_import(
+    case_mover: CaseMover,
+    instrument_name: str,
+    instrument: Instrument,
+    deadline: Optional[Deadline] = None,
+) -> bool:
+    """Returns whether the instrument is up to date in the bucket and Blaise."""
     logging.info(f"Processing instrument - {instrument_name} - {instrument.sftp_path}")
-    if case_mover.instrument_needs_updating(instrument):
-        logging.info(f"Syncing instrument - {instrument_name}")
-        case_mover.sync_instrument(instrument)
-        case_mover.send_request_to_api(instrument.gcp_folder())
-    else:
+    case_mover.load_bucket_index(prefix=f"{instrument.gcp_folder()}/")
+    if not case_mover.instrument_needs_updating(instrument):
         logging.info(
             f"Instrument - {instrument_name} - "
             + "has no changes to the database file, skipping..."
         )
+        return True
+
+    logging.info(f"Syncing instrument - {instrument_name}")
+    synced = case_mover.sync_instrument(instrument, deadline)
+    imported = case_mover.send_request_to_api(instrument.gcp_folder())
+    return synced and imported
+
+
+def process_events(
+    case_mover: CaseMover,
+    events: List[ProcessorEvent],
+    deadline: Optional[Deadline] = None,
+) -> List[ProcessorEvent]:
+    """Process the events from one message, returning those there was not
+    enough time left to finish."""
+    if len(events) > 1:
+        return process_instruments(case_mover, events, deadline)
+
+    try:
+        process_instrument(
+            case_mover, events[0].instrument_name, events[0].instrument, deadline
+        )
+    except DeadlineExceeded as error:
+        logging.warning(
+            f"Unable to finish instrument {events[0].instrument_name}: {error}"
+        )
+        return events
+    return []
+
+
+def process_instruments(
+    case_mover: CaseMover,
+    events: List[ProcessorEvent],
+    deadline: Optional[Deadline] = None,
+) -> List[ProcessorEvent]:
+    """Process a batch of instruments concurrently over one SFTP connection.
+
+    Each worker gets its own SFTP session and CaseMover. Every instrument is
+    attempted before an exception is raised for any that failed, and a
+    redelivered batch skips the instruments that are already up to date.
+    Instruments there was not enough time left to finish are returned.
+    """
+    unfinished = set()
+
+    def process_on_channel(
+        sftp_connection: paramiko.SFTPClient, event: ProcessorEvent
+    ) -> bool:
+        try:
+            process_instrument(
+                case_mover.for_sftp_connection(sftp_connection),
+                event.instrument_name,
+                event.instrument,
+                deadline,
+            )
+            return True
+        except DeadlineExceeded as error:
+            logging.warning(
+                f"Unable to finish instrument {event.instrument_name}: {error}"
+            )
+            unfinished.add(event.instrument_name)
+            return True
+        except Exception:
+            logging.exception(f"Failed to process instrument {event.instrument_name}")
+            return False
+
+    results = case_mover.map_on_sftp_channels(
+        process_on_channel, events, case_mover.config.processor_batch_concurrency
+    )
+    failed = [event.instrument_name for event, ok in zip(events, results) if not ok]
+    if failed:
+        raise Exception(f"Failed to process instruments: {', '.join(failed)}")
+    return [event for event in events if event.instrument_name in unfinished]
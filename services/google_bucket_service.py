@@ -1,10 +1,12 @@
 import logging
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, cast
 
 from google.cloud import storage
 
 from models.configuration.bucket_config_model import BucketConfig
+from pkg.bucket_index import BucketIndex
+from pkg.google_storage import BUCKET_INDEX_FIELDS
 
 
 class GoogleBucketService:
@@ -16,14 +18,18 @@ class GoogleBucketService:
     ) -> Dict[str, datetime]:
         try:
             questionnaire_modified_dates = {}
-            blobs = self.get_blobs()
-
-            for blob in blobs:
-                if not blob.name.upper().endswith(file_extension.upper()):
-                    continue
-
-                questionnaire_name = blob.name.upper().split("/")[0]
-                questionnaire_modified_dates[questionnaire_name] = blob.updated
+            bucket_index = BucketIndex.from_blobs(self.get_blobs())
+
+            for folder, files in bucket_index.folders.items():
+                for file_name, entry in files.items():
+                    if not file_name.upper().endswith(file_extension.upper()):
+                        continue
+
+                    # not `updated`, which moves when the fingerprint of an
+                    # unchanged database is recorded
+                    questionnaire_modified_dates[folder.upper()] = cast(
+                        datetime, entry.time_created
+                    )
             return questionnaire_modified_dates
         except Exception as error:
             logging.error(
@@ -33,4 +39,6 @@ class GoogleBucketService:
 
     def get_blobs(self) -> List:
         _storage_client = storage.Client()
-        return list(_storage_client.list_blobs(self._bucket_name))
+        return list(
+            _storage_client.list_blobs(self._bucket_name, fields=BUCKET_INDEX_FIELDS)
+        )
@@ -48,26 +48,30 @@ def google_storage(config):
 
 @pytest.fixture
 def mock_stat():
-    def inner(st_size):
+    def inner(st_size, st_mtime=0):
         @dataclass
         class MockStat:
             st_size: int
+            st_mtime: int
 
-        return MockStat(st_size=st_size)
+        return MockStat(st_size=st_size, st_mtime=st_mtime)
 
     return inner
 
 
 @pytest.fixture
 def mock_list_dir_attr():
-    def inner(filename, st_mtime, st_mode=stat.S_IFREG):
+    def inner(filename, st_mtime, st_mode=stat.S_IFREG, st_size=0):
         @dataclass
         class MockListDirAttr:
             filename: str
             st_mtime: int
             st_mode: int
+            st_size: int
 
-        return MockListDirAttr(filename=filename, st_mtime=st_mtime, st_mode=st_mode)
+        return MockListDirAttr(
+            filename=filename, st_mtime=st_mtime, st_mode=st_mode, st_size=st_size
+        )
 
     return inner
 
@@ -79,7 +83,7 @@ def fake_sftp_file():
             def __init__(self, byte_content):
                 super().__init__(byte_content)
 
-            def prefetch(self):
+            def prefetch(self, file_size=None, max_concurrent_requests=None):
                 pass
 
             # Add context manager support
@@ -1,5 +1,6 @@
 import base64
 import os
+from concurrent import futures
 
 from google.cloud.pubsub_v1 import PublisherClient
 
@@ -18,6 +19,9 @@ class FakePublisherClient(PublisherClient):
     def publish(self, topic_path, data):
         message = {"topic_path": topic_path, "data": data}
         self.published_messages.append(message)
+        future = futures.Future()
+        future.set_result(str(len(self.published_messages)))
+        return future
 
     def run_all(self):
         for message in self.published_messages:
@@ -2,6 +2,7 @@ import os
 from unittest import mock
 
 import flask
+import requests
 from behave import given, then, when
 
 import main
@@ -50,10 +51,12 @@ def step_there_is_new_opn_nisra_data_on_the_nisra_sftp_that_hasnt_previously_bee
 def step_the_nisra_mover_service_is_run_with_an_opn_configuration(context):
     with mock.patch("main.get_publisher_client", return_value=context.publisher_client):
         with mock.patch.object(
+            CaseMover, "get_blaise_questionnaire_names", return_value=None
+        ), mock.patch.object(
             CaseMover, "instrument_exists_in_blaise"
         ) as mock_instrument_exists_in_blaise:
             mock_instrument_exists_in_blaise.return_value = True
-            with mock.patch("requests.post") as mock_requests_post:
+            with mock.patch.object(requests.Session, "post") as mock_requests_post:
                 mock_requests_post.return_value.status_code = 200
                 mock_request = flask.Request.from_values(json={"survey": "./ONS/TEST"})
                 main.trigger(mock_request)
@@ -69,10 +72,12 @@ def step_the_nisra_mover_service_is_run_with_survey_source_path(
 ):
     with mock.patch("main.get_publisher_client", return_value=context.publisher_client):
         with mock.patch.object(
+            CaseMover, "get_blaise_questionnaire_names", return_value=None
+        ), mock.patch.object(
             CaseMover, "instrument_exists_in_blaise"
         ) as mock_instrument_exists_in_blaise:
             mock_instrument_exists_in_blaise.return_value = True
-            with mock.patch("requests.post") as mock_requests_post:
+            with mock.patch.object(requests.Session, "post") as mock_requests_post:
                 mock_requests_post.return_value.status_code = 200
                 mock_request = flask.Request.from_values(
                     json={"survey": survey_source_path}
@@ -144,7 +149,7 @@ def step_a_call_is_made_to_the_restful_api_to_process_the_new_data(context):
         ),
         json={"questionnaireDataPath": "opn2101a"},
         headers={"content-type": "application/json"},
-        timeout=(30),
+        timeout=(5, 30),
     )
 
 
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from models.instruments import Instrument
 
 
@@ -39,3 +41,21 @@ def test_get_bdbx_blob_filepath():
         files=["foo.bdix", "bar.bdix", "OPn2101A.bDbX", "fish.zip"],
     )
     assert instrument.get_bdbx_blob_filepath() == "opn2101a/opn2101a.bdbx"
+
+
+def test_bdbx_fingerprint():
+    instrument = Instrument(
+        sftp_path="path/to/OPN2101A",
+        bdbx_updated_at=datetime.fromisoformat("2021-05-20T10:21:53+00:00"),
+        bdbx_size=1234,
+        files=["OPn2101A.bDbX"],
+    )
+    assert instrument.bdbx_fingerprint() == {
+        "source_size": "1234",
+        "source_mtime": "1621506113",
+    }
+
+
+def test_bdbx_fingerprint_when_not_listed():
+    instrument = Instrument(sftp_path="path/to/OPN2101A", files=["OPn2101A.bDbX"])
+    assert instrument.bdbx_fingerprint() is None
@@ -1,7 +1,8 @@
 import json
 from datetime import datetime
 
-from models import Instrument, ProcessorEvent
+from models import BatchProcessorEvent, Instrument, ProcessorEvent
+from models.processor_event import processor_events_from_json
 
 
 def test_processor_event_json():
@@ -16,6 +17,7 @@ def test_processor_event_json():
         "instrument_name": "foobar",
         "instrument": {
             "bdbx_md5": None,
+            "bdbx_size": None,
             "bdbx_updated_at": "2021-01-01T00:00:00",
             "files": ["foo.bdix"],
             "sftp_path": "",
@@ -42,3 +44,35 @@ def test_processor_event_from_json():
     assert ProcessorEvent.from_json(processor_event_json) == ProcessorEvent(
         instrument_name="foobar", instrument=instrument
     )
+
+
+def test_batch_processor_event_round_trip():
+    batch = BatchProcessorEvent(
+        events=[
+            ProcessorEvent(
+                instrument_name="OPN2101A",
+                instrument=Instrument(
+                    sftp_path="ONS/OPN/OPN2101A",
+                    bdbx_updated_at=datetime(2021, 1, 1, 0, 0),
+                    bdbx_size=17,
+                    files=["opn2101a.bdbx"],
+                ),
+            ),
+            ProcessorEvent(
+                instrument_name="OPN2102A",
+                instrument=Instrument(sftp_path="ONS/OPN/OPN2102A"),
+            ),
+        ]
+    )
+
+    assert BatchProcessorEvent.from_json(batch.json()) == batch
+    assert processor_events_from_json(batch.json()) == batch.events
+
+
+def test_processor_events_from_json_single_event():
+    event = ProcessorEvent(
+        instrument_name="foobar",
+        instrument=Instrument(sftp_path="", files=["foo.bdix"]),
+    )
+
+    assert processor_events_from_json(event.json()) == [event]
@@ -0,0 +1,74 @@
+import pytest
+import requests
+
+from pkg import blaise_api
+from pkg.blaise_api import BlaiseApiClient, get_blaise_api_client
+
+
+@pytest.fixture(autouse=True)
+def clear_clients():
+    blaise_api._clients.clear()
+    yield
+    blaise_api._clients.clear()
+
+
+def test_get_blaise_api_client_is_cached(config):
+    client = get_blaise_api_client(config)
+
+    assert get_blaise_api_client(config) is client
+    assert client.base_url == (
+        "http://mock_blaise_api_url.com/api/v2/serverparks/MOCK_SERVER_PARK"
+    )
+    assert client.timeout == (5, 30)
+
+
+def test_get_blaise_api_client_per_server_park(config):
+    client = get_blaise_api_client(config)
+    config.server_park = "other"
+
+    assert get_blaise_api_client(config) is not client
+
+
+def test_blaise_api_client_retries():
+    client = BlaiseApiClient("localhost:90", "gusty", retries=5, backoff_factor=1)
+    retry = client.session.get_adapter("http://localhost:90").max_retries
+
+    assert retry.total == 5
+    assert retry.backoff_factor == 1
+    assert retry.is_retry("GET", 503)
+    assert not retry.is_retry("POST", 503)
+    assert not retry.is_retry("GET", 404)
+
+
+def test_blaise_api_client_get(requests_mock):
+    requests_mock.get(
+        "http://localhost:90/api/v2/serverparks/gusty/questionnaires", json=[]
+    )
+    client = BlaiseApiClient("localhost:90", "gusty", connect_timeout=1)
+
+    assert client.get("questionnaires").json() == []
+    assert requests_mock.last_request.timeout == (1, 30)
+
+
+def test_blaise_api_client_post(requests_mock):
+    requests_mock.post(
+        "http://localhost:90/api/v2/serverparks/gusty/questionnaires/opn2101a/data",
+        status_code=202,
+    )
+    client = BlaiseApiClient("localhost:90", "gusty", read_timeout=60)
+
+    response = client.post(
+        "questionnaires/opn2101a/data", json={"questionnaireDataPath": "opn2101a"}
+    )
+
+    assert response.status_code == 202
+    assert requests_mock.last_request.timeout == (5, 60)
+
+
+def test_blaise_api_client_reuses_its_session():
+    client = BlaiseApiClient("localhost:90", "gusty")
+
+    assert isinstance(client.session, requests.Session)
+    assert client.session.get_adapter("http://localhost:90") is (
+        client.session.get_adapter("http://localhost:90/other")
+    )
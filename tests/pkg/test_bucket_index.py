@@ -0,0 +1,89 @@
+from datetime import datetime
+from unittest import mock
+
+import pybase64
+
+from pkg.bucket_index import BlobEntry, BucketIndex
+
+
+def fake_blob(name, md5_hash=None, metadata=None):
+    blob = mock.MagicMock(
+        md5_hash=md5_hash,
+        size=17,
+        generation=1621506113000000,
+        time_created=datetime.fromisoformat("2021-05-20T10:21:53+00:00"),
+        updated=datetime.fromisoformat("2021-05-21T09:00:00+00:00"),
+        metadata=metadata,
+    )
+    blob.name = name
+    return blob
+
+
+def test_blob_entry_from_blob():
+    blob = fake_blob(
+        "opn2101a/opn2101a.bdbx",
+        md5_hash=pybase64.b64encode(b"foobar"),
+        metadata={"source_size": "17"},
+    )
+    assert BlobEntry.from_blob(blob) == BlobEntry(
+        name="opn2101a/opn2101a.bdbx",
+        md5="666f6f626172",
+        size=17,
+        generation=1621506113000000,
+        time_created=datetime.fromisoformat("2021-05-20T10:21:53+00:00"),
+        updated=datetime.fromisoformat("2021-05-21T09:00:00+00:00"),
+        metadata={"source_size": "17"},
+    )
+
+
+def test_blob_entry_from_composed_blob_takes_the_source_md5():
+    blob = fake_blob(
+        "opn2101a/opn2101a.bdbx",
+        metadata={"source_md5": "50cc5a0bbd05754f98022a25566220fe"},
+    )
+    assert BlobEntry.from_blob(blob).md5 == "50cc5a0bbd05754f98022a25566220fe"
+
+
+def test_blob_entry_has_metadata():
+    entry = BlobEntry(name="test.txt", metadata={"source_size": "17", "other": "1"})
+    assert entry.has_metadata({"source_size": "17"}) is True
+    assert entry.has_metadata({"source_size": "18"}) is False
+    assert BlobEntry(name="test.txt").has_metadata({"source_size": "17"}) is False
+
+
+def test_bucket_index_from_blobs():
+    bucket_index = BucketIndex.from_blobs(
+        [
+            fake_blob("foobar"),
+            fake_blob("opn2101a/oPn2101A.BdBx"),
+            fake_blob("opn2101a/FrameSOC.blix"),
+            fake_blob("opn2103a/opn2103a.bdbx"),
+        ]
+    )
+
+    assert sorted(bucket_index.files("OPN2101A")) == ["framesoc.blix", "opn2101a.bdbx"]
+    assert sorted(bucket_index.files("opn2103a")) == ["opn2103a.bdbx"]
+    assert bucket_index.files("opn2102a") == {}
+
+
+def test_bucket_index_get():
+    bucket_index = BucketIndex.from_blobs([fake_blob("opn2101a/oPn2101A.BdBx")])
+
+    entry = bucket_index.get("opn2101a/opn2101a.bdbx")
+    assert entry is not None
+    assert entry.name == "opn2101a/oPn2101A.BdBx"
+    assert bucket_index.get("opn2101a/opn2101a.bdix") is None
+
+
+def test_bucket_index_find_content():
+    bucket_index = BucketIndex.from_blobs(
+        [
+            fake_blob("opn2101a/FrameSOC.blix", md5_hash=pybase64.b64encode(b"foobar")),
+            fake_blob("opn2101a/opn2101a.bdbx"),
+        ]
+    )
+
+    entry = bucket_index.find_content("666f6f626172", 17)
+    assert entry is not None
+    assert entry.name == "opn2101a/FrameSOC.blix"
+    assert bucket_index.find_content("666f6f626172", 18) is None
@@ -1,15 +1,23 @@
 import io
 import logging
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from unittest import mock
 
+import pybase64
 import pytest
 import requests
+from google.api_core import exceptions as api_exceptions
 
 from models import Instrument
-from pkg.case_mover import CaseMover
-from pkg.gcs_stream_upload import GCSObjectStreamUpload
+from pkg.bucket_index import BlobEntry, BucketIndex
+from pkg.case_mover import CaseMover, composite_part_ranges
+from pkg.checksums import StreamChecksums, UploadIntegrityError
+from pkg.deadline import Deadline, DeadlineExceeded
+from pkg.gcs_stream_upload import GCSObjectStreamUpload, ResumableSession
 from pkg.google_storage import GoogleStorage
+from pkg.sftp import SFTP
 
 
 @pytest.fixture()
@@ -28,11 +36,30 @@ def get_contents(buffer: io.BytesIO) -> bytes:
     return buffer.read()
 
 
+@pytest.fixture()
+def config(config):
+    # most tests here cover streaming, uploads in one request are tested apart
+    config.multipart_upload_threshold = 0
+    return config
+
+
 @pytest.fixture()
 def case_mover(google_storage, config, mock_sftp):
     return CaseMover(google_storage, config, mock_sftp)
 
 
+@pytest.fixture(autouse=True)
+def resumable_sessions():
+    with mock.patch.dict("pkg.case_mover._resumable_sessions", clear=True) as sessions:
+        yield sessions
+
+
+@pytest.fixture(autouse=True)
+def content_indexes():
+    with mock.patch.dict("pkg.case_mover._content_indexes", clear=True) as indexes:
+        yield indexes
+
+
 @mock.patch.object(GoogleStorage, "get_blob_md5")
 def test_bdbx_md5_changed_when_match(mock_get_blob_md5, case_mover):
     mock_get_blob_md5.return_value = "my_lovely_md5"
@@ -91,7 +118,7 @@ def test_sync_instrument(mock_sync_file, case_mover):
     )
     case_mover.sync_instrument(instrument)
     mock_sync_file.assert_called_once_with(
-        "opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx"
+        "opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx", deadline=None
     )
 
 
@@ -126,6 +153,32 @@ def test_sync_file(
     assert mock_stream_upload.call_count == len(fake_content)
 
 
+@mock.patch.object(GCSObjectStreamUpload, "write")
+@mock.patch.object(GCSObjectStreamUpload, "stop")
+@mock.patch.object(GCSObjectStreamUpload, "start")
+@mock.patch.object(GCSObjectStreamUpload, "__init__")
+def test_sync_file_stamps_source_fingerprint(
+    mock_stream_upload_init,
+    _mock_stream_upload_start,
+    _mock_stream_upload_stop,
+    _mock_stream_upload,
+    mock_sftp_connection,
+    mock_stat,
+    mock_sftp_file,
+    case_mover,
+):
+    mock_sftp_file(b"My fake bdbx file")
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17, st_mtime=1621506113)
+    mock_stream_upload_init.return_value = None
+
+    case_mover.sync_file("opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx")
+
+    assert mock_stream_upload_init.call_args.kwargs["metadata"] == {
+        "source_size": "17",
+        "source_mtime": "1621506113",
+    }
+
+
 @mock.patch.object(GCSObjectStreamUpload, "start")
 @mock.patch.object(GCSObjectStreamUpload, "__init__")
 def test_sync_file_exception(
@@ -288,19 +341,27 @@ def test_sync_with_too_many_retries_on_read_timeout(
     ) in caplog.record_tuples
 
 
-@mock.patch.object(requests, "post")
-def test_send_request_to_api(mock_requests_post, case_mover, config):
-    case_mover.send_request_to_api("opn2101a")
-    mock_requests_post.assert_called_once_with(
-        (
-            f"http://{config.blaise_api_url}/api/v2/serverparks/"
-            + f"{config.server_park}/questionnaires/opn2101a/data"
-        ),
-        json={"questionnaireDataPath": "opn2101a"},
-        headers={"content-type": "application/json"},
-        timeout=(30),
+def test_send_request_to_api(requests_mock, case_mover, config):
+    requests_mock.post(
+        f"http://{config.blaise_api_url}/api/v2/serverparks/"
+        + f"{config.server_park}/questionnaires/opn2101a/data",
+        status_code=202,
     )
 
+    case_mover.send_request_to_api("opn2101a")
+
+    assert requests_mock.call_count == 1
+    assert requests_mock.last_request.json() == {"questionnaireDataPath": "opn2101a"}
+    assert requests_mock.last_request.headers["content-type"] == "application/json"
+    assert requests_mock.last_request.timeout == (5, 30)
+
+
+def test_case_mover_shares_blaise_api_client(google_storage, config, mock_sftp):
+    first = CaseMover(google_storage, config, mock_sftp)
+    second = CaseMover(google_storage, config, mock_sftp)
+
+    assert first.blaise_api is second.blaise_api
+
 
 def test_instrument_exists_in_blaise(config, requests_mock, case_mover):
     requests_mock.get(
@@ -320,8 +381,12 @@ def test_instrument_exists_in_blaise_exists(config, requests_mock, case_mover):
     assert case_mover.instrument_exists_in_blaise("opn2101a") is True
 
 
+@mock.patch.object(CaseMover, "get_blaise_questionnaire_names")
 @mock.patch.object(CaseMover, "instrument_exists_in_blaise")
-def test_filter_existing_instruments(mock_instrument_exists_in_blaise, case_mover):
+def test_filter_existing_instruments(
+    mock_instrument_exists_in_blaise, mock_get_blaise_questionnaire_names, case_mover
+):
+    mock_get_blaise_questionnaire_names.return_value = None
     mock_instrument_exists_in_blaise.side_effect = lambda instrument_name: (
         True if instrument_name.startswith("opn") else False
     )
@@ -337,6 +402,63 @@ def test_filter_existing_instruments(mock_instrument_exists_in_blaise, case_move
     }
 
 
+def test_get_blaise_questionnaire_names(config, requests_mock, case_mover):
+    requests_mock.get(
+        f"http://{config.blaise_api_url}/api/v2/serverparks/"
+        + f"{config.server_park}/questionnaires",
+        json=[{"name": "OPN2101A"}, {"name": "lms2101a"}],
+    )
+    assert case_mover.get_blaise_questionnaire_names() == {"opn2101a", "lms2101a"}
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        {"status_code": 500, "text": "oops"},
+        {"text": "not json"},
+        {"json": [{"not_name": "OPN2101A"}]},
+        {"exc": requests.exceptions.ConnectTimeout},
+    ],
+)
+def test_get_blaise_questionnaire_names_when_listing_fails(
+    config, requests_mock, case_mover, caplog, response
+):
+    requests_mock.get(
+        f"http://{config.blaise_api_url}/api/v2/serverparks/"
+        + f"{config.server_park}/questionnaires",
+        **response,
+    )
+    with caplog.at_level(logging.WARNING):
+        assert case_mover.get_blaise_questionnaire_names() is None
+    assert any(
+        "checking each instrument instead" in message for message in caplog.messages
+    )
+
+
+@mock.patch.object(CaseMover, "instrument_exists_in_blaise")
+def test_filter_existing_instruments_from_questionnaire_list(
+    mock_instrument_exists_in_blaise, config, requests_mock, case_mover
+):
+    requests_mock.get(
+        f"http://{config.blaise_api_url}/api/v2/serverparks/"
+        + f"{config.server_park}/questionnaires",
+        json=[{"name": "OPN2101A"}, {"name": "LMS2102A"}],
+    )
+    instruments = {
+        "OPN2101A": Instrument(sftp_path="./ONS/OPN/OPN2101A"),
+        "oPn2101a": Instrument(sftp_path="./ONS/OPN/oPn2101a"),
+        "LMS2101A": Instrument(sftp_path="./ONS/OPN/LMS2101A"),
+    }
+
+    filtered_instruments = case_mover.filter_existing_instruments(instruments)
+
+    assert filtered_instruments == {
+        "OPN2101A": Instrument(sftp_path="./ONS/OPN/OPN2101A"),
+        "oPn2101a": Instrument(sftp_path="./ONS/OPN/oPn2101a"),
+    }
+    mock_instrument_exists_in_blaise.assert_not_called()
+
+
 @mock.patch.object(GoogleStorage, "list_blobs")
 def test_get_instrument_blobs(mock_list_blobs, case_mover, fake_blob):
     instrument = Instrument(
@@ -358,6 +480,11 @@ def test_get_instrument_blobs(mock_list_blobs, case_mover, fake_blob):
         "opn2103a.bdix",
         "framesoc.blix",
     ]
+    mock_list_blobs.assert_called_once_with(
+        prefix="opn2103a/",
+        delimiter="/",
+        fields="items(name,md5Hash,size,updated),nextPageToken",
+    )
 
 
 @mock.patch.object(CaseMover, "get_instrument_blobs")
@@ -423,3 +550,1007 @@ def test_instrument_needs_updating(case_mover, bdbx_changed, gcp_missing_files,
                 ],
             )
             assert case_mover.instrument_needs_updating(instrument) is result
+
+
+@pytest.fixture()
+def fingerprinted_instrument():
+    return Instrument(
+        sftp_path="ONS/OPN/OPN2103A",
+        bdbx_updated_at=datetime.fromisoformat("2021-05-20T10:21:53+00:00"),
+        bdbx_size=17,
+        files=[
+            "oPn2103A.BdBx",
+        ],
+    )
+
+
+def fake_bdbx_blob(metadata, md5_hash=pybase64.b64encode(b"my_lovely_md5")):
+    blob = mock.MagicMock(metadata=metadata, md5_hash=md5_hash)
+    blob.name = "opn2103a/opn2103a.bdbx"
+    return blob
+
+
+@mock.patch.object(SFTP, "generate_bdbx_md5")
+@mock.patch.object(GoogleStorage, "get_blob")
+def test_bdbx_changed_when_fingerprint_matches(
+    mock_get_blob, mock_generate_bdbx_md5, case_mover, fingerprinted_instrument
+):
+    mock_get_blob.return_value = fake_bdbx_blob(
+        {"source_size": "17", "source_mtime": "1621506113"}
+    )
+
+    assert case_mover.bdbx_changed(fingerprinted_instrument) is False
+    mock_get_blob.assert_called_with("opn2103a/opn2103a.bdbx")
+    mock_generate_bdbx_md5.assert_not_called()
+
+
+@mock.patch.object(SFTP, "generate_bdbx_md5")
+@mock.patch.object(GoogleStorage, "get_blob")
+def test_bdbx_changed_when_no_gcp_file(
+    mock_get_blob, mock_generate_bdbx_md5, case_mover, fingerprinted_instrument
+):
+    mock_get_blob.return_value = None
+
+    assert case_mover.bdbx_changed(fingerprinted_instrument) is True
+    mock_generate_bdbx_md5.assert_not_called()
+
+
+@mock.patch.object(GoogleStorage, "update_blob_metadata")
+@mock.patch.object(SFTP, "generate_bdbx_md5")
+@mock.patch.object(GoogleStorage, "get_blob")
+def test_bdbx_changed_falls_back_to_md5_when_fingerprint_differs(
+    mock_get_blob,
+    mock_generate_bdbx_md5,
+    mock_update_blob_metadata,
+    case_mover,
+    fingerprinted_instrument,
+):
+    mock_get_blob.return_value = fake_bdbx_blob(
+        {"source_size": "17", "source_mtime": "1600000000"}
+    )
+    mock_generate_bdbx_md5.return_value = "another_md5_which_is_less_lovely"
+
+    assert case_mover.bdbx_changed(fingerprinted_instrument) is True
+    assert fingerprinted_instrument.bdbx_md5 == "another_md5_which_is_less_lovely"
+    mock_update_blob_metadata.assert_not_called()
+
+
+@mock.patch.object(GoogleStorage, "update_blob_metadata")
+@mock.patch.object(SFTP, "generate_bdbx_md5")
+@mock.patch.object(GoogleStorage, "get_blob")
+def test_bdbx_changed_records_fingerprint_when_md5_matches(
+    mock_get_blob,
+    mock_generate_bdbx_md5,
+    mock_update_blob_metadata,
+    case_mover,
+    fingerprinted_instrument,
+):
+    mock_get_blob.return_value = fake_bdbx_blob(None)
+    mock_generate_bdbx_md5.return_value = "6d795f6c6f76656c795f6d6435"
+
+    assert case_mover.bdbx_changed(fingerprinted_instrument) is False
+    mock_update_blob_metadata.assert_called_once_with(
+        "opn2103a/opn2103a.bdbx", {"source_size": "17", "source_mtime": "1621506113"}
+    )
+
+
+@mock.patch.object(CaseMover, "bdbx_md5_changed", return_value=True)
+@mock.patch.object(GoogleStorage, "get_blob")
+def test_bdbx_changed_uses_md5_when_known(
+    mock_get_blob, mock_bdbx_md5_changed, case_mover
+):
+    instrument = Instrument(
+        sftp_path="ONS/OPN/OPN2103A", bdbx_md5="my_lovely_md5", files=["oPn2103A.BdBx"]
+    )
+    assert case_mover.bdbx_changed(instrument) is True
+    mock_get_blob.assert_not_called()
+
+
+@mock.patch.object(CaseMover, "gcp_missing_files", return_value=False)
+@mock.patch.object(CaseMover, "bdbx_changed")
+def test_update_check_when_the_database_changed(
+    mock_bdbx_changed, _mock_gcp_missing_files, case_mover
+):
+    mock_bdbx_changed.return_value = True
+    instrument = Instrument(sftp_path="./ONS/OPN/OPN2101A", bdbx_md5="new-md5")
+
+    assert case_mover.update_check("OPN2101A", instrument) == (
+        "OPN2101A",
+        instrument,
+        True,
+    )
+    assert instrument.bdbx_md5 == "new-md5"
+
+
+@mock.patch.object(CaseMover, "gcp_missing_files", return_value=True)
+@mock.patch.object(CaseMover, "bdbx_changed", return_value=False)
+def test_update_check_leaves_out_unchanged_md5_when_files_are_missing(
+    _mock_bdbx_changed, _mock_gcp_missing_files, case_mover
+):
+    instrument = Instrument(sftp_path="./ONS/OPN/OPN2101A", bdbx_md5="imported-md5")
+
+    assert case_mover.update_check("OPN2101A", instrument) == (
+        "OPN2101A",
+        instrument,
+        True,
+    )
+    assert instrument.bdbx_md5 is None
+
+
+@mock.patch.object(CaseMover, "gcp_missing_files", return_value=False)
+@mock.patch.object(CaseMover, "bdbx_changed", return_value=False)
+def test_update_check_when_nothing_changed(
+    _mock_bdbx_changed, _mock_gcp_missing_files, case_mover
+):
+    instrument = Instrument(sftp_path="./ONS/OPN/OPN2101A", bdbx_md5="imported-md5")
+
+    assert case_mover.update_check("OPN2101A", instrument)[2] is False
+    assert instrument.bdbx_md5 == "imported-md5"
+
+
+def test_iter_update_checks_on_separate_channels(case_mover, config):
+    config.sftp_scan_concurrency = 2
+    case_mover.bucket_index = BucketIndex()
+    channels = [mock.MagicMock(), mock.MagicMock()]
+    both_running = threading.Barrier(2, timeout=5)
+    checked_on = []
+
+    @contextmanager
+    def fake_sftp_channels(sftp_connection, count):
+        assert count == 2
+        yield channels
+
+    def bdbx_changed(worker, instrument):
+        assert worker.bucket_index is case_mover.bucket_index
+        checked_on.append(worker.sftp.sftp_connection)
+        both_running.wait()
+        return instrument.sftp_path.endswith("OPN2101A")
+
+    instruments = {
+        "OPN2101A": Instrument(sftp_path="./ONS/OPN/OPN2101A"),
+        "OPN2102A": Instrument(sftp_path="./ONS/OPN/OPN2102A"),
+    }
+    with mock.patch("pkg.sftp.sftp_channels", fake_sftp_channels), mock.patch.object(
+        CaseMover, "bdbx_changed", bdbx_changed
+    ), mock.patch.object(CaseMover, "gcp_missing_files", return_value=False):
+        checks = sorted(case_mover.iter_update_checks(instruments))
+
+    assert checks == [
+        ("OPN2101A", instruments["OPN2101A"], True),
+        ("OPN2102A", instruments["OPN2102A"], False),
+    ]
+    assert sorted(map(id, checked_on)) == sorted(map(id, channels))
+
+
+def test_iter_update_checks_yields_each_check_as_it_finishes(case_mover, config):
+    config.sftp_scan_concurrency = 2
+    second_yielded = threading.Event()
+
+    @contextmanager
+    def fake_sftp_channels(sftp_connection, count):
+        yield [mock.MagicMock(), mock.MagicMock()]
+
+    def bdbx_changed(worker, instrument):
+        if instrument.sftp_path.endswith("OPN2101A"):
+            # a slow hash, only finishing once the check after it is yielded
+            assert second_yielded.wait(timeout=5)
+        return True
+
+    instruments = {
+        "OPN2101A": Instrument(sftp_path="./ONS/OPN/OPN2101A"),
+        "OPN2102A": Instrument(sftp_path="./ONS/OPN/OPN2102A"),
+    }
+    with mock.patch("pkg.sftp.sftp_channels", fake_sftp_channels), mock.patch.object(
+        CaseMover, "bdbx_changed", bdbx_changed
+    ):
+        checks = case_mover.iter_update_checks(instruments)
+        assert next(checks)[0] == "OPN2102A"
+        second_yielded.set()
+        assert next(checks)[0] == "OPN2101A"
+
+
+@mock.patch("pkg.sftp.sftp_channels")
+@mock.patch.object(CaseMover, "bdbx_changed", return_value=True)
+def test_iter_update_checks_runs_inline_when_not_concurrent(
+    _mock_bdbx_changed, mock_sftp_channels, case_mover, config
+):
+    config.sftp_scan_concurrency = 1
+    instruments = {
+        "OPN2101A": Instrument(sftp_path="./ONS/OPN/OPN2101A"),
+        "OPN2102A": Instrument(sftp_path="./ONS/OPN/OPN2102A"),
+    }
+
+    assert list(case_mover.iter_update_checks(instruments)) == [
+        (name, instrument, True) for name, instrument in instruments.items()
+    ]
+    mock_sftp_channels.assert_not_called()
+
+
+@mock.patch.object(GCSObjectStreamUpload, "write")
+@mock.patch.object(GCSObjectStreamUpload, "stop")
+@mock.patch.object(GCSObjectStreamUpload, "start")
+@mock.patch.object(GCSObjectStreamUpload, "__init__")
+def test_sync_instrument_records_streamed_bdbx_md5(
+    mock_stream_upload_init,
+    _mock_stream_upload_start,
+    _mock_stream_upload_stop,
+    _mock_stream_upload,
+    mock_sftp_file,
+    case_mover,
+):
+    mock_sftp_file(b"My fake bdbx file")
+    mock_stream_upload_init.return_value = None
+    instrument = Instrument(sftp_path="./ONS/OPN/OPN2103A", files=["oPn2103A.BdBx"])
+
+    case_mover.sync_instrument(instrument)
+
+    assert instrument.bdbx_md5 == "50cc5a0bbd05754f98022a25566220fe"
+
+
+@mock.patch.object(CaseMover, "sync_file")
+def test_sync_instrument_keeps_bdbx_md5_when_the_upload_has_none(
+    mock_sync_file, case_mover
+):
+    # as a composite upload returns when md5sum is unavailable
+    mock_sync_file.return_value = StreamChecksums.combine([])
+    instrument = Instrument(
+        sftp_path="./ONS/OPN/OPN2103A",
+        files=["oPn2103A.BdBx"],
+        bdbx_md5="50cc5a0bbd05754f98022a25566220fe",
+    )
+
+    assert case_mover.sync_instrument(instrument) is True
+    assert instrument.bdbx_md5 == "50cc5a0bbd05754f98022a25566220fe"
+
+
+@mock.patch.object(GoogleStorage, "list_blobs")
+def test_load_bucket_index(mock_list_blobs, case_mover, fake_blob):
+    mock_list_blobs.return_value = []
+
+    case_mover.load_bucket_index(prefix="opn2103a/")
+
+    assert case_mover.bucket_index == BucketIndex()
+    mock_list_blobs.assert_called_once_with(
+        prefix="opn2103a/",
+        fields=(
+            "items(name,md5Hash,size,generation,timeCreated,updated,metadata),"
+            "nextPageToken"
+        ),
+    )
+
+
+@mock.patch.object(GoogleStorage, "get_blob_md5")
+def test_bdbx_md5_changed_uses_bucket_index(mock_get_blob_md5, case_mover):
+    case_mover.bucket_index = BucketIndex()
+    case_mover.bucket_index.add(
+        BlobEntry(name="opn2103a/opn2103a.bdbx", md5="my_lovely_md5")
+    )
+    instrument = Instrument(
+        sftp_path="ONS/OPN/OPN2103A",
+        bdbx_md5="my_lovely_md5",
+        files=["oPn2103A.BdBx"],
+    )
+
+    assert case_mover.bdbx_md5_changed(instrument) is False
+    instrument.bdbx_md5 = "another_md5_which_is_less_lovely"
+    assert case_mover.bdbx_md5_changed(instrument) is True
+    mock_get_blob_md5.assert_not_called()
+
+
+@mock.patch.object(GoogleStorage, "list_blobs")
+def test_gcp_missing_files_uses_bucket_index(mock_list_blobs, case_mover):
+    case_mover.bucket_index = BucketIndex()
+    case_mover.bucket_index.add(BlobEntry(name="opn2103a/opn2103a.bdbx"))
+    case_mover.bucket_index.add(BlobEntry(name="opn2103a/framesoc.blix"))
+    instrument = Instrument(
+        sftp_path="ONS/OPN/OPN2103A", files=["oPn2103A.BdBx", "FrameSOC.blix"]
+    )
+
+    assert case_mover.gcp_missing_files(instrument) is False
+    instrument.files.append("oPn2103A.BdIx")
+    assert case_mover.gcp_missing_files(instrument) is True
+    mock_list_blobs.assert_not_called()
+
+
+@mock.patch.object(CaseMover, "sync_file")
+def test_sync_instrument_syncs_bdbx_last(mock_sync_file, case_mover, config):
+    config.file_sync_concurrency = 1
+    mock_sync_file.return_value = StreamChecksums()
+    instrument = Instrument(
+        sftp_path="./ONS/OPN/OPN2103A",
+        files=["oPn2103A.BdBx", "oPn2103A.BdIx", "oPn2103A.BmIx"],
+    )
+
+    case_mover.sync_instrument(instrument)
+
+    assert mock_sync_file.call_args_list == [
+        mock.call(
+            "opn2103a/opn2103a.bdix", "./ONS/OPN/OPN2103A/oPn2103A.BdIx", deadline=None
+        ),
+        mock.call(
+            "opn2103a/opn2103a.bmix", "./ONS/OPN/OPN2103A/oPn2103A.BmIx", deadline=None
+        ),
+        mock.call(
+            "opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx", deadline=None
+        ),
+    ]
+    assert instrument.bdbx_md5 == "d41d8cd98f00b204e9800998ecf8427e"
+
+
+@mock.patch.object(CaseMover, "transfer_file")
+def test_sync_instrument_stops_starting_files_at_the_deadline(
+    mock_transfer_file, case_mover, config, mock_sftp_connection, mock_stat
+):
+    config.file_sync_concurrency = 1
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=10)
+    mock_transfer_file.return_value = StreamChecksums()
+    instrument = Instrument(
+        sftp_path="./ONS/OPN/OPN2103A",
+        files=["oPn2103A.BdBx", "oPn2103A.BdIx", "oPn2103A.BmIx"],
+    )
+    # already inside the margin, so only the first file is started
+    deadline = Deadline(timeout=10, margin=30, transfer_rate=1024)
+
+    with pytest.raises(
+        DeadlineExceeded, match="Not starting ./ONS/OPN/OPN2103A/oPn2103A.BmIx"
+    ):
+        case_mover.sync_instrument(instrument, deadline)
+
+    assert [call.args[1] for call in mock_transfer_file.call_args_list] == [
+        "./ONS/OPN/OPN2103A/oPn2103A.BdIx"
+    ]
+    assert instrument.bdbx_md5 is None
+
+
+@mock.patch.object(CaseMover, "sync_file")
+def test_sync_instrument_only_syncs_changed_files(
+    mock_sync_file, case_mover, config, mock_sftp_connection, mock_list_dir_attr
+):
+    config.file_sync_concurrency = 1
+    mock_sync_file.return_value = StreamChecksums()
+    mock_sftp_connection.listdir_attr.return_value = [
+        mock_list_dir_attr("oPn2103A.BdBx", st_mtime=1621506113, st_size=20),
+        mock_list_dir_attr("oPn2103A.BdIx", st_mtime=1621506113, st_size=10),
+        mock_list_dir_attr("oPn2103A.BmIx", st_mtime=1621506113, st_size=10),
+        mock_list_dir_attr("FrameSOC.blix", st_mtime=1617186117, st_size=30),
+    ]
+    fingerprint = {"source_size": "10", "source_mtime": "1621506113"}
+    case_mover.bucket_index = BucketIndex()
+    for entry in [
+        # different size, same modified time
+        BlobEntry(name="opn2103a/opn2103a.bdbx", size=17, metadata=fingerprint),
+        BlobEntry(name="opn2103a/opn2103a.bdix", size=10, metadata=fingerprint),
+        # same size, modified since
+        BlobEntry(
+            name="opn2103a/opn2103a.bmix",
+            size=10,
+            metadata={"source_size": "10", "source_mtime": "1617186113"},
+        ),
+        BlobEntry(
+            name="opn2103a/framesoc.blix",
+            size=30,
+            metadata={"source_size": "30", "source_mtime": "1617186117"},
+        ),
+    ]:
+        case_mover.bucket_index.add(entry)
+    instrument = Instrument(
+        sftp_path="./ONS/OPN/OPN2103A",
+        files=["oPn2103A.BdBx", "oPn2103A.BdIx", "oPn2103A.BmIx", "FrameSOC.blix"],
+    )
+
+    case_mover.sync_instrument(instrument)
+
+    mock_sftp_connection.listdir_attr.assert_called_once_with("./ONS/OPN/OPN2103A")
+    assert mock_sync_file.call_args_list == [
+        mock.call(
+            "opn2103a/opn2103a.bmix", "./ONS/OPN/OPN2103A/oPn2103A.BmIx", deadline=None
+        ),
+        mock.call(
+            "opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx", deadline=None
+        ),
+    ]
+
+
+@mock.patch.object(CaseMover, "sync_file")
+def test_sync_instrument_syncs_every_file_when_listing_fails(
+    mock_sync_file, case_mover, config, mock_sftp_connection, caplog
+):
+    config.file_sync_concurrency = 1
+    mock_sync_file.return_value = StreamChecksums()
+    mock_sftp_connection.listdir_attr.side_effect = IOError("listing failed")
+    instrument = Instrument(
+        sftp_path="./ONS/OPN/OPN2103A",
+        files=["oPn2103A.BdBx", "oPn2103A.BdIx"],
+    )
+
+    with caplog.at_level(logging.WARNING):
+        case_mover.sync_instrument(instrument)
+
+    assert mock_sync_file.call_count == 2
+    assert (
+        "Failed to list files in ./ONS/OPN/OPN2103A, syncing them all: listing failed"
+        in caplog.messages
+    )
+
+
+@mock.patch.object(GoogleStorage, "get_blob")
+def test_blob_matches_source_without_bucket_index(
+    mock_get_blob, case_mover, mock_list_dir_attr
+):
+    mock_get_blob.return_value = fake_bdbx_blob(
+        {"source_size": "17", "source_mtime": "1621506113"}
+    )
+    mock_get_blob.return_value.size = 17
+
+    assert case_mover.blob_matches_source(
+        "opn2103a/opn2103a.bdbx",
+        mock_list_dir_attr("oPn2103A.BdBx", st_mtime=1621506113, st_size=17),
+    )
+    assert not case_mover.blob_matches_source(
+        "opn2103a/opn2103a.bdbx",
+        mock_list_dir_attr("oPn2103A.BdBx", st_mtime=1621506114, st_size=17),
+    )
+    assert not case_mover.blob_matches_source("opn2103a/opn2103a.bdbx", None)
+    mock_get_blob.assert_called_with("opn2103a/opn2103a.bdbx")
+
+
+@mock.patch.object(CaseMover, "sync_file")
+def test_sync_instrument_skips_bdbx_when_a_file_fails(
+    mock_sync_file, case_mover, config, caplog
+):
+    config.file_sync_concurrency = 1
+    mock_sync_file.side_effect = [None, StreamChecksums()]
+    instrument = Instrument(
+        sftp_path="./ONS/OPN/OPN2103A",
+        files=["oPn2103A.BdBx", "oPn2103A.BdIx", "oPn2103A.BmIx"],
+    )
+
+    with caplog.at_level(logging.ERROR):
+        case_mover.sync_instrument(instrument)
+
+    assert mock_sync_file.call_count == 2
+    assert instrument.bdbx_md5 is None
+    assert (
+        "root",
+        logging.ERROR,
+        "Not syncing ./ONS/OPN/OPN2103A/oPn2103A.BdBx as "
+        "./ONS/OPN/OPN2103A/oPn2103A.BdIx failed to sync",
+    ) in caplog.record_tuples
+
+
+def test_sync_files_runs_concurrently_on_separate_channels(case_mover, config):
+    config.file_sync_concurrency = 2
+    channels = [mock.MagicMock(), mock.MagicMock()]
+    both_running = threading.Barrier(2, timeout=5)
+    used_channels = []
+
+    @contextmanager
+    def fake_sftp_channels(sftp_connection, count):
+        assert count == 2
+        yield channels
+
+    def fake_sync_file(blob_filepath, sftp_path, sftp_connection=None, deadline=None):
+        used_channels.append(sftp_connection)
+        both_running.wait()
+        return StreamChecksums()
+
+    with mock.patch("pkg.sftp.sftp_channels", fake_sftp_channels), mock.patch.object(
+        case_mover, "sync_file", side_effect=fake_sync_file
+    ):
+        results = case_mover.sync_files(
+            [
+                ("opn2103a/opn2103a.bdix", "./ONS/OPN/OPN2103A/oPn2103A.BdIx"),
+                ("opn2103a/opn2103a.bmix", "./ONS/OPN/OPN2103A/oPn2103A.BmIx"),
+            ]
+        )
+
+    assert list(results.keys()) == [
+        "./ONS/OPN/OPN2103A/oPn2103A.BdIx",
+        "./ONS/OPN/OPN2103A/oPn2103A.BmIx",
+    ]
+    assert all(results.values())
+    assert sorted(map(id, used_channels)) == sorted(map(id, channels))
+
+
+@mock.patch.object(GCSObjectStreamUpload, "write")
+@mock.patch.object(GCSObjectStreamUpload, "stop")
+@mock.patch.object(GCSObjectStreamUpload, "start")
+@mock.patch.object(GCSObjectStreamUpload, "__init__")
+def test_sync_file_reads_from_given_connection(
+    mock_stream_upload_init,
+    _mock_stream_upload_start,
+    _mock_stream_upload_stop,
+    _mock_stream_upload,
+    mock_sftp_connection,
+    mock_stat,
+    fake_sftp_file,
+    case_mover,
+):
+    mock_stream_upload_init.return_value = None
+    channel = mock.MagicMock()
+    channel.stat.return_value = mock_stat(st_size=17)
+    channel.open.return_value = fake_sftp_file(b"My fake bdbx file")
+
+    checksums = case_mover.sync_file(
+        "opn2103a/opn2103a.bdix",
+        "./ONS/OPN/OPN2103A/oPn2103A.BdIx",
+        sftp_connection=channel,
+    )
+
+    assert checksums.md5_hexdigest() == "50cc5a0bbd05754f98022a25566220fe"
+    mock_sftp_connection.open.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "file_size,parts,expected",
+    [
+        (17, 4, [(0, 6), (6, 6), (12, 5)]),
+        (12, 4, [(0, 3), (3, 3), (6, 3), (9, 3)]),
+        (4, 8, [(0, 3), (3, 1)]),
+        (1000, 64, [(offset, 33) for offset in range(0, 990, 33)] + [(990, 10)]),
+    ],
+)
+def test_composite_part_ranges(config, file_size, parts, expected):
+    config.bufsize = 3
+    config.composite_upload_parts = parts
+
+    assert composite_part_ranges(file_size, config) == expected
+
+
+@pytest.fixture()
+def composite_sync(case_mover, config, mock_sftp_connection, mock_stat):
+    content = b"My fake bdbx file"
+    config.bufsize = 3
+    config.composite_upload_threshold = 10
+    config.composite_upload_parts = 4
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17, st_mtime=1234)
+    uploads = {}
+
+    @contextmanager
+    def fake_sftp_channels(sftp_connection, count):
+        yield [mock_sftp_connection]
+
+    def fake_stream_to_blob(
+        sftp_connection, sftp_path, file_size, blob_filepath, offset, length, session
+    ):
+        uploads[blob_filepath] = content[offset : offset + length]
+        checksums = StreamChecksums()
+        checksums.update(uploads[blob_filepath])
+        return checksums
+
+    composed = mock.MagicMock()
+    composed.crc32c = pybase64.b64encode(bytes.fromhex("94eb13ae")).decode("utf-8")
+    # GCS has no MD5 for composite objects
+    composed.md5_hash = None
+
+    with mock.patch("pkg.sftp.sftp_channels", fake_sftp_channels), mock.patch.object(
+        case_mover, "stream_to_blob", side_effect=fake_stream_to_blob
+    ), mock.patch.object(
+        GoogleStorage, "compose_blobs", return_value=composed
+    ) as mock_compose_blobs, mock.patch.object(
+        GoogleStorage, "delete_blobs"
+    ) as mock_delete_blobs, mock.patch.object(
+        GoogleStorage, "update_blob_metadata"
+    ) as mock_update_blob_metadata, mock.patch.object(
+        SFTP, "remote_md5", return_value="50cc5a0bbd05754f98022a25566220fe"
+    ) as mock_remote_md5:
+        yield {
+            "uploads": uploads,
+            "composed": composed,
+            "remote_md5": mock_remote_md5,
+            "compose_blobs": mock_compose_blobs,
+            "delete_blobs": mock_delete_blobs,
+            "update_blob_metadata": mock_update_blob_metadata,
+        }
+
+
+def test_sync_file_composes_large_files_from_parts(case_mover, composite_sync):
+    checksums = case_mover.sync_file(
+        "opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx"
+    )
+
+    part_names = [
+        "_composite_parts/opn2103a/opn2103a.bdbx.part-00",
+        "_composite_parts/opn2103a/opn2103a.bdbx.part-01",
+        "_composite_parts/opn2103a/opn2103a.bdbx.part-02",
+    ]
+    assert composite_sync["uploads"] == {
+        part_names[0]: b"My fak",
+        part_names[1]: b"e bdbx",
+        part_names[2]: b" file",
+    }
+    composite_sync["compose_blobs"].assert_called_once_with(
+        "opn2103a/opn2103a.bdbx", part_names
+    )
+    composite_sync["delete_blobs"].assert_called_once_with(
+        part_names, on_error=mock.ANY
+    )
+    composite_sync["update_blob_metadata"].assert_called_once_with(
+        "opn2103a/opn2103a.bdbx",
+        {
+            "source_size": "17",
+            "source_mtime": "1234",
+            "source_md5": "50cc5a0bbd05754f98022a25566220fe",
+        },
+    )
+    assert checksums.crc32c_hexdigest() == "94eb13ae"
+    assert checksums.md5_hexdigest() == "50cc5a0bbd05754f98022a25566220fe"
+
+
+def test_sync_file_composes_without_md5_when_md5sum_is_unavailable(
+    case_mover, composite_sync
+):
+    composite_sync["remote_md5"].return_value = None
+
+    checksums = case_mover.sync_file(
+        "opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx"
+    )
+
+    composite_sync["update_blob_metadata"].assert_called_once_with(
+        "opn2103a/opn2103a.bdbx", {"source_size": "17", "source_mtime": "1234"}
+    )
+    assert checksums.crc32c_hexdigest() == "94eb13ae"
+    assert checksums.md5_hexdigest() is None
+
+
+def test_sync_file_rejects_composed_object_with_wrong_crc32c(
+    case_mover, composite_sync, caplog
+):
+    composite_sync["composed"].crc32c = pybase64.b64encode(b"\x00\x00\x00\x00")
+
+    with caplog.at_level(logging.ERROR):
+        assert (
+            case_mover.sync_file(
+                "opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx"
+            )
+            is None
+        )
+
+    # uploaded again before giving up
+    assert composite_sync["compose_blobs"].call_count == 4
+    assert composite_sync["delete_blobs"].call_count == 4
+    composite_sync["update_blob_metadata"].assert_not_called()
+    assert (
+        "opn2103a/opn2103a.bdbx has crc32c 00000000, expected 94eb13ae" in caplog.text
+    )
+
+
+def test_sync_file_uploads_again_when_the_object_is_corrupted(
+    case_mover, mock_sftp_connection, mock_stat, resumable_sessions
+):
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17, st_mtime=1234)
+    sessions = []
+
+    def fake_stream_to_blob(*args, session, **kwargs):
+        sessions.append(session)
+        if len(sessions) == 1:
+            raise UploadIntegrityError(
+                "opn2103a/opn2103a.bdbx", "crc32c", "00000000", "94eb13ae"
+            )
+        return StreamChecksums()
+
+    with mock.patch.object(
+        case_mover, "stream_to_blob", side_effect=fake_stream_to_blob
+    ):
+        checksums = case_mover.sync_file(
+            "opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx"
+        )
+
+    assert checksums is not None
+    assert len(sessions) == 2
+    assert sessions[0] is not sessions[1]
+    assert resumable_sessions == {}
+
+
+def test_for_sftp_connection(case_mover):
+    channel = mock.MagicMock()
+
+    worker = case_mover.for_sftp_connection(channel)
+
+    assert worker.sftp.sftp_connection is channel
+    assert worker.sftp.sftp_config is case_mover.sftp.sftp_config
+    assert worker.google_storage is case_mover.google_storage
+    assert worker.blaise_api is case_mover.blaise_api
+    assert worker.bucket_index is None
+
+
+def test_for_sftp_connection_shares_bucket_index(case_mover):
+    case_mover.bucket_index = BucketIndex()
+
+    worker = case_mover.for_sftp_connection(mock.MagicMock())
+
+    assert worker.bucket_index is case_mover.bucket_index
+
+
+@mock.patch.object(GCSObjectStreamUpload, "write")
+@mock.patch.object(GCSObjectStreamUpload, "stop")
+@mock.patch.object(GCSObjectStreamUpload, "start")
+@mock.patch.object(GCSObjectStreamUpload, "__init__")
+def test_stream_to_blob_resumes_from_session(
+    mock_stream_upload_init,
+    _mock_stream_upload_start,
+    _mock_stream_upload_stop,
+    mock_stream_upload,
+    config,
+    mock_sftp_connection,
+    fake_sftp_file,
+    case_mover,
+):
+    content = b"My fake bdbx file"
+    config.bufsize = 4
+    mock_sftp_connection.open.return_value = fake_sftp_file(content)
+    mock_stream_upload_init.return_value = None
+    session = ResumableSession(url="https://fake.invalid/upload?id=1")
+    session.checksums.update(content[:8])
+    written = bytearray()
+    mock_stream_upload.side_effect = written.extend
+
+    checksums = case_mover.stream_to_blob(
+        mock_sftp_connection,
+        "./ONS/OPN/OPN2103A/oPn2103A.BdBx",
+        len(content),
+        "opn2103a/opn2103a.bdbx",
+        session=session,
+    )
+
+    assert bytes(written) == content[8:]
+    assert mock_stream_upload_init.call_args.kwargs["session"] is session
+    assert checksums.md5_hexdigest() == "50cc5a0bbd05754f98022a25566220fe"
+
+
+def test_sync_file_keeps_the_upload_session_across_retries(
+    case_mover, mock_sftp_connection, mock_stat, resumable_sessions
+):
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17, st_mtime=1234)
+    sessions = []
+
+    def fake_stream_to_blob(*args, session, **kwargs):
+        sessions.append(session)
+        if len(sessions) == 1:
+            assert resumable_sessions
+            raise requests.exceptions.ReadTimeout()
+        return StreamChecksums()
+
+    with mock.patch.object(
+        case_mover, "stream_to_blob", side_effect=fake_stream_to_blob
+    ):
+        case_mover.sync_file(
+            "opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx"
+        )
+
+    assert len(sessions) == 2
+    assert sessions[0] is sessions[1]
+    assert not resumable_sessions
+
+
+def test_sync_file_starts_a_new_session_when_the_source_changes(
+    case_mover, mock_sftp_connection, mock_stat, resumable_sessions
+):
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17, st_mtime=1234)
+    stale_session = ResumableSession(url="https://fake.invalid/upload?id=1")
+    resumable_sessions[("test_bucket_name", "opn2103a/opn2103a.bdbx", 17, 1000)] = (
+        stale_session
+    )
+
+    with mock.patch.object(
+        case_mover, "stream_to_blob", return_value=StreamChecksums()
+    ) as mock_stream_to_blob:
+        case_mover.sync_file(
+            "opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx"
+        )
+
+    assert mock_stream_to_blob.call_args.kwargs["session"] is not stale_session
+
+
+@pytest.fixture()
+def duplicate_blix(case_mover, mock_sftp_connection, mock_stat):
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17, st_mtime=1234)
+    source = mock.MagicMock(
+        md5_hash=pybase64.b64encode(bytes.fromhex("50cc5a0bbd05754f98022a25566220fe")),
+        size=17,
+        generation=None,
+        metadata=None,
+    )
+    source.name = "opn2101a/framesoc.blix"
+    copied = mock.MagicMock(
+        md5_hash=source.md5_hash,
+        crc32c=pybase64.b64encode(bytes.fromhex("94eb13ae")).decode("utf-8"),
+    )
+    with mock.patch.object(
+        SFTP, "remote_md5", return_value="50cc5a0bbd05754f98022a25566220fe"
+    ), mock.patch.object(
+        GoogleStorage, "list_blobs", return_value=[source]
+    ) as mock_list_blobs, mock.patch.object(
+        GoogleStorage, "copy_blob", return_value=copied
+    ) as mock_copy_blob, mock.patch.object(
+        CaseMover, "stream_to_blob", return_value=StreamChecksums()
+    ) as mock_stream_to_blob:
+        yield {
+            "copied": copied,
+            "list_blobs": mock_list_blobs,
+            "copy_blob": mock_copy_blob,
+            "stream_to_blob": mock_stream_to_blob,
+        }
+
+
+def test_sync_file_copies_duplicate_within_the_bucket(case_mover, duplicate_blix):
+    checksums = case_mover.sync_file(
+        "opn2102a/framesoc.blix", "./ONS/OPN/OPN2102A/FrameSOC.blix"
+    )
+
+    duplicate_blix["copy_blob"].assert_called_once_with(
+        "opn2101a/framesoc.blix",
+        "opn2102a/framesoc.blix",
+        metadata={"source_size": "17", "source_mtime": "1234"},
+    )
+    duplicate_blix["stream_to_blob"].assert_not_called()
+    assert checksums.md5_hexdigest() == "50cc5a0bbd05754f98022a25566220fe"
+    assert checksums.crc32c_hexdigest() == "94eb13ae"
+
+
+def test_sync_file_lists_the_bucket_once_for_duplicates(case_mover, duplicate_blix):
+    for instrument in ["OPN2102A", "OPN2103A"]:
+        case_mover.sync_file(
+            f"{instrument.lower()}/framesoc.blix",
+            f"./ONS/OPN/{instrument}/FrameSOC.blix",
+        )
+
+    duplicate_blix["list_blobs"].assert_called_once()
+    assert duplicate_blix["copy_blob"].call_count == 2
+
+
+def test_sync_file_shares_the_bucket_listing_across_connections(
+    case_mover, duplicate_blix, mock_sftp_connection
+):
+    for instrument in ["OPN2102A", "OPN2103A"]:
+        case_mover.for_sftp_connection(mock_sftp_connection).sync_file(
+            f"{instrument.lower()}/framesoc.blix",
+            f"./ONS/OPN/{instrument}/FrameSOC.blix",
+        )
+
+    duplicate_blix["list_blobs"].assert_called_once()
+    assert duplicate_blix["copy_blob"].call_count == 2
+
+
+def test_sync_file_streams_files_not_deduplicated(case_mover, duplicate_blix):
+    case_mover.sync_file("opn2102a/opn2102a.bdix", "./ONS/OPN/OPN2102A/OPN2102A.bdix")
+
+    duplicate_blix["copy_blob"].assert_not_called()
+    duplicate_blix["stream_to_blob"].assert_called_once()
+
+
+def test_sync_file_streams_when_content_is_new(
+    case_mover, duplicate_blix, mock_stat, mock_sftp_connection
+):
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=18, st_mtime=1234)
+
+    case_mover.sync_file("opn2102a/framesoc.blix", "./ONS/OPN/OPN2102A/FrameSOC.blix")
+
+    duplicate_blix["copy_blob"].assert_not_called()
+    duplicate_blix["stream_to_blob"].assert_called_once()
+
+
+def test_sync_file_streams_when_remote_md5_is_unavailable(case_mover, duplicate_blix):
+    with mock.patch.object(SFTP, "remote_md5", return_value=None):
+        case_mover.sync_file(
+            "opn2102a/framesoc.blix", "./ONS/OPN/OPN2102A/FrameSOC.blix"
+        )
+
+    duplicate_blix["list_blobs"].assert_not_called()
+    duplicate_blix["stream_to_blob"].assert_called_once()
+
+
+def test_sync_file_streams_when_the_duplicate_is_composed(case_mover, duplicate_blix):
+    source = duplicate_blix["list_blobs"].return_value[0]
+    source.md5_hash = None
+    source.metadata = {"source_md5": "50cc5a0bbd05754f98022a25566220fe"}
+
+    case_mover.sync_file("opn2102a/framesoc.blix", "./ONS/OPN/OPN2102A/FrameSOC.blix")
+
+    duplicate_blix["copy_blob"].assert_not_called()
+    duplicate_blix["stream_to_blob"].assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "copy_result",
+    [api_exceptions.NotFound("gone"), mock.MagicMock(md5_hash=None)],
+)
+def test_sync_file_streams_when_the_copy_fails(case_mover, duplicate_blix, copy_result):
+    if isinstance(copy_result, Exception):
+        duplicate_blix["copy_blob"].side_effect = copy_result
+    else:
+        duplicate_blix["copy_blob"].return_value = copy_result
+
+    case_mover.sync_file("opn2102a/framesoc.blix", "./ONS/OPN/OPN2102A/FrameSOC.blix")
+
+    duplicate_blix["stream_to_blob"].assert_called_once()
+
+
+def test_sync_file_records_streamed_content_for_later_duplicates(
+    case_mover, duplicate_blix
+):
+    duplicate_blix["list_blobs"].return_value = []
+    streamed = StreamChecksums()
+    streamed.update(b"My fake bdbx file")
+    duplicate_blix["stream_to_blob"].return_value = streamed
+
+    case_mover.sync_file("opn2102a/framesoc.blix", "./ONS/OPN/OPN2102A/FrameSOC.blix")
+    case_mover.sync_file("opn2103a/framesoc.blix", "./ONS/OPN/OPN2103A/FrameSOC.blix")
+
+    duplicate_blix["stream_to_blob"].assert_called_once()
+    duplicate_blix["copy_blob"].assert_called_once_with(
+        "opn2102a/framesoc.blix",
+        "opn2103a/framesoc.blix",
+        metadata={"source_size": "17", "source_mtime": "1234"},
+    )
+
+
+@mock.patch.object(GoogleStorage, "upload_bytes")
+@mock.patch.object(GCSObjectStreamUpload, "__init__")
+def test_sync_file_uploads_small_files_in_one_request(
+    mock_stream_upload_init,
+    mock_upload_bytes,
+    config,
+    mock_sftp_connection,
+    mock_stat,
+    fake_sftp_file,
+    case_mover,
+):
+    config.multipart_upload_threshold = 18
+    config.bufsize = 4
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17, st_mtime=1234)
+    mock_sftp_connection.open.return_value = fake_sftp_file(b"My fake bdbx file")
+
+    checksums = case_mover.sync_file(
+        "opn2103a/opn2103a.bmix", "./ONS/OPN/OPN2103A/oPn2103A.BmIx"
+    )
+
+    assert checksums.md5_hexdigest() == "50cc5a0bbd05754f98022a25566220fe"
+    mock_upload_bytes.assert_called_once_with(
+        "opn2103a/opn2103a.bmix",
+        b"My fake bdbx file",
+        "UMxaC70FdU+YAiolVmIg/g==",
+        "lOsTrg==",
+        metadata={"source_size": "17", "source_mtime": "1234"},
+    )
+    mock_stream_upload_init.assert_not_called()
+
+
+def test_sync_file_sends_small_files_through_the_multipart_upload(
+    config, mock_sftp_connection, mock_stat, fake_sftp_file, case_mover
+):
+    config.multipart_upload_threshold = 18
+    config.bufsize = 4
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17, st_mtime=1234)
+    mock_sftp_connection.open.return_value = fake_sftp_file(b"My fake bdbx file")
+    transport = mock.MagicMock()
+    transport.request.return_value.status_code = 200
+    transport.request.return_value.headers = {}
+
+    with mock.patch.object(GoogleStorage, "authorized_session", return_value=transport):
+        checksums = case_mover.sync_file(
+            "opn2103a/opn2103a.bmix", "./ONS/OPN/OPN2103A/oPn2103A.BmIx"
+        )
+
+    assert checksums.md5_hexdigest() == "50cc5a0bbd05754f98022a25566220fe"
+    transport.request.assert_called_once()
+    assert b"My fake bdbx file" in transport.request.call_args.kwargs["data"]
+
+
+@mock.patch.object(GoogleStorage, "upload_bytes")
+@mock.patch.object(CaseMover, "stream_to_blob", return_value=StreamChecksums())
+def test_sync_file_streams_files_at_the_multipart_threshold(
+    mock_stream_to_blob,
+    mock_upload_bytes,
+    config,
+    mock_sftp_connection,
+    mock_stat,
+    case_mover,
+):
+    config.multipart_upload_threshold = 17
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17, st_mtime=1234)
+
+    case_mover.sync_file("opn2103a/opn2103a.bdbx", "./ONS/OPN/OPN2103A/oPn2103A.BdBx")
+
+    mock_stream_to_blob.assert_called_once()
+    mock_upload_bytes.assert_not_called()
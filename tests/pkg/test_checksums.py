@@ -0,0 +1,83 @@
+import google_crc32c
+import pytest
+
+from pkg.checksums import StreamChecksums, crc32c_combine
+
+
+def test_stream_checksums():
+    checksums = StreamChecksums()
+    checksums.update(b"My fake ")
+    checksums.update(b"bdbx file")
+
+    assert checksums.bytes_hashed == 17
+    assert checksums.md5_hexdigest() == "50cc5a0bbd05754f98022a25566220fe"
+    assert checksums.crc32c_hexdigest() == "94eb13ae"
+
+
+def test_stream_checksums_when_empty():
+    checksums = StreamChecksums()
+
+    assert checksums.bytes_hashed == 0
+    assert checksums.md5_hexdigest() == "d41d8cd98f00b204e9800998ecf8427e"
+    assert checksums.crc32c_hexdigest() == "00000000"
+
+
+@pytest.mark.parametrize(
+    "first,second",
+    [
+        (b"My fake ", b"bdbx file"),
+        (b"", b"My fake bdbx file"),
+        (b"My fake bdbx file", b""),
+        (bytes(range(256)) * 1000, b"x" * 123457),
+    ],
+)
+def test_crc32c_combine(first, second):
+    assert crc32c_combine(
+        google_crc32c.value(first), google_crc32c.value(second), len(second)
+    ) == google_crc32c.value(first + second)
+
+
+def test_stream_checksums_combine():
+    parts = []
+    for data in [b"My fake ", b"bdbx ", b"file"]:
+        part = StreamChecksums()
+        part.update(data)
+        parts.append(part)
+
+    combined = StreamChecksums.combine(parts)
+
+    assert combined.bytes_hashed == 17
+    assert combined.crc32c_hexdigest() == "94eb13ae"
+    assert combined.md5_hexdigest() is None
+
+
+def test_copy_carries_on_independently():
+    checksums = StreamChecksums()
+    checksums.update(b"My fake ")
+
+    copied = checksums.copy()
+    copied.update(b"bdbx file")
+
+    assert checksums.bytes_hashed == 8
+    assert copied.bytes_hashed == 17
+    assert copied.md5_hexdigest() == "50cc5a0bbd05754f98022a25566220fe"
+    assert copied.crc32c_hexdigest() == "94eb13ae"
+
+
+def test_from_digests():
+    checksums = StreamChecksums.from_digests(
+        "50cc5a0bbd05754f98022a25566220fe", "94eb13ae", 17
+    )
+
+    assert checksums.md5_hexdigest() == "50cc5a0bbd05754f98022a25566220fe"
+    assert checksums.crc32c_hexdigest() == "94eb13ae"
+    assert checksums.bytes_hashed == 17
+
+
+def test_base64_digests():
+    checksums = StreamChecksums()
+    checksums.update(b"My fake bdbx file")
+
+    assert checksums.md5_base64() == "UMxaC70FdU+YAiolVmIg/g=="
+    assert checksums.crc32c_base64() == "lOsTrg=="
+    assert StreamChecksums.combine([checksums]).md5_base64() is None
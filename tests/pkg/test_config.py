@@ -25,6 +25,50 @@ def test_config_from_env():
     assert config.bucket_name == "nisra_bucket"
     assert config.project_id == "project_id"
     assert config.processor_topic_name == "processor_topic_name"
+    assert config.force_local_md5 is False
+    assert config.sftp_request_count == 64
+    assert config.sftp_request_size == 32768
+    assert config.sftp_scan_concurrency == 4
+    assert config.file_sync_concurrency == 4
+    assert config.multipart_upload_threshold == 8 * 1024 * 1024
+    assert config.composite_upload_threshold == 1024 * 1024 * 1024
+    assert config.composite_upload_parts == 8
+    assert config.processor_batch_bytes == 0
+    assert config.processor_batch_concurrency == 2
+
+
+@mock.patch.dict(
+    os.environ,
+    {
+        "SERVER_PARK": "server_park_foobar",
+        "BLAISE_API_URL": "blaise_api_url_haha",
+        "NISRA_BUCKET_NAME": "nisra_bucket",
+        "PROJECT_ID": "project_id",
+        "PROCESSOR_TOPIC_NAME": "processor_topic_name",
+        "FORCE_LOCAL_MD5": "True",
+    },
+)
+def test_config_from_env_force_local_md5():
+    config = Config.from_env()
+    assert config.force_local_md5 is True
+
+
+@mock.patch.dict(
+    os.environ,
+    {
+        "SERVER_PARK": "server_park_foobar",
+        "BLAISE_API_URL": "blaise_api_url_haha",
+        "NISRA_BUCKET_NAME": "nisra_bucket",
+        "PROJECT_ID": "project_id",
+        "PROCESSOR_TOPIC_NAME": "processor_topic_name",
+        "SFTP_REQUEST_COUNT": "128",
+        "SFTP_REQUEST_SIZE": "65536",
+    },
+)
+def test_config_from_env_sftp_read_pipeline():
+    config = Config.from_env()
+    assert config.sftp_request_count == 128
+    assert config.sftp_request_size == 65536
 
 
 @mock.patch.dict(os.environ, {})
@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+from pkg.deadline import Deadline, DeadlineExceeded
+
+
+def test_deadline_starts_work_until_something_has_finished():
+    deadline = Deadline(timeout=10, margin=30, transfer_rate=1)
+
+    deadline.check("instrument OPN2101A")
+    with deadline.transfer("oPn2101A.BdBx", 100):
+        pass
+
+    with pytest.raises(DeadlineExceeded, match="Not starting instrument OPN2102A"):
+        deadline.check("instrument OPN2102A")
+
+
+def test_deadline_expects_transfers_at_the_configured_rate(config):
+    config.function_timeout = 100
+    config.deadline_margin = 10
+    config.expected_transfer_rate = 1
+    deadline = Deadline.from_config(config, started=time.monotonic() - 50)
+    deadline._transfers = 1
+
+    deadline.check("a small file", 30)
+    with pytest.raises(DeadlineExceeded, match="expected to take 50s"):
+        deadline.check("a large file", 50)
+
+
+def test_deadline_expects_transfers_at_the_rate_seen_so_far():
+    deadline = Deadline(timeout=100, margin=10, transfer_rate=1)
+
+    with deadline.transfer("oPn2101A.BdBx", 1000):
+        time.sleep(0.01)
+
+    assert deadline.transfer_rate() > 1000
+    deadline.check("oPn2102A.BdBx", 1000 / deadline.transfer_rate())
@@ -0,0 +1,259 @@
+import base64
+import hashlib
+import json
+import re
+from unittest import mock
+
+import google_crc32c
+import pytest
+import requests
+
+from pkg.checksums import UploadIntegrityError
+from pkg.gcs_stream_upload import GCSObjectStreamUpload, ResumableSession
+
+CHUNK_SIZE = 256 * 1024
+
+
+class Interrupted(Exception):
+    """Stands in for a failure resumable-media does not retry itself."""
+
+
+class FakeUploadTransport:
+    def __init__(self):
+        self.received = bytearray()
+        self.payload_types = []
+        self.initiated = 0
+        # how to fail each chunk upload in turn, None to accept it
+        self.failures = []
+        self.session_expired = False
+
+    def request(self, method, url, data=None, headers=None, timeout=None):
+        response = requests.Response()
+        if method == "POST":
+            self.initiated += 1
+            self.received = bytearray()
+            self.session_expired = False
+            response.status_code = 200
+            response.headers["location"] = "https://fake.invalid/upload?id=1"
+            return response
+
+        if data is None:
+            return self._status(response)
+
+        failure = self.failures.pop(0) if self.failures else None
+        if failure == "reject":
+            response.status_code = 400
+            return response
+        if failure == "interrupt":
+            raise Interrupted()
+
+        self.payload_types.append(type(data))
+        self.received += data
+        if failure == "lost response":
+            raise Interrupted()
+        if re.match(r"bytes .*/\*$", headers["content-range"]):
+            return self._status(response)
+        response.status_code = 200
+        response._content = json.dumps(self._uploaded_object()).encode("utf-8")
+        return response
+
+    def _uploaded_object(self):
+        crc32c = google_crc32c.value(bytes(self.received)).to_bytes(4, "big")
+        return {
+            "generation": "1",
+            "md5Hash": base64.b64encode(hashlib.md5(self.received).digest()).decode(),
+            "crc32c": base64.b64encode(crc32c).decode(),
+        }
+
+    def _status(self, response):
+        if self.session_expired:
+            response.status_code = 404
+            return response
+        response.status_code = 308
+        if self.received:
+            response.headers["range"] = f"bytes=0-{len(self.received) - 1}"
+        return response
+
+
+@pytest.fixture
+def fake_transport():
+    return FakeUploadTransport()
+
+
+@pytest.fixture
+def google_storage(fake_transport):
+    google_storage = mock.MagicMock()
+    google_storage.authorized_session.return_value = fake_transport
+    google_storage.bucket.name = "test_bucket_name"
+    google_storage.bucket.blob.return_value.name = "opn2101a/opn2101a.bdbx"
+    return google_storage
+
+
+@pytest.mark.parametrize(
+    "write_size,total_size",
+    [
+        (1000, CHUNK_SIZE * 2 + 123),
+        (CHUNK_SIZE, CHUNK_SIZE * 3),
+        (CHUNK_SIZE * 2 + 7, CHUNK_SIZE * 4 + 14),
+        (100, 0),
+    ],
+)
+def test_stream_upload_uploads_all_bytes(
+    fake_transport, google_storage, write_size, total_size
+):
+    content = bytes(i % 251 for i in range(total_size))
+
+    with GCSObjectStreamUpload(
+        google_storage=google_storage,
+        blob_name="opn2101a/opn2101a.bdbx",
+        chunk_size=CHUNK_SIZE,
+    ) as upload:
+        for offset in range(0, total_size, write_size):
+            upload.write(content[offset : offset + write_size])
+
+    assert bytes(fake_transport.received) == content
+    assert upload.tell() == total_size
+
+
+def test_stream_upload_sends_full_chunks_without_copying(
+    fake_transport, google_storage
+):
+    with GCSObjectStreamUpload(
+        google_storage=google_storage,
+        blob_name="opn2101a/opn2101a.bdbx",
+        chunk_size=CHUNK_SIZE,
+    ) as upload:
+        upload.write(b"x" * (CHUNK_SIZE * 2 + 10))
+
+    assert fake_transport.payload_types == [memoryview, memoryview, memoryview]
+
+
+def test_stream_upload_read_keeps_unread_bytes(fake_transport, google_storage):
+    upload = GCSObjectStreamUpload(
+        google_storage=google_storage,
+        blob_name="opn2101a/opn2101a.bdbx",
+        chunk_size=CHUNK_SIZE,
+    )
+    upload.write(b"foobar")
+
+    assert upload.read(3) == b"foo"
+    assert bytes(upload.read(3)) == b"bar"
+    assert upload.tell() == 6
+
+
+def test_stream_upload_sends_custom_metadata(fake_transport, google_storage):
+    upload = GCSObjectStreamUpload(
+        google_storage=google_storage,
+        blob_name="opn2101a/opn2101a.bdbx",
+        chunk_size=CHUNK_SIZE,
+        metadata={"source_size": "17"},
+    )
+
+    assert upload._object_metadata() == {
+        "name": "opn2101a/opn2101a.bdbx",
+        "metadata": {"source_size": "17"},
+    }
+
+
+CONTENT = bytes(i % 251 for i in range(CHUNK_SIZE * 3 + 5))
+
+
+def upload_content(google_storage, session):
+    with GCSObjectStreamUpload(
+        google_storage=google_storage,
+        blob_name="opn2101a/opn2101a.bdbx",
+        chunk_size=CHUNK_SIZE,
+        session=session,
+    ) as upload:
+        checksums = session.resume()
+        for offset in range(session.bytes_uploaded, len(CONTENT), CHUNK_SIZE):
+            data = CONTENT[offset : offset + CHUNK_SIZE]
+            checksums.update(data)
+            upload.write(data)
+    return checksums
+
+
+def test_stream_upload_resumes_from_the_last_confirmed_chunk(
+    fake_transport, google_storage
+):
+    session = ResumableSession()
+    fake_transport.failures = [None, None, "interrupt"]
+
+    with pytest.raises(Interrupted):
+        upload_content(google_storage, session)
+
+    assert session.url == "https://fake.invalid/upload?id=1"
+    assert session.bytes_uploaded == CHUNK_SIZE * 2
+
+    checksums = upload_content(google_storage, session)
+
+    assert bytes(fake_transport.received) == CONTENT
+    assert fake_transport.initiated == 1
+    assert checksums.md5_hexdigest() == hashlib.md5(CONTENT).hexdigest()
+
+
+def test_stream_upload_skips_bytes_the_server_already_has(
+    fake_transport, google_storage
+):
+    session = ResumableSession()
+    fake_transport.failures = [None, "lost response"]
+
+    with pytest.raises(Interrupted):
+        upload_content(google_storage, session)
+
+    assert session.bytes_uploaded == CHUNK_SIZE
+    assert len(fake_transport.received) == CHUNK_SIZE * 2
+
+    checksums = upload_content(google_storage, session)
+
+    assert bytes(fake_transport.received) == CONTENT
+    assert fake_transport.initiated == 1
+    assert checksums.md5_hexdigest() == hashlib.md5(CONTENT).hexdigest()
+
+
+def test_stream_upload_starts_again_when_the_session_has_expired(
+    fake_transport, google_storage, caplog
+):
+    session = ResumableSession()
+    fake_transport.failures = [None, "interrupt"]
+    with pytest.raises(Interrupted):
+        upload_content(google_storage, session)
+    fake_transport.session_expired = True
+
+    checksums = upload_content(google_storage, session)
+
+    assert bytes(fake_transport.received) == CONTENT
+    assert fake_transport.initiated == 2
+    assert checksums.md5_hexdigest() == hashlib.md5(CONTENT).hexdigest()
+    assert "Unable to resume upload of opn2101a/opn2101a.bdbx" in caplog.text
+
+
+def test_stream_upload_resends_a_rejected_chunk(fake_transport, google_storage):
+    fake_transport.failures = [None, "reject"]
+
+    upload_content(google_storage, ResumableSession())
+
+    assert bytes(fake_transport.received) == CONTENT
+
+
+def test_stream_upload_deletes_object_with_different_checksums(
+    fake_transport, google_storage
+):
+    session = ResumableSession()
+
+    with pytest.raises(
+        UploadIntegrityError,
+        match="opn2101a/opn2101a.bdbx has md5 7c4301837d3250c1d6d9068fb57c41c6",
+    ):
+        with GCSObjectStreamUpload(
+            google_storage=google_storage,
+            blob_name="opn2101a/opn2101a.bdbx",
+            chunk_size=CHUNK_SIZE,
+            session=session,
+        ) as upload:
+            session.resume().update(b"read from sftp")
+            upload.write(b"what gcs got")
+
+    google_storage.bucket.blob.return_value.delete.assert_called_once_with(
+        if_generation_match=1
+    )
@@ -2,8 +2,13 @@ import logging
 from unittest import mock
 
 import pybase64
+import pytest
+import requests
+from google.api_core import exceptions as api_exceptions
+from google.auth import exceptions as auth_exceptions
 
-from pkg.google_storage import GoogleStorage
+from pkg import google_storage as google_storage_module
+from pkg.google_storage import GoogleStorage, init_google_storage, reset_google_storage
 
 
 def test_get_blob_md5_no_blob(caplog):
@@ -25,3 +30,240 @@ def test_get_blob_md5():
     google_storage.bucket = mock.MagicMock()
     google_storage.bucket.get_blob.return_value = mock_md5
     assert google_storage.get_blob_md5("test.txt") == "666f6f626172"
+
+
+def test_update_blob_metadata():
+    google_storage = GoogleStorage("test")
+    google_storage.bucket = mock.MagicMock()
+
+    google_storage.update_blob_metadata("test.txt", {"source_size": "17"})
+
+    google_storage.bucket.blob.assert_called_once_with("test.txt")
+    blob = google_storage.bucket.blob.return_value
+    assert blob.metadata == {"source_size": "17"}
+    blob.patch.assert_called_once()
+
+
+def test_list_blobs_with_prefix():
+    google_storage = GoogleStorage("test")
+    google_storage.bucket = mock.MagicMock()
+    google_storage.bucket.list_blobs.return_value = iter(["opn2101a/opn2101a.bdbx"])
+
+    assert google_storage.list_blobs(prefix="opn2101a/", delimiter="/") == [
+        "opn2101a/opn2101a.bdbx"
+    ]
+    google_storage.bucket.list_blobs.assert_called_once_with(
+        prefix="opn2101a/", delimiter="/", fields=None
+    )
+
+
+def test_blob_crc32c():
+    blob = mock.MagicMock()
+    blob.crc32c = pybase64.b64encode(bytes.fromhex("94eb13ae")).decode("utf-8")
+
+    assert GoogleStorage.blob_crc32c(blob) == "94eb13ae"
+
+
+def test_compose_blobs():
+    google_storage = GoogleStorage("test")
+    google_storage.bucket = mock.MagicMock()
+    destination = mock.MagicMock()
+    sources = [mock.MagicMock(), mock.MagicMock()]
+    google_storage.bucket.blob.side_effect = [destination] + sources
+
+    assert (
+        google_storage.compose_blobs("test.bdbx", ["test.part-00", "test.part-01"])
+        is destination
+    )
+
+    assert google_storage.bucket.blob.call_args_list == [
+        mock.call("test.bdbx"),
+        mock.call("test.part-00"),
+        mock.call("test.part-01"),
+    ]
+    destination.compose.assert_called_once_with(sources)
+
+
+@pytest.fixture
+def mock_storage_client():
+    google_storage_module._google_storage.clear()
+    with mock.patch("pkg.google_storage.storage.Client") as mock_client:
+        yield mock_client
+    google_storage_module._google_storage.clear()
+
+
+def test_init_google_storage_is_cached(mock_storage_client, config):
+    google_storage = init_google_storage(config)
+
+    assert init_google_storage(config) is google_storage
+    mock_storage_client.assert_called_once()
+    mock_storage_client.return_value.get_bucket.assert_called_once_with(
+        "test_bucket_name"
+    )
+
+
+def test_init_google_storage_retries_failed_connection(mock_storage_client, config):
+    mock_storage_client.return_value.get_bucket.side_effect = [
+        Exception("nope"),
+        mock.MagicMock(),
+    ]
+
+    assert init_google_storage(config).bucket is None
+    assert init_google_storage(config).bucket is not None
+    assert mock_storage_client.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        auth_exceptions.RefreshError("expired"),
+        auth_exceptions.TransportError("dns"),
+        api_exceptions.Unauthorized("no"),
+        api_exceptions.Forbidden("no"),
+        requests.exceptions.ConnectionError("reset"),
+    ],
+)
+def test_reset_google_storage_on_auth_or_connection_error(
+    mock_storage_client, config, error
+):
+    google_storage = init_google_storage(config)
+    session = mock.MagicMock()
+    google_storage._authorized_session = session
+
+    reset_google_storage(error)
+
+    session.close.assert_called_once()
+    assert init_google_storage(config) is not google_storage
+
+
+def test_reset_google_storage_ignores_other_errors(mock_storage_client, config):
+    google_storage = init_google_storage(config)
+
+    reset_google_storage(ValueError("bad data"))
+
+    assert init_google_storage(config) is google_storage
+
+
+@mock.patch("pkg.google_storage.AuthorizedSession")
+def test_authorized_session_is_shared(mock_authorized_session):
+    google_storage = GoogleStorage("test")
+    google_storage.storage_client = mock.MagicMock()
+
+    assert google_storage.authorized_session() is google_storage.authorized_session()
+    mock_authorized_session.assert_called_once_with(
+        credentials=google_storage.storage_client._credentials
+    )
+    mock_authorized_session.return_value.mount.assert_called_once_with(
+        "https://", mock.ANY
+    )
+    adapter = mock_authorized_session.return_value.mount.call_args[0][1]
+    assert adapter._pool_maxsize == 32
+
+
+def test_copy_blob_rewrites_until_done():
+    google_storage = GoogleStorage("test")
+    google_storage.bucket = mock.MagicMock()
+    source = mock.MagicMock()
+    destination = mock.MagicMock()
+    google_storage.bucket.blob.side_effect = [source, destination]
+    destination.rewrite.side_effect = [("token", 5, 17), (None, 17, 17)]
+
+    assert (
+        google_storage.copy_blob(
+            "opn2101a/framesoc.blix",
+            "opn2102a/framesoc.blix",
+            metadata={"source_size": "17"},
+        )
+        is destination
+    )
+
+    assert google_storage.bucket.blob.call_args_list == [
+        mock.call("opn2101a/framesoc.blix"),
+        mock.call("opn2102a/framesoc.blix"),
+    ]
+    assert destination.metadata == {"source_size": "17"}
+    assert destination.rewrite.call_args_list == [
+        mock.call(source, token=None),
+        mock.call(source, token="token"),
+    ]
+
+
+def test_blob_md5_decodes_standard_base64():
+    blob = mock.MagicMock()
+    blob.md5_hash = pybase64.b64encode(
+        bytes.fromhex("50cc5a0bbd05754f98022a25566220fe")
+    ).decode("utf-8")
+
+    assert "+" in blob.md5_hash or "/" in blob.md5_hash
+    assert GoogleStorage.blob_md5(blob) == "50cc5a0bbd05754f98022a25566220fe"
+
+
+def test_upload_bytes_sends_one_request_with_checksums():
+    google_storage = GoogleStorage("test")
+    transport = mock.MagicMock()
+    transport.request.return_value.status_code = 200
+    transport.request.return_value.headers = {}
+
+    with mock.patch.object(GoogleStorage, "authorized_session", return_value=transport):
+        google_storage.upload_bytes(
+            "opn2101a/opn2101a.bmix",
+            b"My fake bdbx file",
+            "UMxaC70FdU+YAiolVmIg/g==",
+            "lOsTrg==",
+            metadata={"source_size": "17"},
+        )
+
+    transport.request.assert_called_once()
+    method, url = transport.request.call_args[0][:2]
+    body = transport.request.call_args.kwargs["data"]
+    assert method == "POST"
+    assert url == (
+        "https://www.googleapis.com/upload/storage/v1/b/test/o?uploadType=multipart"
+    )
+    assert b'"md5Hash": "UMxaC70FdU+YAiolVmIg/g=="' in body
+    assert b'"crc32c": "lOsTrg=="' in body
+    assert b'"metadata": {"source_size": "17"}' in body
+    assert b"My fake bdbx file" in body
+
+
+def test_upload_file_uses_small_chunks():
+    google_storage = GoogleStorage("test")
+    google_storage.bucket = mock.MagicMock()
+
+    google_storage.upload_file("OPN2101A.bdbx", "opn2101a/opn2101a.bdbx")
+
+    google_storage.bucket.blob.assert_called_once_with(
+        "opn2101a/opn2101a.bdbx", chunk_size=5 * 1024 * 1024
+    )
+
+
+def test_create_blob_only_if_generation_matches():
+    google_storage = GoogleStorage("test")
+    google_storage.bucket = mock.MagicMock()
+    blob = google_storage.bucket.blob.return_value
+
+    assert (
+        google_storage.create_blob(
+            "_leases/opn2101a", {"expires": "60"}, if_generation_match=0
+        )
+        is blob
+    )
+    assert blob.metadata == {"expires": "60"}
+    blob.upload_from_string.assert_called_once_with(b"", if_generation_match=0)
+
+    blob.upload_from_string.side_effect = api_exceptions.PreconditionFailed("taken")
+    assert google_storage.create_blob("_leases/opn2101a", if_generation_match=0) is None
+
+
+def test_delete_blob_ignores_replaced_blob():
+    google_storage = GoogleStorage("test")
+    google_storage.bucket = mock.MagicMock()
+    google_storage.bucket.delete_blob.side_effect = api_exceptions.PreconditionFailed(
+        "replaced"
+    )
+
+    google_storage.delete_blob("_leases/opn2101a", if_generation_match=3)
+
+    google_storage.bucket.delete_blob.assert_called_once_with(
+        "_leases/opn2101a", if_generation_match=3
+    )
@@ -0,0 +1,118 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict
+
+import pytest
+
+from models import Instrument
+from pkg.instrument_lease import InstrumentLease, LeaseHeld
+
+
+@dataclass
+class FakeBlob:
+    name: str
+    generation: int
+    metadata: Dict[str, str] = field(default_factory=dict)
+
+
+class FakeGoogleStorage:
+    """Keeps blobs in memory, with the generation preconditions GCS applies."""
+
+    def __init__(self):
+        self.blobs = {}
+        self.generations = 0
+
+    def get_blob(self, blob_location):
+        return self.blobs.get(blob_location)
+
+    def create_blob(self, blob_location, metadata=None, if_generation_match=None):
+        current = self.blobs.get(blob_location)
+        generation = current.generation if current else 0
+        if if_generation_match is not None and if_generation_match != generation:
+            return None
+        self.generations += 1
+        blob = FakeBlob(blob_location, self.generations, metadata or {})
+        self.blobs[blob_location] = blob
+        return blob
+
+    def delete_blob(self, blob_location, if_generation_match=None):
+        current = self.blobs.get(blob_location)
+        if current and if_generation_match in (None, current.generation):
+            del self.blobs[blob_location]
+
+
+@pytest.fixture
+def google_storage():
+    return FakeGoogleStorage()
+
+
+@pytest.fixture
+def instrument():
+    return Instrument(sftp_path="ONS/OPN/OPN2101A", bdbx_md5="my-md5")
+
+
+def test_lease_is_only_held_by_one_processor(google_storage, instrument, config):
+    first = InstrumentLease(google_storage, instrument, config)
+    second = InstrumentLease(google_storage, instrument, config)
+
+    assert first.acquire() is True
+    assert second.acquire() is False
+
+    first.release()
+    assert "_leases/opn2101a" not in google_storage.blobs
+    assert second.acquire() is True
+
+
+@pytest.mark.parametrize("held_md5", ["older-md5", None])
+def test_lease_held_for_another_database_md5_raises(
+    google_storage, instrument, config, held_md5
+):
+    InstrumentLease(
+        google_storage,
+        Instrument(sftp_path="ONS/OPN/OPN2101A", bdbx_md5=held_md5),
+        config,
+    ).acquire()
+
+    with pytest.raises(LeaseHeld) as held:
+        InstrumentLease(google_storage, instrument, config).acquire()
+
+    expires = google_storage.blobs["_leases/opn2101a"].metadata["expires"]
+    assert held.value.expires == float(expires)
+
+
+def test_lease_records_database_md5(google_storage, instrument, config):
+    InstrumentLease(google_storage, instrument, config).acquire()
+
+    assert google_storage.blobs["_leases/opn2101a"].metadata["md5"] == "my-md5"
+
+
+def test_expired_lease_is_taken_over(google_storage, instrument, config):
+    google_storage.create_blob(
+        "_leases/opn2101a", {"expires": str(time.time() - 1)}, if_generation_match=0
+    )
+    lease = InstrumentLease(google_storage, instrument, config)
+
+    assert lease.acquire() is True
+    expires = float(google_storage.blobs["_leases/opn2101a"].metadata["expires"])
+    assert expires > time.time() + config.function_timeout - 5
+
+
+def test_release_leaves_a_lease_taken_over_since(google_storage, instrument, config):
+    lease = InstrumentLease(google_storage, instrument, config)
+    lease.acquire()
+    google_storage.blobs["_leases/opn2101a"].generation = 99
+
+    lease.release()
+
+    assert "_leases/opn2101a" in google_storage.blobs
+
+
+def test_processed_marker_matches_database_md5(google_storage, instrument, config):
+    lease = InstrumentLease(google_storage, instrument, config)
+    assert lease.processed() is False
+
+    lease.mark_processed()
+
+    assert lease.processed() is True
+    instrument.bdbx_md5 = "new-md5"
+    assert lease.processed() is False
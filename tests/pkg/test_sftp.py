@@ -1,13 +1,16 @@
 import logging
 import os
 import stat
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from unittest import mock
 
+import paramiko
 import pytest
 
 from models.instruments import Instrument
-from pkg.sftp import SFTP, SFTPConfig
+from pkg.sftp import SFTP, SFTPConfig, read_sftp_file, sftp_channels
 
 
 @mock.patch.dict(
@@ -65,7 +68,7 @@ def test_get_instrument_files(
     sftp = SFTP(mock_sftp_connection, sftp_config, config)
     instrument_folders = {"OPN2101A": Instrument(sftp_path="ONS/OPN/OPN2101A")}
     mock_sftp_connection.listdir_attr.return_value = [
-        mock_list_dir_attr(filename="oPn2101A.BdBx", st_mtime=1617186113),
+        mock_list_dir_attr(filename="oPn2101A.BdBx", st_mtime=1617186113, st_size=20),
         mock_list_dir_attr(filename="oPn2101A.BdIx", st_mtime=1617186091),
         mock_list_dir_attr(filename="oPn2101A.BmIx", st_mtime=1617186113),
         mock_list_dir_attr(filename="oPn2101A.pdf", st_mtime=1617186117),
@@ -76,6 +79,7 @@ def test_get_instrument_files(
         "OPN2101A": Instrument(
             sftp_path="ONS/OPN/OPN2101A",
             bdbx_updated_at=datetime.fromisoformat("2021-03-31T10:21:53+00:00"),
+            bdbx_size=20,
             files=[
                 "oPn2101A.BdBx",
                 "oPn2101A.BdIx",
@@ -419,54 +423,6 @@ def test_filter_instrument_files_returns_the_latest_modified_when_names_clash(
     }
 
 
-@mock.patch.object(SFTP, "generate_bdbx_md5", return_value="my_lovely_md5")
-def test_get_bdbx_md5s(
-    mock_generate_bdbx_md5, mock_sftp_connection, sftp_config, config
-):
-    instruments = {
-        "opn2101a": Instrument(
-            sftp_path="ONS/OPN/oPN2101A",
-            bdbx_updated_at=datetime.fromisoformat("2021-04-30T10:21:53+00:00"),
-            files=[
-                "oPn2101A.BdBx",
-                "oPn2101A.BdIx",
-                "oPn2101A.BmIx",
-                "FrameSOC.blix",
-            ],
-        ),
-        "OPN2103A": Instrument(
-            sftp_path="ONS/OPN/OPN2103A",
-            bdbx_updated_at=datetime.fromisoformat("2021-05-20T10:21:53+00:00"),
-            files=[
-                "oPn2103A.BdBx",
-            ],
-        ),
-    }
-    sftp = SFTP(mock_sftp_connection, sftp_config, config)
-    assert sftp.generate_bdbx_md5s(instruments) == {
-        "opn2101a": Instrument(
-            sftp_path="ONS/OPN/oPN2101A",
-            bdbx_updated_at=datetime.fromisoformat("2021-04-30T10:21:53+00:00"),
-            bdbx_md5="my_lovely_md5",
-            files=[
-                "oPn2101A.BdBx",
-                "oPn2101A.BdIx",
-                "oPn2101A.BmIx",
-                "FrameSOC.blix",
-            ],
-        ),
-        "OPN2103A": Instrument(
-            sftp_path="ONS/OPN/OPN2103A",
-            bdbx_updated_at=datetime.fromisoformat("2021-05-20T10:21:53+00:00"),
-            bdbx_md5="my_lovely_md5",
-            files=[
-                "oPn2103A.BdBx",
-            ],
-        ),
-    }
-    assert mock_generate_bdbx_md5.call_count == 2
-
-
 def test_generate_bdbx_md5(
     mock_sftp_connection, sftp_config, config, mock_stat, fake_sftp_file
 ):
@@ -510,3 +466,311 @@ def test_generate_bdbx_md5_when_file_does_not_exist(
         logging.ERROR,
         "Failed to open ONS/OPN/OPN2103A/opn2103a.bdbx over SFTP",
     ) in caplog.record_tuples
+
+
+@pytest.fixture
+def mock_exec_channel(mock_sftp_connection):
+    def inner(outputs):
+        transport = mock_sftp_connection.get_channel.return_value.get_transport()
+        channels = []
+        for output, exit_status in outputs:
+            channel = mock.MagicMock()
+            channel.makefile.return_value.read.return_value = output
+            channel.recv_exit_status.return_value = exit_status
+            channels.append(channel)
+        transport.open_session.side_effect = channels
+        return channels
+
+    return inner
+
+
+def test_generate_bdbx_md5_uses_remote_md5sum(
+    mock_sftp_connection, sftp_config, config, mock_exec_channel
+):
+    probe_channel, md5sum_channel = mock_exec_channel(
+        [
+            (b"d41d8cd98f00b204e9800998ecf8427e  /dev/null\n", 0),
+            (b"50cc5a0bbd05754f98022a25566220fe  ONS/OPN/OPN2103A/opn2103a.bdbx\n", 0),
+        ]
+    )
+    instrument = Instrument(sftp_path="ONS/OPN/OPN2103A", files=["opn2103a.bdbx"])
+    sftp = SFTP(mock_sftp_connection, sftp_config, config)
+
+    assert sftp.generate_bdbx_md5(instrument) == "50cc5a0bbd05754f98022a25566220fe"
+    probe_channel.exec_command.assert_called_once_with("md5sum /dev/null")
+    md5sum_channel.exec_command.assert_called_once_with(
+        "md5sum ONS/OPN/OPN2103A/opn2103a.bdbx"
+    )
+    mock_sftp_connection.open.assert_not_called()
+
+
+def test_remote_md5_supported_is_cached_per_connection(
+    mock_sftp_connection, sftp_config, config, mock_exec_channel
+):
+    mock_exec_channel([(b"d41d8cd98f00b204e9800998ecf8427e  /dev/null\n", 0)])
+    sftp = SFTP(mock_sftp_connection, sftp_config, config)
+
+    assert sftp.remote_md5_supported() is True
+    assert sftp.remote_md5_supported() is True
+    assert sftp.for_connection(mock.MagicMock()).remote_md5_supported() is True
+    transport = mock_sftp_connection.get_channel.return_value.get_transport()
+    assert transport.open_session.call_count == 1
+
+
+def test_remote_md5_failing_on_one_session_stops_every_session_using_it(
+    mock_sftp_connection,
+    sftp_config,
+    config,
+    mock_stat,
+    fake_sftp_file,
+    mock_exec_channel,
+):
+    mock_exec_channel(
+        [
+            (b"d41d8cd98f00b204e9800998ecf8427e  /dev/null\n", 0),
+            (b"", 1),
+        ]
+    )
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17)
+    mock_sftp_connection.open.return_value = fake_sftp_file(b"My fake bdbx file")
+    instrument = Instrument(sftp_path="ONS/OPN/OPN2103A", files=["opn2103a.bdbx"])
+    sftp = SFTP(mock_sftp_connection, sftp_config, config)
+
+    sftp.for_connection(mock_sftp_connection).generate_bdbx_md5(instrument)
+
+    assert sftp.remote_md5_supported() is False
+    assert sftp.for_connection(mock.MagicMock()).remote_md5_supported() is False
+
+
+def test_remote_md5_is_probed_once_across_channels(
+    fake_channels, mock_sftp_connection, sftp_config, config
+):
+    config.sftp_scan_concurrency = 2
+    both_running = threading.Barrier(2, timeout=5)
+    sftp = SFTP(mock_sftp_connection, sftp_config, config)
+
+    def remote_md5_supported(channel_sftp, item):
+        both_running.wait()
+        return channel_sftp.remote_md5_supported()
+
+    with mock.patch.object(
+        SFTP, "_exec_md5sum", return_value="d41d8cd98f00b204e9800998ecf8427e"
+    ) as mock_exec_md5sum:
+        assert list(sftp.map_on_channels(remote_md5_supported, [1, 2])) == [True, True]
+
+    mock_exec_md5sum.assert_called_once_with("/dev/null")
+
+
+def test_generate_bdbx_md5_falls_back_when_exec_is_refused(
+    mock_sftp_connection, sftp_config, config, mock_stat, fake_sftp_file
+):
+    transport = mock_sftp_connection.get_channel.return_value.get_transport()
+    transport.open_session.side_effect = paramiko.SSHException("exec refused")
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17)
+    mock_sftp_connection.open.return_value = fake_sftp_file(b"My fake bdbx file")
+    instrument = Instrument(sftp_path="ONS/OPN/OPN2103A", files=["opn2103a.bdbx"])
+    sftp = SFTP(mock_sftp_connection, sftp_config, config)
+
+    assert sftp.generate_bdbx_md5(instrument) == "50cc5a0bbd05754f98022a25566220fe"
+    assert sftp.remote_md5_supported() is False
+
+
+def test_generate_bdbx_md5_falls_back_when_remote_md5sum_fails(
+    mock_sftp_connection,
+    sftp_config,
+    config,
+    mock_stat,
+    fake_sftp_file,
+    mock_exec_channel,
+):
+    mock_exec_channel(
+        [
+            (b"d41d8cd98f00b204e9800998ecf8427e  /dev/null\n", 0),
+            (b"", 1),
+        ]
+    )
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17)
+    mock_sftp_connection.open.return_value = fake_sftp_file(b"My fake bdbx file")
+    instrument = Instrument(sftp_path="ONS/OPN/OPN2103A", files=["opn2103a.bdbx"])
+    sftp = SFTP(mock_sftp_connection, sftp_config, config)
+
+    assert sftp.generate_bdbx_md5(instrument) == "50cc5a0bbd05754f98022a25566220fe"
+    assert sftp.remote_md5_supported() is False
+
+
+def test_generate_bdbx_md5_when_forced_local(
+    mock_sftp_connection, sftp_config, config, mock_stat, fake_sftp_file
+):
+    config.force_local_md5 = True
+    mock_sftp_connection.stat.return_value = mock_stat(st_size=17)
+    mock_sftp_connection.open.return_value = fake_sftp_file(b"My fake bdbx file")
+    instrument = Instrument(sftp_path="ONS/OPN/OPN2103A", files=["opn2103a.bdbx"])
+    sftp = SFTP(mock_sftp_connection, sftp_config, config)
+
+    assert sftp.generate_bdbx_md5(instrument) == "50cc5a0bbd05754f98022a25566220fe"
+    mock_sftp_connection.get_channel.assert_not_called()
+
+
+def test_read_sftp_file_pipelines_sequential_reads(
+    mock_sftp_connection, config, fake_sftp_file
+):
+    config.bufsize = 5
+    config.sftp_request_count = 16
+    config.sftp_request_size = 4096
+    fake_file = fake_sftp_file(b"My fake bdbx file")
+    fake_file.prefetch = mock.MagicMock()
+    mock_sftp_connection.open.return_value = fake_file
+
+    chunks = list(
+        read_sftp_file(mock_sftp_connection, "ONS/OPN/opn2103a.bdbx", 17, config)
+    )
+
+    assert chunks == [b"My fa", b"ke bd", b"bx fi", b"le"]
+    mock_sftp_connection.open.assert_called_once_with(
+        "ONS/OPN/opn2103a.bdbx", bufsize=5
+    )
+    fake_file.prefetch.assert_called_once_with(17, max_concurrent_requests=16)
+    assert fake_file.MAX_REQUEST_SIZE == 4096
+
+
+def test_read_sftp_file_from_offset(mock_sftp_connection, config, fake_sftp_file):
+    mock_sftp_connection.open.return_value = fake_sftp_file(b"My fake bdbx file")
+
+    chunks = list(
+        read_sftp_file(
+            mock_sftp_connection, "ONS/OPN/opn2103a.bdbx", 17, config, offset=8
+        )
+    )
+
+    assert b"".join(chunks) == b"bdbx file"
+
+
+def test_read_sftp_file_byte_range(mock_sftp_connection, config, fake_sftp_file):
+    config.bufsize = 3
+    fake_file = fake_sftp_file(b"My fake bdbx file")
+    fake_file.prefetch = mock.MagicMock()
+    mock_sftp_connection.open.return_value = fake_file
+
+    chunks = list(
+        read_sftp_file(
+            mock_sftp_connection,
+            "ONS/OPN/opn2103a.bdbx",
+            17,
+            config,
+            offset=3,
+            length=9,
+        )
+    )
+
+    assert chunks == [b"fak", b"e b", b"dbx"]
+    fake_file.prefetch.assert_called_once_with(
+        12, max_concurrent_requests=config.sftp_request_count
+    )
+
+
+def test_sftp_channels_opens_sessions_on_the_same_transport(monkeypatch):
+    mock_sftp = mock.MagicMock()
+    transport = mock_sftp.get_channel.return_value.get_transport.return_value
+    opened = [mock.MagicMock(), mock.MagicMock()]
+    from_transport = mock.MagicMock(side_effect=opened)
+    monkeypatch.setattr("paramiko.SFTPClient.from_transport", from_transport)
+
+    with sftp_channels(mock_sftp, 2) as channels:
+        assert channels == opened
+
+    from_transport.assert_called_with(transport)
+    for channel in opened:
+        channel.close.assert_called_once()
+    mock_sftp.close.assert_not_called()
+
+
+def test_sftp_channels_stops_when_the_server_refuses(caplog, monkeypatch):
+    mock_sftp = mock.MagicMock()
+    opened = mock.MagicMock()
+    monkeypatch.setattr(
+        "paramiko.SFTPClient.from_transport",
+        mock.MagicMock(side_effect=[opened, paramiko.ChannelException(1, "refused")]),
+    )
+
+    with caplog.at_level(logging.WARNING):
+        with sftp_channels(mock_sftp, 3) as channels:
+            assert channels == [opened]
+
+    assert any(
+        msg.startswith("Unable to open SFTP session 2 of 3") for msg in caplog.messages
+    )
+
+
+def test_sftp_channels_falls_back_to_the_original_session(monkeypatch):
+    mock_sftp = mock.MagicMock()
+    monkeypatch.setattr(
+        "paramiko.SFTPClient.from_transport",
+        mock.MagicMock(side_effect=paramiko.SSHException("no sessions")),
+    )
+
+    with sftp_channels(mock_sftp, 2) as channels:
+        assert channels == [mock_sftp]
+
+
+@pytest.fixture
+def fake_channels():
+    channels = [mock.MagicMock(), mock.MagicMock()]
+
+    @contextmanager
+    def fake_sftp_channels(sftp_connection, count):
+        assert count == 2
+        yield channels
+
+    with mock.patch("pkg.sftp.sftp_channels", fake_sftp_channels):
+        yield channels
+
+
+def test_get_instrument_files_lists_folders_on_separate_channels(
+    fake_channels, mock_sftp_connection, sftp_config, config, mock_list_dir_attr
+):
+    config.sftp_scan_concurrency = 4
+    both_running = threading.Barrier(2, timeout=5)
+    for channel in fake_channels:
+
+        def listdir_attr(sftp_path):
+            both_running.wait()
+            name = sftp_path.rsplit("/", 1)[-1]
+            return [mock_list_dir_attr(filename=f"{name}.bdbx", st_mtime=0)]
+
+        channel.listdir_attr.side_effect = listdir_attr
+    sftp = SFTP(mock_sftp_connection, sftp_config, config)
+    instruments = {
+        "OPN2101A": Instrument(sftp_path="ONS/OPN/OPN2101A"),
+        "OPN2102A": Instrument(sftp_path="ONS/OPN/OPN2102A"),
+    }
+
+    sftp.get_instrument_files(instruments)
+
+    assert instruments["OPN2101A"].files == ["OPN2101A.bdbx"]
+    assert instruments["OPN2102A"].files == ["OPN2102A.bdbx"]
+    mock_sftp_connection.listdir_attr.assert_not_called()
+    for channel in fake_channels:
+        channel.listdir_attr.assert_called_once()
+
+
+def test_remote_md5(mock_sftp_connection, sftp_config, config, mock_exec_channel):
+    mock_exec_channel(
+        [
+            (b"d41d8cd98f00b204e9800998ecf8427e  /dev/null\n", 0),
+            (b"50cc5a0bbd05754f98022a25566220fe  ONS/OPN/OPN2103A/FrameSOC.blix\n", 0),
+        ]
+    )
+    sftp = SFTP(mock_sftp_connection, sftp_config, config)
+
+    assert (
+        sftp.remote_md5("ONS/OPN/OPN2103A/FrameSOC.blix")
+        == "50cc5a0bbd05754f98022a25566220fe"
+    )
+
+
+def test_remote_md5_when_forced_local(mock_sftp_connection, sftp_config, config):
+    config.force_local_md5 = True
+    sftp = SFTP(mock_sftp_connection, sftp_config, config)
+
+    assert sftp.remote_md5("ONS/OPN/OPN2103A/FrameSOC.blix") is None
+    mock_sftp_connection.get_channel.assert_not_called()
@@ -0,0 +1,253 @@
+import json
+from concurrent import futures
+from unittest import mock
+
+import pytest
+from paramiko.ssh_exception import SSHException
+
+from models import BatchProcessorEvent, Instrument, ProcessorEvent
+from pkg.trigger import (
+    ProcessorEventPublisher,
+    TriggerCheckpoint,
+    batch_processor_events,
+    iter_filtered_instruments,
+)
+
+
+def instruments_with_sizes(**sizes):
+    return {
+        name: Instrument(sftp_path=f"ONS/OPN/{name}", bdbx_size=size)
+        for name, size in sizes.items()
+    }
+
+
+def test_batch_processor_events_disabled(config):
+    instruments = instruments_with_sizes(OPN2101A=10, OPN2102A=20)
+
+    assert list(batch_processor_events(instruments.items(), config)) == [
+        ProcessorEvent(instrument_name="OPN2101A", instrument=instruments["OPN2101A"]),
+        ProcessorEvent(instrument_name="OPN2102A", instrument=instruments["OPN2102A"]),
+    ]
+
+
+def test_batch_processor_events_by_bytes(config):
+    config.processor_batch_bytes = 100
+    instruments = instruments_with_sizes(
+        OPN2101A=40, OPN2102A=500, OPN2103A=50, OPN2104A=30, OPN2105A=None
+    )
+
+    def event(name):
+        return ProcessorEvent(instrument_name=name, instrument=instruments[name])
+
+    assert list(batch_processor_events(instruments.items(), config)) == [
+        event("OPN2102A"),
+        BatchProcessorEvent(events=[event("OPN2101A"), event("OPN2103A")]),
+        BatchProcessorEvent(events=[event("OPN2104A"), event("OPN2105A")]),
+    ]
+
+
+def test_batch_processor_events_single_small_instrument(config):
+    config.processor_batch_bytes = 100
+    instruments = instruments_with_sizes(OPN2101A=40, OPN2102A=80)
+
+    assert list(batch_processor_events(instruments.items(), config)) == [
+        ProcessorEvent(instrument_name="OPN2101A", instrument=instruments["OPN2101A"]),
+        ProcessorEvent(instrument_name="OPN2102A", instrument=instruments["OPN2102A"]),
+    ]
+
+
+def published(message_id):
+    future = futures.Future()
+    future.set_result(message_id)
+    return future
+
+
+def failed(error):
+    future = futures.Future()
+    future.set_exception(error)
+    return future
+
+
+def processor_event(name):
+    return ProcessorEvent(
+        instrument_name=name, instrument=Instrument(sftp_path=f"ONS/{name}")
+    )
+
+
+def test_processor_event_publisher_publishes_batch(config):
+    publisher_client = mock.MagicMock()
+    publisher_client.publish.return_value = published("1")
+    batch = BatchProcessorEvent(
+        events=[
+            ProcessorEvent(
+                instrument_name=name, instrument=Instrument(sftp_path=f"ONS/{name}")
+            )
+            for name in ["OPN2101A", "OPN2102A"]
+        ]
+    )
+
+    publisher = ProcessorEventPublisher(publisher_client, config)
+    publisher.publish(batch)
+    publisher.wait()
+
+    publisher_client.topic_path.assert_called_once_with(
+        "test_project_id", "test_processor_topic_name"
+    )
+    data = publisher_client.publish.call_args.kwargs["data"]
+    assert [event["instrument_name"] for event in json.loads(data)["events"]] == [
+        "OPN2101A",
+        "OPN2102A",
+    ]
+
+
+def test_processor_event_publisher_waits_for_all_messages(config, caplog):
+    publisher_client = mock.MagicMock()
+    pending = [futures.Future(), futures.Future()]
+    publisher_client.publish.side_effect = pending
+    publisher = ProcessorEventPublisher(publisher_client, config)
+
+    publisher.publish(processor_event("OPN2101A"))
+    publisher.publish(processor_event("OPN2102A"))
+    for message_id, future in enumerate(pending):
+        future.set_result(str(message_id))
+
+    with caplog.at_level("INFO"):
+        publisher.wait()
+
+    assert publisher.published == 2
+    assert publisher_client.publish.call_count == 2
+    messages = [record.message for record in caplog.records]
+    assert any(
+        message.startswith("Queued on pubsub for: OPN2101A as message 0 in ")
+        for message in messages
+    )
+    assert any(
+        message.startswith("Queued on pubsub for: OPN2102A as message 1 in ")
+        for message in messages
+    )
+
+
+def test_processor_event_publisher_republishes_failed_messages(config):
+    publisher_client = mock.MagicMock()
+    publisher_client.publish.side_effect = [
+        published("1"),
+        failed(Exception("Kaboom")),
+        published("3"),
+    ]
+    publisher = ProcessorEventPublisher(publisher_client, config)
+
+    publisher.publish(processor_event("OPN2101A"))
+    publisher.publish(processor_event("OPN2102A"))
+    publisher.wait()
+
+    republished = json.loads(publisher_client.publish.call_args.kwargs["data"])
+    assert publisher_client.publish.call_count == 3
+    assert republished["instrument_name"] == "OPN2102A"
+
+
+def test_processor_event_publisher_gives_up_after_attempts(config):
+    publisher_client = mock.MagicMock()
+    publisher_client.publish.side_effect = lambda *args, **kwargs: failed(
+        Exception("Kaboom")
+    )
+    publisher = ProcessorEventPublisher(publisher_client, config, attempts=2)
+
+    publisher.publish(processor_event("OPN2101A"))
+    with pytest.raises(
+        Exception, match="Failed to publish processor events for: OPN2101A"
+    ):
+        publisher.wait()
+
+    assert publisher_client.publish.call_count == 2
+
+
+def test_batch_processor_events_yields_before_discovery_finishes(config):
+    config.processor_batch_bytes = 100
+    discovered = []
+
+    def discover():
+        for name, size in [("OPN2101A", 500), ("OPN2102A", 60), ("OPN2103A", 60)]:
+            discovered.append(name)
+            yield name, Instrument(sftp_path=f"ONS/OPN/{name}", bdbx_size=size)
+
+    events = batch_processor_events(discover(), config)
+
+    assert next(events).instrument_name == "OPN2101A"
+    assert discovered == ["OPN2101A"]
+    assert next(events).instrument_name == "OPN2102A"
+    assert discovered == ["OPN2101A", "OPN2102A", "OPN2103A"]
+
+
+def pipeline_mocks(folders):
+    sftp = mock.MagicMock()
+    sftp.get_instrument_folders.return_value = folders
+    for stage in [
+        "get_instrument_files",
+        "filter_invalid_instrument_filenames",
+        "filter_instrument_files",
+    ]:
+        getattr(sftp, stage).side_effect = lambda instruments: instruments
+    case_mover = mock.MagicMock()
+    case_mover.filter_existing_instruments.side_effect = lambda instruments: instruments
+    case_mover.iter_update_checks.side_effect = lambda instruments: iter(
+        (name, instrument, True) for name, instrument in instruments.items()
+    )
+    return sftp, case_mover
+
+
+def test_iter_filtered_instruments():
+    folders = instruments_with_sizes(OPN2101A=1, opn2101a=2, LMS2101A=3)
+    sftp, case_mover = pipeline_mocks(folders)
+
+    instruments = iter_filtered_instruments(sftp, case_mover, "./ONS/OPN")
+
+    assert list(instruments) == list(folders.items())
+    sftp.get_instrument_files.assert_called_once_with(folders)
+    case_mover.load_bucket_index.assert_called_once_with()
+    case_mover.iter_update_checks.assert_called_once_with(folders)
+
+
+def test_iter_filtered_instruments_carries_on_from_the_checkpoint(config):
+    folders = instruments_with_sizes(OPN2101A=1, OPN2102A=2, OPN2103A=3)
+    sftp, case_mover = pipeline_mocks(folders)
+    checks = []
+
+    failing = ["OPN2103A"]
+
+    def iter_update_checks(instruments):
+        for name, instrument in instruments.items():
+            checks.append(name)
+            if name in failing:
+                failing.remove(name)
+                raise SSHException("Kaboom")
+            yield name, instrument, True
+
+    case_mover.iter_update_checks.side_effect = iter_update_checks
+    checkpoint = TriggerCheckpoint()
+    publisher = checkpoint.get_publisher(mock.MagicMock(), config)
+    instruments = iter_filtered_instruments(sftp, case_mover, "./ONS/OPN", checkpoint)
+    publisher.publish(processor_event(next(instruments)[0]))
+    # found but still waiting for its batch when the attempt failed
+    next(instruments)
+    with pytest.raises(SSHException):
+        next(instruments)
+
+    retried = iter_filtered_instruments(sftp, case_mover, "./ONS/OPN", checkpoint)
+
+    assert [name for name, _ in retried] == ["OPN2102A", "OPN2103A"]
+    assert checks == ["OPN2101A", "OPN2102A", "OPN2103A", "OPN2103A"]
+    case_mover.filter_existing_instruments.assert_called_once()
+    sftp.get_instrument_files.assert_called_once()
+
+
+def test_iter_filtered_instruments_leaves_out_instruments_not_in_blaise():
+    folders = instruments_with_sizes(OPN2101A=1, LMS2101A=3)
+    sftp, case_mover = pipeline_mocks(folders)
+    case_mover.filter_existing_instruments.side_effect = lambda instruments: {
+        "OPN2101A": instruments["OPN2101A"]
+    }
+
+    assert dict(iter_filtered_instruments(sftp, case_mover, "./ONS/OPN")) == {
+        "OPN2101A": folders["OPN2101A"]
+    }
+    sftp.get_instrument_folders.assert_called_once_with("./ONS/OPN")
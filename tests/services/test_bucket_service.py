@@ -107,6 +107,29 @@ def test_get_questionnaire_modified_dates_returns_only_the_instrument_file_names
     assert "DST3399" in result
 
 
+@mock.patch.object(GoogleBucketService, "get_blobs")
+def test_get_questionnaire_modified_dates_ignores_metadata_updates(
+    mock_get_blobs, bucket_service, bucket_name
+):
+    # arrange
+    file_extension = "bdbx"
+    blob = Blob(name="OPN2101A/OPN2101A.BDBX", bucket=bucket_name)
+    blob._properties.update(
+        {
+            "timeCreated": "2021-05-20T10:21:53.000Z",
+            "updated": "2021-05-21T09:00:00.000Z",
+        }
+    )
+    mock_get_blobs.return_value = [blob]
+
+    # act
+    result = bucket_service.get_questionnaire_modified_dates(file_extension)
+
+    # assert
+    assert result == {"OPN2101A": blob.time_created}
+    assert result["OPN2101A"].isoformat() == "2021-05-20T10:21:53+00:00"
+
+
 @mock.patch.object(GoogleBucketService, "get_blobs")
 def test_get_questionnaire_modified_dates_logs_an_error_if_exception_occurs(
     mock_get_blobs, bucket_service, caplog
@@ -5,6 +5,7 @@ import flask
 import pytest
 
 from main import do_processor, do_trigger, public_ip_logger
+from models import Instrument
 
 
 def test_public_ip_logger(requests_mock, caplog):
@@ -69,8 +70,10 @@ def test_do_trigger_bucket_none(monkeypatch, sftp_config, config, google_storage
     monkeypatch.setattr("main.init_google_storage", lambda config: google_storage)
     monkeypatch.setattr("main.SFTP", mock.MagicMock)
     monkeypatch.setattr("main.CaseMover", mock.MagicMock)
-    monkeypatch.setattr("main.get_filtered_instruments", lambda *a, **k: {})
-    monkeypatch.setattr("main.pubsub_v1.PublisherClient", lambda: mock.MagicMock())
+    monkeypatch.setattr("main.iter_filtered_instruments", lambda *a, **k: iter([]))
+    monkeypatch.setattr(
+        "main.pubsub_v1.PublisherClient", lambda **kwargs: mock.MagicMock()
+    )
 
     request = mock.MagicMock()
     request.get_json.return_value = {"survey": "TEST_SURVEY"}
@@ -84,7 +87,9 @@ def test_do_trigger_bucket_none(monkeypatch, sftp_config, config, google_storage
 def test_do_trigger_bucket_exists(monkeypatch, sftp_config, config, google_storage):
     monkeypatch.setattr("main.Config.from_env", lambda: config)
     monkeypatch.setattr("main.SFTPConfig.from_env", lambda: sftp_config)
-    monkeypatch.setattr("main.pubsub_v1.PublisherClient", lambda: mock.MagicMock())
+    monkeypatch.setattr(
+        "main.pubsub_v1.PublisherClient", lambda **kwargs: mock.MagicMock()
+    )
 
     google_storage.bucket = config.bucket_name
     monkeypatch.setattr("main.init_google_storage", lambda config: google_storage)
@@ -105,14 +110,14 @@ def test_do_trigger_bucket_exists(monkeypatch, sftp_config, config, google_stora
     monkeypatch.setattr("main.SFTP", lambda *args, **kwargs: mock.MagicMock())
     monkeypatch.setattr("main.CaseMover", lambda *args, **kwargs: mock.MagicMock())
 
-    mock_instrument = mock.MagicMock()
+    instrument = Instrument(sftp_path="./ONS/TEST/TEST_INSTRUMENT", bdbx_size=17)
 
-    def mock_get_filtered(*args, **kwargs):
-        print("get_filtered_instruments called!")
-        return {"TEST_INSTRUMENT": mock_instrument}
+    def mock_iter_filtered(*args, **kwargs):
+        print("iter_filtered_instruments called!")
+        yield "TEST_INSTRUMENT", instrument
 
-    monkeypatch.setattr("main.get_filtered_instruments", mock_get_filtered)
-    monkeypatch.setattr("main.trigger_processor", lambda *args, **kwargs: None)
+    monkeypatch.setattr("main.iter_filtered_instruments", mock_iter_filtered)
+    monkeypatch.setattr("main.TriggerCheckpoint", mock.MagicMock)
 
     request = mock.MagicMock()
     request.get_json.return_value = {"survey": "TEST_SURVEY"}
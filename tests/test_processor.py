@@ -0,0 +1,188 @@
+import time
+from unittest import mock
+
+import pytest
+
+from models import Instrument, ProcessorEvent
+from pkg.deadline import Deadline, DeadlineExceeded
+from pkg.instrument_lease import LeaseHeld
+from processor import process_events, process_instrument, process_instruments
+
+
+@pytest.fixture
+def batch_case_mover(config):
+    case_mover = mock.MagicMock()
+    case_mover.config = config
+    channels = [mock.MagicMock(), mock.MagicMock()]
+
+    def map_on_sftp_channels(func, items, workers):
+        return [func(channels[index % 2], item) for index, item in enumerate(items)]
+
+    case_mover.map_on_sftp_channels.side_effect = map_on_sftp_channels
+    case_mover.channels = channels
+    return case_mover
+
+
+def events(*names):
+    return [
+        ProcessorEvent(instrument_name=name, instrument=Instrument(sftp_path=name))
+        for name in names
+    ]
+
+
+@mock.patch("processor.process_instrument")
+def test_process_instruments(mock_process_instrument, batch_case_mover, config):
+    config.processor_batch_concurrency = 3
+
+    process_instruments(batch_case_mover, events("OPN2101A", "OPN2102A"))
+
+    assert batch_case_mover.map_on_sftp_channels.call_args[0][2] == 3
+    batch_case_mover.for_sftp_connection.assert_has_calls(
+        [mock.call(channel) for channel in batch_case_mover.channels]
+    )
+    assert [call.args[1] for call in mock_process_instrument.call_args_list] == [
+        "OPN2101A",
+        "OPN2102A",
+    ]
+
+
+@mock.patch("processor.process_instrument")
+def test_process_instruments_raises_after_trying_every_instrument(
+    mock_process_instrument, batch_case_mover
+):
+    mock_process_instrument.side_effect = [
+        Exception("boom"),
+        None,
+        Exception("boom"),
+    ]
+
+    with pytest.raises(
+        Exception, match="Failed to process instruments: OPN2101A, OPN2103A"
+    ):
+        process_instruments(
+            batch_case_mover, events("OPN2101A", "OPN2102A", "OPN2103A")
+        )
+
+    assert mock_process_instrument.call_count == 3
+
+
+@mock.patch("processor.process_instrument")
+def test_process_instruments_returns_instruments_out_of_time(
+    mock_process_instrument, batch_case_mover
+):
+    mock_process_instrument.side_effect = [
+        None,
+        DeadlineExceeded("Not starting instrument OPN2102A"),
+        DeadlineExceeded("Not starting instrument OPN2103A"),
+    ]
+
+    unfinished = process_instruments(
+        batch_case_mover, events("OPN2101A", "OPN2102A", "OPN2103A")
+    )
+
+    assert [event.instrument_name for event in unfinished] == ["OPN2102A", "OPN2103A"]
+
+
+@mock.patch("processor.process_instrument")
+def test_process_events_returns_single_instrument_out_of_time(
+    mock_process_instrument, batch_case_mover
+):
+    mock_process_instrument.side_effect = DeadlineExceeded("Not starting")
+    processor_events = events("OPN2101A")
+
+    assert process_events(batch_case_mover, processor_events) == processor_events
+    batch_case_mover.map_on_sftp_channels.assert_not_called()
+
+
+@pytest.fixture
+def mock_lease():
+    with mock.patch("processor.InstrumentLease") as lease_class:
+        lease = lease_class.return_value
+        lease.processed.return_value = False
+        lease.acquire.return_value = True
+        yield lease
+
+
+def test_process_instrument_skips_instrument_already_processed(mock_lease):
+    case_mover = mock.MagicMock()
+    mock_lease.processed.return_value = True
+
+    process_instrument(case_mover, "OPN2101A", Instrument(sftp_path="OPN2101A"))
+
+    mock_lease.acquire.assert_not_called()
+    case_mover.load_bucket_index.assert_not_called()
+
+
+def test_process_instrument_skips_instrument_leased_elsewhere(mock_lease):
+    case_mover = mock.MagicMock()
+    mock_lease.acquire.return_value = False
+
+    process_instrument(case_mover, "OPN2101A", Instrument(sftp_path="OPN2101A"))
+
+    case_mover.load_bucket_index.assert_not_called()
+    mock_lease.release.assert_not_called()
+
+
+@mock.patch("processor.time.sleep")
+def test_process_instrument_waits_for_a_lease_held_for_another_database(
+    mock_sleep, mock_lease
+):
+    case_mover = mock.MagicMock()
+    mock_lease.acquire.side_effect = [
+        LeaseHeld("_leases/opn2101a", "older-md5", time.time() + 3),
+        True,
+    ]
+
+    process_instrument(case_mover, "OPN2101A", Instrument(sftp_path="OPN2101A"))
+
+    mock_sleep.assert_called_once()
+    assert 0 < mock_sleep.call_args.args[0] <= 3
+    case_mover.load_bucket_index.assert_called_once()
+    mock_lease.release.assert_called_once_with()
+
+
+@mock.patch("processor.time.sleep")
+def test_process_events_hands_back_when_a_lease_outlasts_the_deadline(
+    mock_sleep, mock_lease
+):
+    case_mover = mock.MagicMock()
+    mock_lease.acquire.side_effect = LeaseHeld(
+        "_leases/opn2101a", "older-md5", time.time() + 120
+    )
+    events = [
+        ProcessorEvent(
+            instrument_name="OPN2101A", instrument=Instrument(sftp_path="OPN2101A")
+        )
+    ]
+
+    unfinished = process_events(
+        case_mover, events, Deadline(timeout=60, margin=30, transfer_rate=1)
+    )
+
+    assert unfinished == events
+    mock_sleep.assert_not_called()
+    case_mover.load_bucket_index.assert_not_called()
+
+
+def test_process_instrument_marks_instrument_processed(mock_lease):
+    case_mover = mock.MagicMock()
+    case_mover.instrument_needs_updating.return_value = True
+    case_mover.sync_instrument.return_value = True
+    case_mover.send_request_to_api.return_value = True
+
+    process_instrument(case_mover, "OPN2101A", Instrument(sftp_path="OPN2101A"))
+
+    mock_lease.mark_processed.assert_called_once_with()
+    mock_lease.release.assert_called_once_with()
+
+
+def test_process_instrument_releases_lease_after_failed_sync(mock_lease):
+    case_mover = mock.MagicMock()
+    case_mover.instrument_needs_updating.return_value = True
+    case_mover.sync_instrument.side_effect = DeadlineExceeded("Not starting")
+
+    with pytest.raises(DeadlineExceeded):
+        process_instrument(case_mover, "OPN2101A", Instrument(sftp_path="OPN2101A"))
+
+    mock_lease.mark_processed.assert_not_called()
+    mock_lease.release.assert_called_once_with()
@@ -1,10 +1,12 @@
 import logging
+import threading
 from unittest import mock
 
 import paramiko
+import pytest
 
 from pkg.sftp import SFTPConfig
-from util.sftp_connection import sftp_connection
+from util.sftp_connection import SFTPConnectionPool, sftp_connection
 
 
 def test_sftp_connection(caplog, monkeypatch):
@@ -41,3 +43,117 @@ def test_sftp_connection(caplog, monkeypatch):
     mock_ssh.set_missing_host_key_policy.assert_called()
     policy = mock_ssh.set_missing_host_key_policy.call_args[0][0]
     assert isinstance(policy, paramiko.AutoAddPolicy)
+
+
+@pytest.fixture
+def ssh_connections():
+    connections = []
+
+    def connect_ssh(sftp_config):
+        connections.append(mock.MagicMock())
+        return connections[-1]
+
+    with mock.patch("util.sftp_connection.connect_ssh", side_effect=connect_ssh):
+        yield connections
+
+
+@pytest.fixture
+def pool_sftp_config():
+    return SFTPConfig("localhost", "user", "pass", 22)
+
+
+def test_pool_reuses_connection(ssh_connections, pool_sftp_config):
+    pool = SFTPConnectionPool()
+
+    with pool.connection(pool_sftp_config):
+        pass
+    with pool.connection(pool_sftp_config):
+        pass
+
+    assert len(ssh_connections) == 1
+    ssh = ssh_connections[0]
+    assert ssh.open_sftp.call_count == 2
+    # each SFTP session is closed when it is returned
+    assert ssh.open_sftp.return_value.__exit__.call_count == 2
+    ssh.get_transport.return_value.send_ignore.assert_called_once()
+    ssh.close.assert_not_called()
+
+
+def test_pool_drops_connections_idle_too_long(ssh_connections, pool_sftp_config):
+    pool = SFTPConnectionPool(max_idle_seconds=-1)
+
+    with pool.connection(pool_sftp_config):
+        pass
+    with pool.connection(pool_sftp_config):
+        pass
+
+    assert len(ssh_connections) == 2
+    ssh_connections[0].close.assert_called_once()
+
+
+def test_pool_drops_connections_failing_keepalive(ssh_connections, pool_sftp_config):
+    pool = SFTPConnectionPool()
+
+    with pool.connection(pool_sftp_config):
+        transport = ssh_connections[0].get_transport.return_value
+        transport.send_ignore.side_effect = EOFError
+    with pool.connection(pool_sftp_config):
+        pass
+
+    assert len(ssh_connections) == 2
+    ssh_connections[0].close.assert_called_once()
+
+
+def test_pool_reconnects_when_pooled_session_cannot_open(
+    ssh_connections, pool_sftp_config
+):
+    pool = SFTPConnectionPool()
+
+    with pool.connection(pool_sftp_config):
+        ssh_connections[0].open_sftp.side_effect = paramiko.SSHException("gone")
+    with pool.connection(pool_sftp_config):
+        pass
+
+    assert len(ssh_connections) == 2
+    ssh_connections[0].close.assert_called_once()
+
+
+def test_pool_discards_connection_after_an_error(ssh_connections, pool_sftp_config):
+    pool = SFTPConnectionPool()
+
+    with pytest.raises(OSError):
+        with pool.connection(pool_sftp_config):
+            raise OSError("Socket is closed")
+    with pool.connection(pool_sftp_config):
+        pass
+
+    assert len(ssh_connections) == 2
+    ssh_connections[0].close.assert_called_once()
+
+
+def test_pool_limits_open_connections(ssh_connections, pool_sftp_config):
+    pool = SFTPConnectionPool(max_size=1)
+    checked_out = threading.Event()
+
+    def checkout():
+        with pool.connection(pool_sftp_config):
+            checked_out.set()
+
+    with pool.connection(pool_sftp_config):
+        waiting = threading.Thread(target=checkout)
+        waiting.start()
+        assert not checked_out.wait(0.1)
+
+    waiting.join(5)
+    assert checked_out.is_set()
+    assert len(ssh_connections) == 1
+
+
+def test_pool_close(ssh_connections, pool_sftp_config):
+    pool = SFTPConnectionPool()
+    with pool.connection(pool_sftp_config):
+        pass
+
+    pool.close()
+
+    ssh_connections[0].close.assert_called_once()
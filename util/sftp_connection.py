@@ -1,17 +1,15 @@
 import logging
+import threading
+import time
 from contextlib import contextmanager
-from typing import Generator
+from typing import Dict, Generator, List, Optional, Tuple
 
 import paramiko
 
 from pkg.sftp import SFTPConfig
 
 
-@contextmanager
-def sftp_connection(
-    sftp_config: SFTPConfig,
-) -> Generator[paramiko.SFTPClient, None, None]:
-
+def connect_ssh(sftp_config: SFTPConfig) -> paramiko.SSHClient:
     host = getattr(sftp_config, "host", "").lower()
 
     ssh = paramiko.SSHClient()
@@ -35,8 +33,121 @@ def sftp_connection(
     if transport:
         transport.set_keepalive(30)
 
+    return ssh
+
+
+@contextmanager
+def sftp_connection(
+    sftp_config: SFTPConfig,
+) -> Generator[paramiko.SFTPClient, None, None]:
+    ssh = connect_ssh(sftp_config)
     try:
         with ssh.open_sftp() as sftp:
             yield sftp
     finally:
         ssh.close()
+
+
+class SFTPConnectionPool:
+    """SSH connections kept open between invocations of a warm instance.
+
+    Each checkout gets a new SFTP session on a pooled connection. Idle
+    connections are dropped once they are older than `max_idle_seconds` or
+    fail a keepalive probe, and at most `max_size` connections are open at
+    once; further checkouts wait for one to be returned.
+    """
+
+    def __init__(self, max_size: int = 4, max_idle_seconds: float = 300) -> None:
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self._idle: Dict[
+            Tuple[str, str, str], List[Tuple[paramiko.SSHClient, float]]
+        ] = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    @contextmanager
+    def connection(
+        self, sftp_config: SFTPConfig
+    ) -> Generator[paramiko.SFTPClient, None, None]:
+        key = self._key(sftp_config)
+        with self._slots:
+            ssh, sftp = self._checkout(key, sftp_config)
+            try:
+                with sftp:
+                    yield sftp
+            except BaseException:
+                # the connection may be what failed, don't hand it out again
+                ssh.close()
+                raise
+            self._checkin(key, ssh)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for ssh, _ in connections:
+                ssh.close()
+
+    @staticmethod
+    def _key(sftp_config: SFTPConfig) -> Tuple[str, str, str]:
+        return (sftp_config.host.lower(), str(sftp_config.port), sftp_config.username)
+
+    def _checkout(
+        self, key: Tuple[str, str, str], sftp_config: SFTPConfig
+    ) -> Tuple[paramiko.SSHClient, paramiko.SFTPClient]:
+        while True:
+            ssh = self._take_idle(key)
+            if ssh is None:
+                break
+            try:
+                logging.info(f"Reusing pooled SFTP connection to {key[0]}")
+                return ssh, ssh.open_sftp()
+            except (paramiko.SSHException, OSError, EOFError) as e:
+                logging.info(f"Discarding pooled SFTP connection to {key[0]}: {e}")
+                ssh.close()
+
+        ssh = connect_ssh(sftp_config)
+        try:
+            return ssh, ssh.open_sftp()
+        except BaseException:
+            ssh.close()
+            raise
+
+    def _take_idle(self, key: Tuple[str, str, str]) -> Optional[paramiko.SSHClient]:
+        while True:
+            with self._lock:
+                connections = self._idle.get(key)
+                if not connections:
+                    return None
+                ssh, returned_at = connections.pop()
+            if self._healthy(ssh, returned_at):
+                return ssh
+            ssh.close()
+
+    def _healthy(self, ssh: paramiko.SSHClient, returned_at: float) -> bool:
+        if time.monotonic() - returned_at > self.max_idle_seconds:
+            return False
+        transport = ssh.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except (paramiko.SSHException, OSError, EOFError):
+            return False
+        return transport.is_active()
+
+    def _checkin(self, key: Tuple[str, str, str], ssh: paramiko.SSHClient) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append((ssh, time.monotonic()))
+
+
+_pool = SFTPConnectionPool()
+
+
+@contextmanager
+def pooled_sftp_connection(
+    sftp_config: SFTPConfig,
+) -> Generator[paramiko.SFTPClient, None, None]:
+    with _pool.connection(sftp_config) as sftp:
+        yield sftp